@@ -1,5 +1,5 @@
 import discord
-import random
+import abc
 import os
 import traceback
 import re
@@ -9,17 +9,69 @@ import configparser
 import datetime
 import uuid
 import sqlite3
+import urllib.request
 import copy
+import time
+import threading
+import asyncio
+import functools
+import concurrent.futures
+import multiprocessing
+import migrate
+import odds
+from collections import OrderedDict
 from discord.ext import commands
 from datetime import datetime, timedelta, timezone
 
 PREFIX = '$'
 
+DATABASE_FILE = 'cortexpal.db'
+DATABASE_BACKEND = 'sqlite'
+DATABASE_SHARED = False
+DATABASE_BUSY_TIMEOUT_MS = 5000
+DATABASE_READERS = 2
+DATABASE_SYNCHRONOUS = 'FULL'
+DATABASE_CHECKPOINT_PAGES = 1000
+SYNCHRONOUS_SETTINGS = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+DATABASE_BACKENDS = ['sqlite', 'memory']
+
 PURGE_DAYS = 180
+PURGE_INTERVAL_HOURS = 24
+PURGE_CHUNK_SIZE = 100
+PURGE_CHUNK_BUDGET_MS = 50
+
+GAME_CACHE_SIZE = 1000
+OPTION_CACHE_SIZE = 10000
+
+SHARD_COUNT = None
+SHARD_IDS = None
+SHARDED = False
+PARSE_CACHE_SIZE = 256
+
+ACTIVITY_FLUSH_MINUTES = 5
+ACTIVITY_RESOLUTION = timedelta(hours=1)
+
+ROLL_STATS_FLUSH_MINUTES = 5
+
+PIN_UPDATE_SECONDS = 1
+
+MESSAGE_LIMIT = 2000
 
 DICE_EXPRESSION = re.compile('(\d*(d|D))?(4|6|8|10|12)')
 DIE_SIZES = [4, 6, 8, 10, 12]
 
+ENTROPY_BLOCK_SIZE = 4096
+
+ROLL_MAX_DICE = 10000
+ROLL_DETAIL_DICE = 50
+ODDS_MAX_DICE = 30
+
+SIM_TRIALS = 10000
+SIM_MAX_TRIALS = 1000000
+SIM_CHUNK_SIZE = 5000
+SIM_BUDGET_SECONDS = 10
+SIM_WORKERS = None
+
 UNTYPED_STRESS = 'General'
 
 ADD_SYNONYMS = ['add', 'give', 'new', 'create']
@@ -27,10 +79,12 @@ REMOVE_SYNOYMS = ['remove', 'spend', 'delete', 'subtract']
 UP_SYNONYMS = ['stepup', 'up']
 DOWN_SYNONYMS = ['stepdown', 'down']
 CLEAR_SYNONYMS = ['clear', 'erase']
+VERSUS_SYNONYMS = ['vs', 'versus', 'beat']
 
 DIE_FACE_ERROR = '{0} is not a valid die size. You may only use dice with sizes of 4, 6, 8, 10, or 12.'
 DIE_STRING_ERROR = '{0} is not a valid die or dice.'
 DIE_EXCESS_ERROR = 'You can\'t use that many dice.'
+TRIALS_EXCESS_ERROR = 'You may simulate at most {0} rolls.'
 DIE_MISSING_ERROR = 'There were no valid dice in that command.'
 DIE_LACK_ERROR = 'That pool only has {0}D{1}.'
 DIE_NONE_ERROR = 'That pool doesn\'t have any D{0}s.'
@@ -41,6 +95,8 @@ INSTRUCTION_ERROR = '`{0}` is not a valid instruction for the `{1}` command.'
 UNKNOWN_COMMAND_ERROR = 'That\'s not a valid command.'
 JOIN_ERROR = 'The #{0} channel does not allow other channels to join. Future commands apply only to this channel.'
 UNEXPECTED_ERROR = 'Oops. A software error interrupted this command.'
+BATCH_LINE_ERROR = 'Line {0} (`{1}`): {2}\nNothing in the batch was changed.'
+BATCH_EMPTY_ERROR = 'There were no commands in that batch.'
 
 PREFIX_OPTION = 'prefix'
 BEST_OPTION = 'best'
@@ -56,58 +112,51 @@ SHUTDOWN_TEXT = '**Warning:** Due to technical changes at Discord, this version
 config = configparser.ConfigParser()
 config.read('cortexpal.ini')
 
-# Set up logging.
-
-logHandler = logging.handlers.TimedRotatingFileHandler(filename=config['logging']['file'], when='D', backupCount=9)
-logging.basicConfig(handlers=[logHandler], format='%(asctime)s %(message)s', level=logging.INFO)
-
-# Set up database.
-
-db = sqlite3.connect(config['database']['file'])
-db.row_factory = sqlite3.Row
-cursor = db.cursor()
-
-cursor.execute(
-'CREATE TABLE IF NOT EXISTS GAME'
-'(GUID VARCHAR(32) PRIMARY KEY,'
-'SERVER INT NOT NULL,'
-'CHANNEL INT NOT NULL,'
-'ACTIVITY DATETIME NOT NULL)'
-)
-
-cursor.execute(
-'CREATE TABLE IF NOT EXISTS GAME_OPTIONS'
-'(GUID VARCHAR(32) PRIMARY KEY,'
-'KEY VARCHAR(16) NOT NULL,'
-'VALUE VARCHAR(256),'
-'PARENT_GUID VARCHAR(32) NOT NULL)'
-)
-
-cursor.execute(
-'CREATE TABLE IF NOT EXISTS DIE'
-'(GUID VARCHAR(32) PRIMARY KEY,'
-'NAME VARCHAR(64),'
-'SIZE INT NOT NULL,'
-'QTY INT NOT NULL,'
-'PARENT_GUID VARCHAR(32) NOT NULL)'
-)
-
-cursor.execute(
-'CREATE TABLE IF NOT EXISTS DICE_COLLECTION'
-'(GUID VARCHAR(32) PRIMARY KEY,'
-'CATEGORY VARCHAR(64) NOT NULL,'
-'GRP VARCHAR(64),'
-'PARENT_GUID VARCHAR(32) NOT NULL)'
-)
-
-cursor.execute(
-'CREATE TABLE IF NOT EXISTS RESOURCE'
-'(GUID VARCHAR(32) PRIMARY KEY,'
-'CATEGORY VARCHAR(64) NOT NULL,'
-'NAME VARCHAR(64) NOT NULL,'
-'QTY INT NOT NULL,'
-'PARENT_GUID VARCHAR(64) NOT NULL)'
-)
+if 'database' in config:
+    DATABASE_FILE = config['database'].get('file', DATABASE_FILE)
+    DATABASE_BACKEND = config['database'].get('backend', DATABASE_BACKEND).lower()
+    DATABASE_SHARED = config['database'].getboolean('shared', DATABASE_SHARED)
+    DATABASE_BUSY_TIMEOUT_MS = config['database'].getint('busy_timeout', DATABASE_BUSY_TIMEOUT_MS)
+    DATABASE_READERS = config['database'].getint('readers', DATABASE_READERS)
+    DATABASE_SYNCHRONOUS = config['database'].get('synchronous', DATABASE_SYNCHRONOUS).upper()
+    DATABASE_CHECKPOINT_PAGES = config['database'].getint('checkpoint', DATABASE_CHECKPOINT_PAGES)
+if DATABASE_BACKEND not in DATABASE_BACKENDS:
+    raise ValueError('The database backend must be one of {0}.'.format(', '.join(DATABASE_BACKENDS)))
+if DATABASE_SYNCHRONOUS not in SYNCHRONOUS_SETTINGS:
+    raise ValueError('The database synchronous setting must be one of {0}.'.format(', '.join(SYNCHRONOUS_SETTINGS)))
+
+if 'purge' in config:
+    PURGE_DAYS = config['purge'].getint('days', PURGE_DAYS)
+    PURGE_INTERVAL_HOURS = config['purge'].getfloat('interval', PURGE_INTERVAL_HOURS)
+    PURGE_CHUNK_SIZE = config['purge'].getint('chunk', PURGE_CHUNK_SIZE)
+    PURGE_CHUNK_BUDGET_MS = config['purge'].getint('budget', PURGE_CHUNK_BUDGET_MS)
+
+if 'dice' in config:
+    ROLL_MAX_DICE = config['dice'].getint('max', ROLL_MAX_DICE)
+    ROLL_DETAIL_DICE = config['dice'].getint('detail', ROLL_DETAIL_DICE)
+    ODDS_MAX_DICE = config['dice'].getint('odds', ODDS_MAX_DICE)
+
+if 'sim' in config:
+    SIM_TRIALS = config['sim'].getint('trials', SIM_TRIALS)
+    SIM_MAX_TRIALS = config['sim'].getint('max', SIM_MAX_TRIALS)
+    SIM_CHUNK_SIZE = config['sim'].getint('chunk', SIM_CHUNK_SIZE)
+    SIM_BUDGET_SECONDS = config['sim'].getfloat('budget', SIM_BUDGET_SECONDS)
+    SIM_WORKERS = config['sim'].getint('workers', SIM_WORKERS)
+
+if 'shards' in config:
+    SHARDED = True
+    SHARD_COUNT = config['shards'].getint('count', SHARD_COUNT)
+    if config['shards'].get('ids'):
+        SHARD_IDS = [int(shard_id) for shard_id in config['shards']['ids'].split(',')]
+        # Discord only lets a bot choose which shards to run if it also says how many there are.
+        if SHARD_COUNT is None:
+            raise ValueError('The shards section must set a count to go with its ids.')
+        if any(shard_id < 0 or shard_id >= SHARD_COUNT for shard_id in SHARD_IDS):
+            raise ValueError('Every shard id must be at least 0 and less than the shard count of {0}.'.format(SHARD_COUNT))
+
+if 'cache' in config:
+    GAME_CACHE_SIZE = config['cache'].getint('games', GAME_CACHE_SIZE)
+    OPTION_CACHE_SIZE = config['cache'].getint('options', OPTION_CACHE_SIZE)
 
 # Classes and functions follow.
 
@@ -121,90 +170,921 @@ class CortexError(Exception):
     def __str__(self):
         return self.message.format(*(self.args))
 
-def get_prefix(bot, message):
-    game_info = CortexGame(None, message.guild.id, message.channel.id)
-    prefix = game_info.get_option(PREFIX_OPTION)
+class Storage(abc.ABC):
+    """
+    The interface to wherever games are kept. Every method runs on the database thread, except where noted, and the database thread wraps each command in a transaction with begin(), then commit() or rollback().
+
+    Rows come back as mappings from upper-case column names to values, like the columns of the SQLite tables. A backend must implement every abstract method, or it can't be created.
+    """
+
+    # Whether other processes may change the stored games at any time.
+    shared = False
+    # Whether reader threads, with connect_reader(), may look things up while the database thread writes.
+    concurrent_reads = False
+
+    def connect(self):
+        """Get ready for work on the database thread."""
+
+    def connect_reader(self):
+        """Get ready for lookups on a reader thread."""
+
+    def close(self):
+        """Release everything. This runs on the database thread after the reader threads have stopped."""
+
+    def begin(self):
+        """Start a transaction."""
+
+    @abc.abstractmethod
+    def commit(self):
+        """Make everything since the transaction started permanent."""
+
+    @abc.abstractmethod
+    def rollback(self):
+        """Undo everything since the transaction started."""
+
+    @abc.abstractmethod
+    def changes(self):
+        """Return a count of changed rows, which grows with every change."""
+
+    def refresh(self):
+        """Return a number that changes whenever another process has changed the stored games. Anything remembered along with an older number may be out of date."""
+
+        return 0
+
+    def reader_version(self):
+        """Return a number that changes whenever anyone, in this process or another, commits a change to the stored games. This runs on a reader thread."""
+
+        return 0
+
+    @abc.abstractmethod
+    def find_game(self, server, channel):
+        """Return the row for the game in a server and channel, or None if there isn't one."""
+
+    @abc.abstractmethod
+    def insert_game(self, guid, server, channel, activity):
+        """Store a new, empty game."""
+
+    @abc.abstractmethod
+    def game_version(self, guid):
+        """Return how many times a game has been changed, or None if it no longer exists."""
+
+    @abc.abstractmethod
+    def bump_game_version(self, guid):
+        """Count one more change to a game."""
+
+    @abc.abstractmethod
+    def record_activity(self, activity):
+        """Record when each game was last used, given a dictionary of times by game guid."""
+
+    @abc.abstractmethod
+    def purge_games(self, purge_time, limit):
+        """Delete up to a given number of games unused since a given time, along with everything that belongs to them. Return the server and channel of each one."""
+
+    @abc.abstractmethod
+    def fetch_options(self, server, channel):
+        """Return a dictionary of the options set for the game in a server and channel. This may also run on a reader thread."""
+
+    @abc.abstractmethod
+    def insert_option(self, guid, key, value, game_guid):
+        """Store an option that a game hasn't set before."""
+
+    @abc.abstractmethod
+    def update_option(self, game_guid, key, value):
+        """Change an option that a game has already set."""
+
+    @abc.abstractmethod
+    def fetch_game_rows(self, game_guid, collection_categories, resource_categories):
+        """Return the rows for a game's dice collections in some categories, for the dice in those collections, and for its resources in some categories, each in the order they were created."""
+
+    @abc.abstractmethod
+    def find_collection(self, game_guid, category, group):
+        """Return the guid of a game's dice collection with a given category and group, or None if there isn't one."""
+
+    @abc.abstractmethod
+    def insert_collection(self, guid, category, group, game_guid):
+        """Store a new, empty dice collection."""
+
+    @abc.abstractmethod
+    def delete_collection(self, guid):
+        """Delete a dice collection, along with its dice."""
+
+    @abc.abstractmethod
+    def fetch_dice(self, collection_guid):
+        """Return the rows for the dice in a collection."""
+
+    @abc.abstractmethod
+    def insert_die(self, guid, name, size, qty, collection_guid):
+        """Store a new die in a collection."""
+
+    @abc.abstractmethod
+    def update_die_size(self, guid, size):
+        """Change the size of a die."""
+
+    @abc.abstractmethod
+    def update_die_qty(self, guid, qty):
+        """Change the quantity of a die."""
+
+    @abc.abstractmethod
+    def delete_die(self, guid):
+        """Delete a die."""
+
+    @abc.abstractmethod
+    def insert_resource(self, guid, category, name, qty, game_guid):
+        """Store a new resource."""
+
+    @abc.abstractmethod
+    def update_resource_qty(self, guid, qty):
+        """Change the quantity of a resource."""
+
+    @abc.abstractmethod
+    def delete_resources(self, guids):
+        """Delete a list of resources."""
+
+    @abc.abstractmethod
+    def add_roll_stats(self, rows):
+        """Add to the count of rolls for each (server, size, face, rolls) row."""
+
+    @abc.abstractmethod
+    def read_roll_stats(self, server=None):
+        """Return (size, face, rolls) rows counting the rolls on one server, or on all of them. This may also run on a reader thread."""
+
+class SQLiteStorage(Storage):
+    """
+    Keeps games in an SQLite database file.
+
+    The database uses write-ahead logging, so reader threads, each with its own read-only connection, can look things up while the database thread writes.
+    """
+
+    concurrent_reads = True
+
+    def __init__(self, filename, shared=False, busy_timeout_ms=DATABASE_BUSY_TIMEOUT_MS, synchronous=DATABASE_SYNCHRONOUS, checkpoint_pages=DATABASE_CHECKPOINT_PAGES):
+        self.filename = filename
+        self.shared = shared
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.checkpoint_pages = checkpoint_pages
+        self.connection = None
+        self.data_version = None
+        self.generation = 0
+        # Each thread's own connection: the writable one on the database thread, and read-only ones on the reader threads.
+        self.local = threading.local()
+        self.reader_connections = []
+
+    def connect(self):
+        self.connection = sqlite3.connect(self.filename, timeout=self.busy_timeout_ms / 1000)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        # Write-ahead logging lets readers, in this process or others, keep reading while the writer writes.
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = {0}'.format(self.synchronous))
+        self.connection.execute('PRAGMA wal_autocheckpoint = {0}'.format(self.checkpoint_pages))
+        if self.shared:
+            self.data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+        self.local.connection = self.connection
+
+    def connect_reader(self):
+        uri = 'file:{0}?mode=ro'.format(urllib.request.pathname2url(os.path.abspath(self.filename)))
+        # The connection is only used on its own thread, until it's closed at shutdown.
+        connection = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        self.local.connection = connection
+        self.reader_connections.append(connection)
+
+    def close(self):
+        for connection in self.reader_connections:
+            connection.close()
+        # Fold the write-ahead log back into the database file.
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.connection.close()
+
+    def execute(self, sql, parameters=()):
+        """Execute a statement on the calling thread's connection, and return the cursor."""
+
+        return self.local.connection.execute(sql, parameters)
+
+    def begin(self):
+        if self.shared:
+            # Take the write lock up front, so that another process can't change what we read before we write.
+            self.connection.execute('BEGIN IMMEDIATE')
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def changes(self):
+        return self.connection.total_changes
+
+    def refresh(self):
+        if self.shared:
+            data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.generation += 1
+        return self.generation
+
+    def reader_version(self):
+        return self.execute('PRAGMA data_version').fetchone()[0]
+
+    def find_game(self, server, channel):
+        return self.execute('SELECT * FROM GAME WHERE SERVER=:server AND CHANNEL=:channel', {"server":server, "channel":channel}).fetchone()
+
+    def insert_game(self, guid, server, channel, activity):
+        self.execute('INSERT INTO GAME (GUID, SERVER, CHANNEL, ACTIVITY) VALUES (?, ?, ?, ?)', (guid, server, channel, activity))
+
+    def game_version(self, guid):
+        row = self.execute('SELECT VERSION FROM GAME WHERE GUID=:guid', {'guid':guid}).fetchone()
+        if not row:
+            return None
+        return row['VERSION']
+
+    def bump_game_version(self, guid):
+        self.execute('UPDATE GAME SET VERSION=VERSION+1 WHERE GUID=:guid', {'guid':guid})
+
+    def record_activity(self, activity):
+        self.connection.executemany('UPDATE GAME SET ACTIVITY=? WHERE GUID=?', [(activity[guid], guid) for guid in activity])
+
+    def purge_games(self, purge_time, limit):
+        purged_guids = []
+        purged_keys = []
+        cursor = self.execute('SELECT GUID, SERVER, CHANNEL FROM GAME WHERE ACTIVITY<:purge_time LIMIT :limit', {'purge_time':purge_time, 'limit':limit})
+        for row in cursor.fetchall():
+            purged_guids.append((row['GUID'],))
+            purged_keys.append((row['SERVER'], row['CHANNEL']))
+        self.connection.executemany('DELETE FROM GAME WHERE GUID=?', purged_guids)
+        return purged_keys
+
+    def fetch_options(self, server, channel):
+        fetched = {}
+        cursor = self.execute('SELECT GAME_OPTIONS.KEY, GAME_OPTIONS.VALUE FROM GAME_OPTIONS INNER JOIN GAME ON GAME_OPTIONS.PARENT_GUID=GAME.GUID WHERE GAME.SERVER=:server AND GAME.CHANNEL=:channel', {'server':server, 'channel':channel})
+        for row in cursor.fetchall():
+            fetched[row['KEY']] = row['VALUE']
+        return fetched
+
+    def insert_option(self, guid, key, value, game_guid):
+        self.execute('INSERT INTO GAME_OPTIONS (GUID, KEY, VALUE, PARENT_GUID) VALUES (?, ?, ?, ?)', (guid, key, value, game_guid))
+
+    def update_option(self, game_guid, key, value):
+        self.execute('UPDATE GAME_OPTIONS SET VALUE=:value where KEY=:key and PARENT_GUID=:game_guid', {'value':value, 'key':key, 'game_guid':game_guid})
+
+    def fetch_game_rows(self, game_guid, collection_categories, resource_categories):
+        collections = []
+        dice = []
+        resources = []
+        if collection_categories:
+            parameters = [game_guid] + collection_categories
+            in_list = ', '.join('?' * len(collection_categories))
+            collections = self.execute('SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=? AND CATEGORY IN ({0}) ORDER BY rowid'.format(in_list), parameters).fetchall()
+            dice = self.execute('SELECT DIE.* FROM DIE INNER JOIN DICE_COLLECTION ON DIE.PARENT_GUID=DICE_COLLECTION.GUID WHERE DICE_COLLECTION.PARENT_GUID=? AND DICE_COLLECTION.CATEGORY IN ({0}) ORDER BY DIE.rowid'.format(in_list), parameters).fetchall()
+        if resource_categories:
+            parameters = [game_guid] + resource_categories
+            in_list = ', '.join('?' * len(resource_categories))
+            resources = self.execute('SELECT * FROM RESOURCE WHERE PARENT_GUID=? AND CATEGORY IN ({0}) ORDER BY rowid'.format(in_list), parameters).fetchall()
+        return collections, dice, resources
+
+    def find_collection(self, game_guid, category, group):
+        if group:
+            cursor = self.execute('SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category AND GRP=:group', {'PARENT_GUID':game_guid, 'category':category, 'group':group})
+        else:
+            cursor = self.execute('SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category AND GRP IS NULL', {'PARENT_GUID':game_guid, 'category':category})
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return row['GUID']
+
+    def insert_collection(self, guid, category, group, game_guid):
+        self.execute('INSERT INTO DICE_COLLECTION (GUID, CATEGORY, GRP, PARENT_GUID) VALUES (?, ?, ?, ?)', (guid, category, group, game_guid))
+
+    def delete_collection(self, guid):
+        self.execute("DELETE FROM DICE_COLLECTION WHERE GUID=:db_guid", {'db_guid':guid})
+
+    def fetch_dice(self, collection_guid):
+        return self.execute('SELECT * FROM DIE WHERE PARENT_GUID=:PARENT_GUID', {'PARENT_GUID':collection_guid}).fetchall()
+
+    def insert_die(self, guid, name, size, qty, collection_guid):
+        self.execute('INSERT INTO DIE (GUID, NAME, SIZE, QTY, PARENT_GUID) VALUES (?, ?, ?, ?, ?)', (guid, name, size, qty, collection_guid))
+
+    def update_die_size(self, guid, size):
+        self.execute('UPDATE DIE SET SIZE=:size WHERE GUID=:guid', {'size':size, 'guid':guid})
+
+    def update_die_qty(self, guid, qty):
+        self.execute('UPDATE DIE SET QTY=:qty WHERE GUID=:guid', {'qty':qty, 'guid':guid})
+
+    def delete_die(self, guid):
+        self.execute('DELETE FROM DIE WHERE GUID=:guid', {'guid':guid})
+
+    def insert_resource(self, guid, category, name, qty, game_guid):
+        self.execute("INSERT INTO RESOURCE (GUID, CATEGORY, NAME, QTY, PARENT_GUID) VALUES (?, ?, ?, ?, ?)", (guid, category, name, qty, game_guid))
+
+    def update_resource_qty(self, guid, qty):
+        self.execute("UPDATE RESOURCE SET QTY=:qty WHERE GUID=:db_guid", {'qty':qty, 'db_guid':guid})
+
+    def delete_resources(self, guids):
+        self.connection.executemany("DELETE FROM RESOURCE WHERE GUID=:db_guid", [{'db_guid':guid} for guid in guids])
+
+    def add_roll_stats(self, rows):
+        self.connection.executemany('INSERT INTO ROLL_STATS (SERVER, SIZE, FACE, ROLLS) VALUES (?, ?, ?, ?) ON CONFLICT (SERVER, SIZE, FACE) DO UPDATE SET ROLLS=ROLLS+excluded.ROLLS', rows)
+
+    def read_roll_stats(self, server=None):
+        if server is None:
+            return self.execute('SELECT SIZE, FACE, SUM(ROLLS) FROM ROLL_STATS GROUP BY SIZE, FACE').fetchall()
+        return self.execute('SELECT SIZE, FACE, ROLLS FROM ROLL_STATS WHERE SERVER=:server', {'server':server}).fetchall()
+
+class MemoryStorage(Storage):
+    """
+    Keeps games in memory only, and loses them when the bot stops. This is meant for tests and benchmarks, to measure the game logic without any disk I/O.
+
+    Rows live in one dictionary per table, keyed by guid, along with which rows belong to which parent, so that deleting a row deletes its children as it would in SQLite. A transaction keeps a list of undo steps, so that it can be rolled back.
+    """
+
+    def __init__(self):
+        self.tables = {'GAME': {}, 'GAME_OPTIONS': {}, 'DICE_COLLECTION': {}, 'RESOURCE': {}, 'DIE': {}}
+        # The guids of the rows that belong to each parent, with each one's table.
+        self.children = {}
+        self.game_keys = {}
+        self.roll_stats = {}
+        self.next_rowid = 1
+        self.changed = 0
+        self.undo = []
+
+    def begin(self):
+        self.undo = []
+
+    def commit(self):
+        self.undo = []
+
+    def rollback(self):
+        for step in reversed(self.undo):
+            step()
+        self.undo = []
+
+    def changes(self):
+        return self.changed
+
+    def attach(self, rows):
+        """Put (table, row) pairs in place, parents before children."""
+
+        for table, row in rows:
+            self.tables[table][row['GUID']] = row
+            if row.get('PARENT_GUID'):
+                self.children.setdefault(row['PARENT_GUID'], {})[row['GUID']] = table
+            if table == 'GAME':
+                self.game_keys[(row['SERVER'], row['CHANNEL'])] = row['GUID']
+
+    def detach(self, table, guid):
+        """Take away a row and everything that belongs to it, and return the (table, row) pairs taken."""
+
+        row = self.tables[table].pop(guid, None)
+        if row is None:
+            return []
+        detached = [(table, row)]
+        if row.get('PARENT_GUID') in self.children:
+            self.children[row['PARENT_GUID']].pop(guid, None)
+        if table == 'GAME':
+            self.game_keys.pop((row['SERVER'], row['CHANNEL']), None)
+        for child, child_table in list(self.children.pop(guid, {}).items()):
+            detached += self.detach(child_table, child)
+        return detached
+
+    def insert(self, table, row):
+        """Add a row to a table, numbering it like an SQLite rowid."""
+
+        row['ROWID'] = self.next_rowid
+        self.next_rowid += 1
+        self.attach([(table, row)])
+        self.undo.append(functools.partial(self.detach, table, row['GUID']))
+        self.changed += 1
+
+    def delete(self, table, guid):
+        """Delete a row and everything that belongs to it."""
+
+        detached = self.detach(table, guid)
+        if detached:
+            self.undo.append(functools.partial(self.attach, detached))
+            self.changed += len(detached)
+
+    def update(self, table, guid, column, value):
+        """Change one column of a row."""
+
+        row = self.tables[table].get(guid)
+        if row:
+            self.undo.append(functools.partial(row.__setitem__, column, row[column]))
+            row[column] = value
+            self.changed += 1
+
+    def select(self, table, parent_guid, categories=None):
+        """Return the rows in a table that belong to a parent, optionally only in some categories, in the order they were created."""
+
+        rows = [self.tables[table][guid] for guid, child_table in self.children.get(parent_guid, {}).items() if child_table == table]
+        if categories is not None:
+            rows = [row for row in rows if row['CATEGORY'] in categories]
+        return sorted(rows, key=lambda row: row['ROWID'])
+
+    def find_game(self, server, channel):
+        guid = self.game_keys.get((server, channel))
+        if not guid:
+            return None
+        return self.tables['GAME'][guid]
+
+    def insert_game(self, guid, server, channel, activity):
+        # Store the time as text, the way SQLite does.
+        self.insert('GAME', {'GUID':guid, 'SERVER':server, 'CHANNEL':channel, 'ACTIVITY':str(activity), 'VERSION':0})
+
+    def game_version(self, guid):
+        row = self.tables['GAME'].get(guid)
+        if not row:
+            return None
+        return row['VERSION']
+
+    def bump_game_version(self, guid):
+        row = self.tables['GAME'].get(guid)
+        if row:
+            self.update('GAME', guid, 'VERSION', row['VERSION'] + 1)
+
+    def record_activity(self, activity):
+        for guid in activity:
+            self.update('GAME', guid, 'ACTIVITY', str(activity[guid]))
+
+    def purge_games(self, purge_time, limit):
+        purged = [row for row in self.tables['GAME'].values() if parse_activity(row['ACTIVITY']) < purge_time][:limit]
+        for row in purged:
+            self.delete('GAME', row['GUID'])
+        return [(row['SERVER'], row['CHANNEL']) for row in purged]
+
+    def fetch_options(self, server, channel):
+        guid = self.game_keys.get((server, channel))
+        return {row['KEY']:row['VALUE'] for row in self.select('GAME_OPTIONS', guid)}
+
+    def insert_option(self, guid, key, value, game_guid):
+        self.insert('GAME_OPTIONS', {'GUID':guid, 'KEY':key, 'VALUE':value, 'PARENT_GUID':game_guid})
+
+    def update_option(self, game_guid, key, value):
+        for row in self.select('GAME_OPTIONS', game_guid):
+            if row['KEY'] == key:
+                self.update('GAME_OPTIONS', row['GUID'], 'VALUE', value)
+
+    def fetch_game_rows(self, game_guid, collection_categories, resource_categories):
+        collections = self.select('DICE_COLLECTION', game_guid, collection_categories)
+        dice = sorted((die for collection in collections for die in self.select('DIE', collection['GUID'])), key=lambda row: row['ROWID'])
+        resources = self.select('RESOURCE', game_guid, resource_categories)
+        return collections, dice, resources
+
+    def find_collection(self, game_guid, category, group):
+        for row in self.select('DICE_COLLECTION', game_guid, [category]):
+            if row['GRP'] == group:
+                return row['GUID']
+        return None
+
+    def insert_collection(self, guid, category, group, game_guid):
+        self.insert('DICE_COLLECTION', {'GUID':guid, 'CATEGORY':category, 'GRP':group, 'PARENT_GUID':game_guid})
+
+    def delete_collection(self, guid):
+        self.delete('DICE_COLLECTION', guid)
+
+    def fetch_dice(self, collection_guid):
+        return self.select('DIE', collection_guid)
+
+    def insert_die(self, guid, name, size, qty, collection_guid):
+        self.insert('DIE', {'GUID':guid, 'NAME':name, 'SIZE':size, 'QTY':qty, 'PARENT_GUID':collection_guid})
+
+    def update_die_size(self, guid, size):
+        self.update('DIE', guid, 'SIZE', size)
+
+    def update_die_qty(self, guid, qty):
+        self.update('DIE', guid, 'QTY', qty)
+
+    def delete_die(self, guid):
+        self.delete('DIE', guid)
+
+    def insert_resource(self, guid, category, name, qty, game_guid):
+        self.insert('RESOURCE', {'GUID':guid, 'CATEGORY':category, 'NAME':name, 'QTY':qty, 'PARENT_GUID':game_guid})
+
+    def update_resource_qty(self, guid, qty):
+        self.update('RESOURCE', guid, 'QTY', qty)
+
+    def delete_resources(self, guids):
+        for guid in guids:
+            self.delete('RESOURCE', guid)
+
+    def add_roll_stats(self, rows):
+        for server, size, face, rolls in rows:
+            key = (server, size, face)
+            self.undo.append(functools.partial(self.roll_stats.__setitem__, key, self.roll_stats.get(key, 0)))
+            self.roll_stats[key] = self.roll_stats.get(key, 0) + rolls
+            self.changed += 1
+
+    def read_roll_stats(self, server=None):
+        totals = {}
+        for (row_server, size, face), rolls in self.roll_stats.items():
+            if server is None or row_server == server:
+                totals[(size, face)] = totals.get((size, face), 0) + rolls
+        return [(size, face, rolls) for (size, face), rolls in totals.items()]
+
+class Database:
+    """
+    Runs all work with stored games on a dedicated worker thread, so that a slow disk never stalls the bot's event loop.
+
+    If the storage allows it, a small pool of reader threads can answer simple lookups while the worker thread is busy writing. Otherwise, lookups take their turn on the worker thread.
+    """
+
+    def __init__(self, storage, readers=DATABASE_READERS):
+        self.storage = storage
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        self.worker_thread = self.executor.submit(self.start_worker).result()
+        if self.storage.concurrent_reads:
+            self.readers = concurrent.futures.ThreadPoolExecutor(max_workers=readers, thread_name_prefix='database-reader', initializer=self.storage.connect_reader)
+        else:
+            self.readers = self.executor
+
+    def start_worker(self):
+        """Connect the storage on the worker thread, and return that thread."""
+
+        self.storage.connect()
+        return threading.current_thread()
+
+    def on_worker_thread(self):
+        """Identify whether the calling thread is the worker thread."""
+
+        return threading.current_thread() is self.worker_thread
+
+    @property
+    def shared(self):
+        return self.storage.shared
+
+    def commit(self):
+        """Commit the current transaction. Only call this on the worker thread."""
+
+        self.storage.commit()
+
+    def changes(self):
+        """Return the number of rows changed so far. Only call this on the worker thread."""
+
+        return self.storage.changes()
+
+    def refresh(self):
+        """Return a number that changes whenever another process has changed the stored games. Only call this on the worker thread."""
+
+        return self.storage.refresh()
+
+    def refresh_soon(self):
+        """Ask the worker thread to refresh, without waiting for it. Return a future for the result."""
+
+        return self.executor.submit(self.refresh)
+
+    def call_in_transaction(self, function, *args):
+        """Call a function, then commit everything it wrote, or roll it all back if it raises an exception."""
+
+        try:
+            self.storage.begin()
+            result = function(*args)
+        except:
+            self.storage.rollback()
+            raise
+        self.storage.commit()
+        return result
+
+    async def run(self, function, *args):
+        """Call a function on the worker thread, and wait for its result without blocking the event loop."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def read(self, function, *args):
+        """Call a function that only reads from the database on a reader thread, if the storage allows it, and wait for its result. The function sees everything committed before it started, and must not touch anything the worker thread changes."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, functools.partial(function, *args))
+
+    async def transact(self, function, *args):
+        """Call a function on the worker thread as a single transaction, and wait for its result."""
+
+        return await self.run(self.call_in_transaction, function, *args)
+
+    def transact_now(self, function, *args):
+        """Call a function on the worker thread as a single transaction, blocking until it finishes. Use this only when the event loop isn't running."""
+
+        return self.executor.submit(self.call_in_transaction, function, *args).result()
+
+    def close(self):
+        """Close the storage and stop the threads."""
+
+        if self.readers is not self.executor:
+            self.readers.shutdown()
+        self.executor.submit(self.storage.close).result()
+        self.executor.shutdown()
+
+def open_storage():
+    """Create the storage backend named in the configuration, upgrading the database's schema first if necessary."""
+
+    if DATABASE_BACKEND == 'memory':
+        return MemoryStorage()
+    migrate.upgrade(DATABASE_FILE)
+    return SQLiteStorage(DATABASE_FILE, DATABASE_SHARED, DATABASE_BUSY_TIMEOUT_MS, DATABASE_SYNCHRONOUS, DATABASE_CHECKPOINT_PAGES)
+
+# Where games are kept, and the database that runs work against it. The bot sets these up with start_storage() when it starts.
+storage = None
+database = None
+
+class OptionCache:
+    """Remembers the options for each server and channel, so that reading an option doesn't require the database. When it remembers too many channels, it forgets the channel that was used least recently."""
+
+    def __init__(self, max_channels):
+        self.max_channels = max_channels
+        self.options = OrderedDict()
+        self.generation = 0
+        # Counts the times we've forgotten options, so that a reader thread can tell whether what it fetched might be out of date.
+        self.forgotten = 0
+        self.lock = threading.Lock()
+        # What each reader thread last saw of a shared database.
+        self.local = threading.local()
+
+    def query(self, server, channel):
+        """Fetch the options for a server and channel from the database."""
+
+        return storage.fetch_options(server, channel)
+
+    def get_all(self, server, channel):
+        """Return the dictionary of options for a server and channel, fetching it from the database if necessary. Only call this on the database thread; the event loop must go through a transaction, and reader threads through read_all()."""
+
+        assert database.on_worker_thread(), 'Options may only be fetched on the database thread.'
+        self.catch_up(database.refresh())
+        options = self.recall(server, channel)
+        if options is None:
+            fetched = self.query(server, channel)
+            with self.lock:
+                options = self.remember((server, channel), fetched)
+        return options
+
+    def read_all(self, server, channel):
+        """
+        Return the dictionary of options for a server and channel, without waiting for the database thread. This runs on a reader thread, and the result must not be changed.
+
+        What the reader fetches is remembered only if nothing was forgotten in the meantime, and never replaces what the database thread has remembered. Another process may change the options of a shared database at any time, so those are fetched while the reader can't be sure that no other process has.
+        """
+
+        key = (server, channel)
+        if database.shared and not self.reader_caught_up():
+            return self.query(server, channel)
+        options = self.recall(server, channel)
+        if options is not None:
+            return options
+        forgotten = self.forgotten
+        fetched = self.query(server, channel)
+        with self.lock:
+            if forgotten == self.forgotten:
+                return self.remember(key, fetched)
+        return fetched
+
+    def recall(self, server, channel):
+        """Return the options we remember for a server and channel, or None if we don't remember them. This may run on any thread."""
+
+        key = (server, channel)
+        with self.lock:
+            options = self.options.get(key)
+            if options is not None:
+                self.options.move_to_end(key)
+        return options
+
+    def remember(self, key, options):
+        """Remember the options fetched for a server and channel, unless we already remember some, and return what we remember. Call this with the lock held."""
+
+        options = self.options.setdefault(key, options)
+        self.options.move_to_end(key)
+        while len(self.options) > self.max_channels:
+            self.options.popitem(last=False)
+        return options
+
+    def catch_up(self, generation):
+        """Forget every option if another process has changed the database since we last looked, given the database's latest generation."""
+
+        # If another process has written to the database, any of the options we remember may be out of date.
+        if generation > self.generation:
+            with self.lock:
+                if generation > self.generation:
+                    self.options = OrderedDict()
+                    self.generation = generation
+                    self.forgotten += 1
+
+    def reader_caught_up(self):
+        """
+        On a reader thread, tell whether the options we remember of a shared database can be trusted.
+
+        A reader's connection sees every commit, whether it came from this process or another, and only the database thread can tell them apart. So when a reader sees a commit, it asks the database thread to check, and doesn't trust what we remember until that check is done. Until someone commits again, the reader trusts it without any further queries.
+        """
+
+        local = self.local
+        version = storage.reader_version()
+        if version != getattr(local, 'version', None):
+            local.version = version
+            local.check = database.refresh_soon()
+        if not local.check.done():
+            return False
+        if local.check.exception():
+            # Check again next time.
+            local.version = None
+            return False
+        self.catch_up(local.check.result())
+        return True
+
+    def get(self, server, channel, key):
+        """Return the value of one option, or None if it has not been set."""
+
+        return self.get_all(server, channel).get(key)
+
+    def set(self, server, channel, key, value):
+        """Remember a new value for an option."""
+
+        self.get_all(server, channel)[key] = value
+
+    def forget(self, server, channel):
+        """Drop everything we remember about a server and channel."""
+
+        with self.lock:
+            self.options.pop((server, channel), None)
+            self.forgotten += 1
+
+def parse_activity(value):
+    """Convert an ACTIVITY value from the database to a UTC datetime."""
+
+    activity = datetime.fromisoformat(value)
+    if not activity.tzinfo:
+        activity = activity.replace(tzinfo=timezone.utc)
+    return activity
+
+class ActivityTracker:
+    """Remembers which games have been used recently, and records that in the database in bulk every few minutes."""
+
+    def __init__(self):
+        self.pending = {}
+
+    def touch(self, game):
+        """Note that a game is in use. Games whose recorded activity is already recent are skipped."""
+
+        now = datetime.now(timezone.utc)
+        if now - game.activity >= ACTIVITY_RESOLUTION:
+            game.activity = now
+            self.pending[game.db_guid] = now
+
+    def flush(self):
+        """Write all pending activity times to the database. This runs on the database thread."""
+
+        if self.pending:
+            pending = self.pending
+            self.pending = {}
+            storage.record_activity(pending)
+            logging.info('Recorded activity for %d games', len(pending))
+
+    async def run_forever(self):
+        """Flush pending activity times after every interval."""
+
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_MINUTES * 60)
+            try:
+                await database.transact(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except:
+                logging.error(traceback.format_exc())
+
+activity_tracker = ActivityTracker()
+
+async def get_prefix(bot, message):
+    option_cache = shards.get(message.guild.shard_id).options
+    options = None
+    # Another process may have changed the options of a shared database, so those must always be checked.
+    if not database.shared:
+        options = option_cache.recall(message.guild.id, message.channel.id)
+    if options is None:
+        options = await database.read(option_cache.read_all, message.guild.id, message.channel.id)
+    prefix = options.get(PREFIX_OPTION)
     if not prefix:
         prefix = '$'
     return prefix
 
-def separate_dice_and_name(inputs):
-    """Sort the words of an input string, and identify which are dice notations and which are not."""
+class ParsedArguments:
+    """The words of a command's arguments, sorted into dice, numbers, and names. Parsed arguments are shared through a cache, so treat them as read-only."""
 
-    dice = []
-    words = []
-    for input in inputs:
-        if DICE_EXPRESSION.fullmatch(input):
-            dice.append(Die(input))
-        else:
-            words.append(input.lower().capitalize())
-    return {'dice': dice, 'name': ' '.join(words)}
+    __slots__ = ('dice', 'numbers', 'name', 'name_head', 'name_tail', 'numbers_name')
 
-def separate_numbers_and_name(inputs):
-    """Sort the words of an input string, and identify which are numerals and which are not."""
+    def __init__(self, dice, numbers, name, numbers_name):
+        self.dice = dice
+        self.numbers = numbers
+        self.name = name
+        # The first word of the name, and the rest of it (or None), for commands that name an owner and then a trait.
+        split_name = name.split(' ', maxsplit=1)
+        self.name_head = split_name[0]
+        self.name_tail = split_name[1] if len(split_name) > 1 else None
+        self.numbers_name = numbers_name
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_arguments(inputs):
+    """
+    Classify each word of a command's arguments once, as a die notation, a number, or a word of a name.
+
+    The inputs must be a tuple. Dice come back as (size, quantity) pairs. The name leaves out the dice, and the numbers name leaves out the numbers.
+    """
 
+    dice = []
     numbers = []
     words = []
+    numbers_words = []
     for input in inputs:
+        word = input.lower().capitalize()
+        match = DICE_EXPRESSION.fullmatch(input)
+        if match:
+            qty = 1
+            if match.group(1) and len(match.group(1)) > 1:
+                qty = int(match.group(1)[:-1])
+            dice.append((int(match.group(3)), qty))
+        else:
+            words.append(word)
         if input.isdecimal():
             numbers.append(int(input))
         else:
-            words.append(input.lower().capitalize())
-    return {'numbers': numbers, 'name': ' '.join(words)}
+            numbers_words.append(word)
+    return ParsedArguments(tuple(dice), tuple(numbers), ' '.join(words), ' '.join(numbers_words))
+
+def separate_dice_and_name(inputs):
+    """Sort the words of an input string, and identify which are dice notations and which are not."""
+
+    parsed = parse_arguments(tuple(inputs))
+    return {'dice': [Die(size=size, qty=qty) for size, qty in parsed.dice], 'name': parsed.name}
+
+def separate_numbers_and_name(inputs):
+    """Sort the words of an input string, and identify which are numerals and which are not."""
+
+    parsed = parse_arguments(tuple(inputs))
+    return {'numbers': list(parsed.numbers), 'name': parsed.numbers_name}
 
 def fetch_all_dice_for_parent(db_parent):
     """Given an object from the database, get all the dice that belong to it."""
 
     dice = []
-    cursor.execute('SELECT * FROM DIE WHERE PARENT_GUID=:PARENT_GUID', {'PARENT_GUID':db_parent.db_guid})
-    fetching = True
-    while fetching:
-        row = cursor.fetchone()
-        if row:
+    for row in storage.fetch_dice(db_parent.db_guid):
+        die = Die(name=row['NAME'], size=row['SIZE'], qty=row['QTY'])
+        die.already_in_db(db_parent, row['GUID'])
+        dice.append(die)
+    return dice
+
+class GameRows:
+    """The stored rows for some or all of one game's traits, fetched in a fixed number of queries no matter how large the game is."""
+
+    def __init__(self, game_guid, collection_categories, resource_categories):
+        self.collections = {}
+        self.dice = {}
+        self.resources = {}
+        collection_rows, die_rows, resource_rows = storage.fetch_game_rows(game_guid, collection_categories, resource_categories)
+        for row in collection_rows:
+            self.collections.setdefault(row['CATEGORY'], []).append(row)
+        for row in die_rows:
+            self.dice.setdefault(row['PARENT_GUID'], []).append(row)
+        for row in resource_rows:
+            self.resources.setdefault(row['CATEGORY'], []).append(row)
+
+    def fetch_collections(self, category):
+        """Get the rows for all the dice collections in a category."""
+
+        return self.collections.get(category, [])
+
+    def find_collection(self, category, group):
+        """Get the guid of the dice collection with a given category and group, or None if there isn't one."""
+
+        for row in self.fetch_collections(category):
+            if row['GRP'] == group:
+                return row['GUID']
+        return None
+
+    def fetch_die_rows(self, db_parent):
+        """Get the rows for all the dice that belong to a given dice collection."""
+
+        return self.dice.get(db_parent.db_guid, [])
+
+    def fetch_dice(self, db_parent):
+        """Get all the dice that belong to a given dice collection."""
+
+        dice = []
+        for row in self.fetch_die_rows(db_parent):
             die = Die(name=row['NAME'], size=row['SIZE'], qty=row['QTY'])
             die.already_in_db(db_parent, row['GUID'])
             dice.append(die)
-        else:
-            fetching = False
-    return dice
+        return dice
 
-def purge():
-    """Scan for old unused games and remove them."""
+    def fetch_resources(self, category):
+        """Get the rows for all the resources in a category."""
 
-    logging.info('Running the purge')
-    purge_time = datetime.now(timezone.utc) - timedelta(days=PURGE_DAYS)
-    games_to_purge = []
-    cursor.execute('SELECT * FROM GAME WHERE ACTIVITY<:purge_time', {'purge_time':purge_time})
-    fetching = True
-    while fetching:
-        row = cursor.fetchone()
-        if row:
-            games_to_purge.append(row['GUID'])
-        else:
-            fetching = False
-    for game_guid in games_to_purge:
-        cursor.execute('DELETE FROM GAME_OPTIONS WHERE PARENT_GUID=:guid', {'guid':game_guid})
-        cursor.execute('SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:guid', {'guid':game_guid})
-        collections = []
-        fetching = True
-        while fetching:
-            row = cursor.fetchone()
-            if row:
-                collections.append(row['GUID'])
-            else:
-                fetching = False
-        for collection_guid in collections:
-            cursor.execute('DELETE FROM DIE WHERE PARENT_GUID=:guid', {'guid':collection_guid})
-        cursor.execute('DELETE FROM DIE WHERE PARENT_GUID=:guid', {'guid':game_guid})
-        cursor.execute('DELETE FROM DICE_COLLECTION WHERE PARENT_GUID=:guid', {'guid':game_guid})
-        cursor.execute('DELETE FROM RESOURCE WHERE PARENT_GUID=:guid', {'guid':game_guid})
-        cursor.execute('DELETE FROM GAME WHERE GUID=:guid', {'guid':game_guid})
-        db.commit()
-    logging.info('Deleted %d games', len(games_to_purge))
+        return self.resources.get(category, [])
+
+def purge(purge_time, limit):
+    """Remove up to a given number of games unused since a given time, along with everything that belongs to them. Return the server and channel of each purged game."""
+
+    return storage.purge_games(purge_time, limit)
 
 class Die:
     """A single die, or a set of dice of the same size."""
 
+    __slots__ = ('name', 'size', 'qty', 'db_parent', 'db_guid')
+
     def __init__(self, expression=None, name=None, size=4, qty=1):
         self.name = name
         self.size = size
@@ -227,8 +1107,7 @@ class Die:
 
         self.db_parent = db_parent
         self.db_guid = uuid.uuid1().hex
-        cursor.execute('INSERT INTO DIE (GUID, NAME, SIZE, QTY, PARENT_GUID) VALUES (?, ?, ?, ?, ?)', (self.db_guid, self.name, self.size, self.qty, self.db_parent.db_guid))
-        db.commit()
+        storage.insert_die(self.db_guid, self.name, self.size, self.qty, self.db_parent.db_guid)
 
     def already_in_db(self, db_parent, db_guid):
         """Inform the Die that it is already in the database, under a given parent and guid."""
@@ -240,8 +1119,7 @@ class Die:
         """Remove this Die from the database."""
 
         if self.db_guid:
-            cursor.execute('DELETE FROM DIE WHERE GUID=:guid', {'guid':self.db_guid})
-            db.commit()
+            storage.delete_die(self.db_guid)
 
     def step_down(self):
         """Step down the die size."""
@@ -268,15 +1146,14 @@ class Die:
 
         self.size = new_size
         if self.db_guid:
-            cursor.execute('UPDATE DIE SET SIZE=:size WHERE GUID=:guid', {'size':self.size, 'guid':self.db_guid})
-            db.commit()
+            storage.update_die_size(self.db_guid, self.size)
 
     def update_qty(self, new_qty):
         """Change the quantity of the dice."""
 
         self.qty = new_qty
         if self.db_guid:
-            cursor.execute('UPDATE DIE SET QTY=:qty WHERE GUID=:guid', {'qty':self.qty, 'guid':self.db_guid})
+            storage.update_die_qty(self.db_guid, self.qty)
 
     def is_max(self):
         """Identify whether the Die is at the maximum allowed size."""
@@ -299,36 +1176,37 @@ class Die:
 class NamedDice:
     """A collection of user-named single-die traits, suitable for complications and assets."""
 
-    def __init__(self, category, group, db_parent, db_guid=None):
+    __slots__ = ('dice', 'version', 'category', 'group', 'db_parent', 'db_guid')
+
+    def __init__(self, category, group, db_parent, db_guid=None, rows=None):
         self.dice = {}
+        self.version = 0
         self.category = category
         self.group = group
         self.db_parent = db_parent
         if db_guid:
             self.db_guid = db_guid
         else:
-            if self.group:
-                cursor.execute('SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category AND GRP=:group', {'PARENT_GUID':self.db_parent.db_guid, 'category':self.category, 'group':self.group})
-            else:
-                cursor.execute('SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category AND GRP IS NULL', {'PARENT_GUID':self.db_parent.db_guid, 'category':self.category})
-            row = cursor.fetchone()
-            if row:
-                self.db_guid = row['GUID']
+            found_guid = None
+            if rows is None:
+                found_guid = storage.find_collection(self.db_parent.db_guid, self.category, self.group)
+            if found_guid:
+                self.db_guid = found_guid
             else:
                 self.db_guid = uuid.uuid1().hex
-                cursor.execute('INSERT INTO DICE_COLLECTION (GUID, CATEGORY, GRP, PARENT_GUID) VALUES (?, ?, ?, ?)', (self.db_guid, self.category, self.group, self.db_parent.db_guid))
-                db.commit()
-        fetched_dice = fetch_all_dice_for_parent(self)
+                storage.insert_collection(self.db_guid, self.category, self.group, self.db_parent.db_guid)
+        if rows is None:
+            fetched_dice = fetch_all_dice_for_parent(self)
+        else:
+            fetched_dice = rows.fetch_dice(self)
         for die in fetched_dice:
             self.dice[die.name] = die
 
     def remove_from_db(self):
-        """Remove these NamedDice from the database."""
+        """Remove these NamedDice from the database. Their dice go along with them."""
 
-        for name in list(self.dice):
-            self.dice[name].remove_from_db()
-        cursor.execute("DELETE FROM DICE_COLLECTION WHERE GUID=:db_guid", {'db_guid':self.db_guid})
-        db.commit()
+        self.version += 1
+        storage.delete_collection(self.db_guid)
         self.dice = {}
 
     def is_empty(self):
@@ -339,6 +1217,7 @@ class NamedDice:
     def add(self, name, die):
         """Add a new die, with a given name."""
 
+        self.version += 1
         die.name = name
         if not name in self.dice:
             die.store_in_db(self)
@@ -353,6 +1232,7 @@ class NamedDice:
     def remove(self, name):
         """Remove a die with a given name."""
 
+        self.version += 1
         if not name in self.dice:
             raise CortexError(NOT_EXIST_ERROR, self.category)
         output = 'Removed: ' + self.output(name)
@@ -363,6 +1243,7 @@ class NamedDice:
     def step_up(self, name):
         """Step up the die with a given name."""
 
+        self.version += 1
         if not name in self.dice:
             raise CortexError(NOT_EXIST_ERROR, self.category)
         if self.dice[name].is_max():
@@ -373,6 +1254,7 @@ class NamedDice:
     def step_down(self, name):
         """Step down the die with a given name."""
 
+        self.version += 1
         if not name in self.dice:
             raise CortexError(NOT_EXIST_ERROR, self.category)
         if self.dice[name].size == 4:
@@ -405,10 +1287,14 @@ class NamedDice:
 class DicePool:
     """A single-purpose collection of die sizes and quantities, suitable for doom pools, crisis pools, and growth pools."""
 
+    __slots__ = ('roller', 'group', 'counts', 'db_guids', 'db_parent', 'db_guid')
+
     def __init__(self, roller, group, incoming_dice=[]):
         self.roller = roller
         self.group = group
-        self.dice = [None, None, None, None, None]
+        # The quantity of each die size, in the order of DIE_SIZES, and for a stored pool, the guid of each size's row.
+        self.counts = [0, 0, 0, 0, 0]
+        self.db_guids = None
         self.db_parent = None
         self.db_guid = None
         if incoming_dice:
@@ -419,54 +1305,56 @@ class DicePool:
 
         self.db_guid = uuid.uuid1().hex
         self.db_parent = db_parent
-        cursor.execute("INSERT INTO DICE_COLLECTION (GUID, CATEGORY, GRP, PARENT_GUID) VALUES (?, 'pool', ?, ?)", (self.db_guid, self.group, self.db_parent.db_guid))
-        db.commit()
+        self.db_guids = [None, None, None, None, None]
+        storage.insert_collection(self.db_guid, 'pool', self.group, self.db_parent.db_guid)
 
     def already_in_db(self, db_parent, db_guid):
         """Inform the pool that it is already in the database, under a given parent and guid."""
 
         self.db_parent = db_parent
         self.db_guid = db_guid
+        self.db_guids = [None, None, None, None, None]
 
-    def fetch_dice_from_db(self):
+    def fetch_dice_from_db(self, rows):
         """Get all the dice from the database that would belong to this pool."""
 
-        fetched_dice = fetch_all_dice_for_parent(self)
-        for die in fetched_dice:
-            self.dice[DIE_SIZES.index(die.size)] = die
+        for row in rows.fetch_die_rows(self):
+            index = DIE_SIZES.index(row['SIZE'])
+            self.counts[index] = row['QTY']
+            self.db_guids[index] = row['GUID']
 
     def disconnect_from_db(self):
         """Prevent further changes to this pool from affecting the database."""
 
         self.db_parent = None
         self.db_guid = None
+        self.db_guids = None
 
     def is_empty(self):
         """Identify whether this pool is empty."""
 
-        return not self.dice
+        return not any(self.counts)
 
     def remove_from_db(self):
-        """Remove this entire pool from the database."""
+        """Remove this entire pool from the database. Its dice go along with it."""
 
-        for index in range(len(self.dice)):
-            if self.dice[index]:
-                self.dice[index].remove_from_db()
-        cursor.execute("DELETE FROM DICE_COLLECTION WHERE GUID=:db_guid", {'db_guid':self.db_guid})
-        db.commit()
-        self.dice = [None, None, None, None, None]
+        storage.delete_collection(self.db_guid)
+        self.counts = [0, 0, 0, 0, 0]
+        self.db_guids = [None, None, None, None, None]
 
     def add(self, dice):
         """Add dice to the pool."""
 
         for die in dice:
             index = DIE_SIZES.index(die.size)
-            if self.dice[index]:
-                self.dice[index].update_qty(self.dice[index].qty + die.qty)
-            else:
-                self.dice[index] = die
-                if self.db_parent and not die.db_parent:
-                    die.store_in_db(self)
+            qty = self.counts[index] + die.qty
+            if self.db_parent:
+                if self.db_guids[index]:
+                    storage.update_die_qty(self.db_guids[index], qty)
+                else:
+                    self.db_guids[index] = uuid.uuid1().hex
+                    storage.insert_die(self.db_guids[index], None, die.size, qty, self.db_guid)
+            self.counts[index] = qty
         return self.output()
 
     def remove(self, dice):
@@ -474,113 +1362,160 @@ class DicePool:
 
         for die in dice:
             index = DIE_SIZES.index(die.size)
-            if self.dice[index]:
-                stored_die = self.dice[index]
-                if die.qty > stored_die.qty:
-                    raise CortexError(DIE_LACK_ERROR, stored_die.qty, stored_die.size)
-                stored_die.update_qty(stored_die.qty - die.qty)
-                if stored_die.qty == 0:
-                    if self.db_parent:
-                        stored_die.remove_from_db()
-                    self.dice[index] = None
-            else:
+            if not self.counts[index]:
                 raise CortexError(DIE_NONE_ERROR, die.size)
+            if die.qty > self.counts[index]:
+                raise CortexError(DIE_LACK_ERROR, self.counts[index], die.size)
+            qty = self.counts[index] - die.qty
+            if self.db_parent:
+                if qty == 0:
+                    storage.delete_die(self.db_guids[index])
+                    self.db_guids[index] = None
+                else:
+                    storage.update_die_qty(self.db_guids[index], qty)
+            self.counts[index] = qty
         return self.output()
 
     def temporary_copy(self):
-        """Return a temporary, non-persisted copy of this dice pool."""
+        """Return a temporary, non-persisted copy of this dice pool. Only the counts are copied."""
+
         copy = DicePool(self.roller, self.group)
-        dice_copies = []
-        for die in self.dice:
-            if die:
-                dice_copies.append(Die(size=die.size, qty=die.qty))
-        copy.add(dice_copies)
+        copy.counts = list(self.counts)
         return copy
 
     def roll(self, suggest_best=False):
         """Roll all the dice in the pool, and return a formatted summary of the results."""
 
-        output = ''
-        separator = ''
-        rolls = []
-        for die in self.dice:
-            if die:
-                output += '{0}D{1} : '.format(separator, die.size)
-                for num in range(die.qty):
-                    roll = {'value': self.roller.roll(die.size), 'size': die.size}
-                    roll_str = str(roll['value'])
-                    if roll_str == '1':
-                        roll_str = '**(1)**'
-                    else:
-                        rolls.append(roll)
-                    output += roll_str + ' '
-                separator = '\n'
+        total_qty = sum(self.counts)
+        if total_qty > ROLL_MAX_DICE:
+            raise CortexError(DIE_EXCESS_ERROR)
+        counts = {}
+        lines = []
+        for index, qty in enumerate(self.counts):
+            if qty:
+                size = DIE_SIZES[index]
+                if total_qty > ROLL_DETAIL_DICE:
+                    # Too many dice to list one by one, so just count how often each face came up.
+                    faces = self.roller.roll_counts(size, qty)
+                    tallies = []
+                    for face in range(size):
+                        if faces[face]:
+                            face_str = str(face + 1)
+                            if face == 0:
+                                face_str = '**(1)**'
+                            tallies.append('{0} x{1}'.format(face_str, faces[face]))
+                    lines.append('{0}D{1} : {2}'.format(qty, size, ', '.join(tallies)))
+                else:
+                    faces = [0] * size
+                    roll_strs = []
+                    for num in range(qty):
+                        value = self.roller.roll(size)
+                        faces[value - 1] += 1
+                        roll_str = str(value)
+                        if value == 1:
+                            roll_str = '**(1)**'
+                        roll_strs.append(roll_str)
+                    lines.append('D{0} : {1} '.format(size, ' '.join(roll_strs)))
+                counts[size] = faces
+        output = '\n'.join(lines)
         if suggest_best:
-            if len(rolls) == 0:
+            best = odds.best_total(counts)
+            if not best:
                 output += '\nBotch!'
             else:
-                # Calculate best total, then choose an effect die
-                rolls.sort(key=lambda roll: roll['value'], reverse=True)
-                best_total_1 = rolls[0]['value']
-                best_addition_1 = '{0}'.format(rolls[0]['value'])
-                best_effect_1 = 'D4'
-                if len(rolls) > 1:
-                    best_total_1 += rolls[1]['value']
-                    best_addition_1 = '{0} + {1}'.format(best_addition_1, rolls[1]['value'])
-                    if len(rolls) > 2:
-                        resorted_rolls = sorted(rolls[2:], key=lambda roll: roll['size'], reverse=True)
-                        best_effect_1 = 'D{0}'.format(resorted_rolls[0]['size'])
-                output += '\nBest Total: {0} ({1}) with Effect: {2}'.format(best_total_1, best_addition_1, best_effect_1)
-
-                # Find best effect die, then chooose best total
-                rolls.sort(key=lambda roll: roll['value'])
-                rolls.sort(key=lambda roll: roll['size'], reverse=True)
-                best_total_2 = rolls[0]['value']
-                best_addition_2 = '{0}'.format(rolls[0]['value'])
-                best_effect_2 = 'D4'
-                if len(rolls) > 1:
-                    best_total_2 += rolls[1]['value']
-                    best_addition_2 = '{0} + {1}'.format(best_addition_2, rolls[1]['value'])
-                    if len(rolls) > 2:
-                        best_effect_2 = 'D{0}'.format(rolls[0]['size'])
-                        resorted_rolls = sorted(rolls[1:], key=lambda roll: roll['value'], reverse=True)
-                        best_total_2 = resorted_rolls[0]['value'] + resorted_rolls[1]['value']
-                        best_addition_2 = '{0} + {1}'.format(resorted_rolls[0]['value'], resorted_rolls[1]['value'])
-                if best_effect_1 != best_effect_1 or best_total_1 != best_total_2:
-                    output += ' | Best Effect: {0} with Total: {1} ({2})'.format(best_effect_2, best_total_2, best_addition_2)
+                values, effect = best
+                output += '\nBest Total: {0} ({1}) with Effect: D{2}'.format(sum(values), ' + '.join(str(value) for value in values), effect)
+                values_2, effect_2 = odds.best_effect(counts)
+                if sum(values) != sum(values_2):
+                    output += ' | Best Effect: D{0} with Total: {1} ({2})'.format(effect_2, sum(values_2), ' + '.join(str(value) for value in values_2))
         return output
 
+    def signature(self):
+        """Return the sizes and quantities of the dice in this pool, as a tuple that identifies any pool with the same dice."""
+
+        return tuple((DIE_SIZES[index], qty) for index, qty in enumerate(self.counts) if qty)
+
+    def odds(self, difficulty=None):
+        """Work out the exact odds for the pool, and return a formatted summary of them."""
+
+        signature = self.signature()
+        total_qty = sum(qty for size, qty in signature)
+        if total_qty == 0:
+            raise CortexError(DIE_MISSING_ERROR)
+        if total_qty > ODDS_MAX_DICE:
+            raise CortexError(DIE_EXCESS_ERROR)
+        pool_odds = odds.pool_odds(signature)
+        lines = []
+        if difficulty is not None:
+            lines.append('Chance to beat {0}: {1}%'.format(difficulty, round(pool_odds.chance_to_beat(difficulty) * 100.0, 1)))
+        lines.append('Chance to beat: ' + ' | '.join('{0}: {1}%'.format(level, round(pool_odds.chance_to_beat(level) * 100.0, 1)) for level in odds.DIFFICULTIES))
+        lines.append('Average total: {0}'.format(round(pool_odds.average_total(), 1)))
+        lines.append('Effect: ' + ' | '.join('D{0}: {1}%'.format(size, round(pool_odds.chance_of_effect(size) * 100.0, 1)) for size in DIE_SIZES if size in pool_odds.effects))
+        lines.append('Hitch: {0}% | Botch: {1}%'.format(round(pool_odds.chance_of_hitch() * 100.0, 1), round(pool_odds.chance_of_botch() * 100.0, 1)))
+        return '\n'.join(lines)
+
+    def simulate(self, opponent=None, trials=SIM_TRIALS, seed=None, executor=None):
+        """Simulate many rolls of the pool, against a difficulty or another pool if given, and return a formatted summary of the results."""
+
+        signature = self.signature()
+        if not signature:
+            raise CortexError(DIE_MISSING_ERROR)
+        if sum(qty for size, qty in signature) > ODDS_MAX_DICE:
+            raise CortexError(DIE_EXCESS_ERROR)
+        if trials > SIM_MAX_TRIALS:
+            raise CortexError(TRIALS_EXCESS_ERROR, SIM_MAX_TRIALS)
+        if isinstance(opponent, DicePool):
+            opponent_signature = opponent.signature()
+            if not opponent_signature:
+                raise CortexError(DIE_MISSING_ERROR)
+            if sum(qty for size, qty in opponent_signature) > ODDS_MAX_DICE:
+                raise CortexError(DIE_EXCESS_ERROR)
+        else:
+            opponent_signature = opponent
+        simulation = odds.simulate(signature, opponent_signature, trials, seed, executor, SIM_CHUNK_SIZE, SIM_BUDGET_SECONDS)
+        lines = ['Simulated {0} rolls with seed {1}.'.format(simulation.trials, simulation.seed)]
+        if simulation.trials < trials:
+            lines[0] += ' (The simulation ran out of time before {0} rolls.)'.format(trials)
+        if isinstance(opponent, DicePool):
+            wins = round(simulation.wins / simulation.trials * 100.0, 1)
+            ties = round(simulation.ties / simulation.trials * 100.0, 1)
+            losses = round(100.0 - wins - ties, 1)
+            lines.append('Against {0}: Win: {1}% | Tie: {2}% | Lose: {3}%'.format(opponent.output().strip(), wins, ties, losses))
+        elif opponent is not None:
+            lines.append('Chance to beat {0}: {1}%'.format(opponent, round(simulation.wins / simulation.trials * 100.0, 1)))
+        lines.append('Total percentiles: ' + ' | '.join('{0}%: {1}'.format(percent, simulation.percentile(percent)) for percent in [10, 25, 50, 75, 90]))
+        lines.append('Best Total: average {0} with Effect: '.format(round(simulation.average(simulation.totals), 1)) + ' | '.join('D{0}: {1}%'.format(size, round(simulation.effects[size] / simulation.trials * 100.0, 1)) for size in DIE_SIZES if size in simulation.effects))
+        lines.append('Best Effect: average {0} with Effect: '.format(round(simulation.average(simulation.effect_totals), 1)) + ' | '.join('D{0}: {1}%'.format(size, round(simulation.effect_effects[size] / simulation.trials * 100.0, 1)) for size in DIE_SIZES if size in simulation.effect_effects))
+        lines.append('Hitch: {0}% | Botch: {1}%'.format(round(simulation.hitches / simulation.trials * 100.0, 1), round(simulation.botches / simulation.trials * 100.0, 1)))
+        return '\n'.join(lines)
+
     def output(self):
         """Return a formatted list of the dice in this pool."""
 
         if self.is_empty():
             return 'empty'
         output = ''
-        for die in self.dice:
-            if die:
-                output += die.output() + ' '
+        for index, qty in enumerate(self.counts):
+            if qty > 1:
+                output += '{0}D{1} '.format(qty, DIE_SIZES[index])
+            elif qty:
+                output += 'D{0} '.format(DIE_SIZES[index])
         return output
 
 class DicePools:
     """A collection of DicePool objects."""
 
-    def __init__(self, roller, db_parent):
+    __slots__ = ('roller', 'pools', 'version', 'db_parent')
+
+    def __init__(self, roller, db_parent, rows):
         self.roller = roller
         self.pools = {}
+        self.version = 0
         self.db_parent = db_parent
-        cursor.execute('SELECT * FROM DICE_COLLECTION WHERE CATEGORY="pool" AND PARENT_GUID=:PARENT_GUID', {'PARENT_GUID':self.db_parent.db_guid})
-        pool_info = []
-        fetching = True
-        while fetching:
-            row = cursor.fetchone()
-            if row:
-                pool_info.append({'db_guid':row['GUID'], 'grp':row['GRP'], 'parent_guid':row['PARENT_GUID']})
-            else:
-                fetching = False
-        for fetched_pool in pool_info:
-            new_pool = DicePool(self.roller, fetched_pool['grp'])
-            new_pool.already_in_db(fetched_pool['parent_guid'], fetched_pool['db_guid'])
-            new_pool.fetch_dice_from_db()
+        for row in rows.fetch_collections('pool'):
+            new_pool = DicePool(self.roller, row['GRP'])
+            new_pool.already_in_db(self.db_parent, row['GUID'])
+            new_pool.fetch_dice_from_db(rows)
             self.pools[new_pool.group] = new_pool
 
     def is_empty(self):
@@ -591,6 +1526,7 @@ class DicePools:
     def remove_from_db(self):
         """Remove all of these pools from the database."""
 
+        self.version += 1
         for group in list(self.pools):
             self.pools[group].remove_from_db()
         self.pools = {}
@@ -598,6 +1534,7 @@ class DicePools:
     def add(self, group, dice):
         """Add some dice to a pool under a given name."""
 
+        self.version += 1
         if not group in self.pools:
             self.pools[group] = DicePool(self.roller, group)
             self.pools[group].store_in_db(self.db_parent)
@@ -607,6 +1544,7 @@ class DicePools:
     def remove(self, group, dice):
         """Remove some dice from a pool with a given name."""
 
+        self.version += 1
         if not group in self.pools:
             raise CortexError(NOT_EXIST_ERROR, 'pool')
         self.pools[group].remove(dice)
@@ -614,6 +1552,8 @@ class DicePools:
 
     def clear(self, group):
         """Remove one entire pool."""
+
+        self.version += 1
         if not group in self.pools:
             raise CortexError(NOT_EXIST_ERROR, 'pool')
         self.pools[group].remove_from_db()
@@ -645,18 +1585,15 @@ class DicePools:
 class Resources:
     """Holds simple quantity-based resources, like plot points."""
 
-    def __init__(self, category, db_parent):
+    __slots__ = ('resources', 'version', 'category', 'db_parent')
+
+    def __init__(self, category, db_parent, rows):
         self.resources = {}
+        self.version = 0
         self.category = category
         self.db_parent = db_parent
-        cursor.execute("SELECT * FROM RESOURCE WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category", {'PARENT_GUID':self.db_parent.db_guid, 'category':self.category})
-        fetching = True
-        while fetching:
-            row = cursor.fetchone()
-            if row:
-                self.resources[row['NAME']] = {'qty':row['QTY'], 'db_guid':row['GUID']}
-            else:
-                fetching = False
+        for row in rows.fetch_resources(self.category):
+            self.resources[row['NAME']] = {'qty':row['QTY'], 'db_guid':row['GUID']}
 
     def is_empty(self):
         """Identify whether there are any resources stored here."""
@@ -666,42 +1603,42 @@ class Resources:
     def remove_from_db(self):
         """Removce these resources from the database."""
 
-        cursor.executemany("DELETE FROM RESOURCE WHERE GUID=:db_guid", [{'db_guid':self.resources[resource]['db_guid']} for resource in list(self.resources)])
-        db.commit()
+        self.version += 1
+        storage.delete_resources([self.resources[resource]['db_guid'] for resource in list(self.resources)])
         self.resources = {}
 
     def add(self, name, qty=1):
         """Add a quantity of resources to a given name."""
 
+        self.version += 1
         if not name in self.resources:
             db_guid = uuid.uuid1().hex
             self.resources[name] = {'qty':qty, 'db_guid':db_guid}
-            cursor.execute("INSERT INTO RESOURCE (GUID, CATEGORY, NAME, QTY, PARENT_GUID) VALUES (?, ?, ?, ?, ?)", (db_guid, self.category, name, qty, self.db_parent.db_guid))
-            db.commit()
+            storage.insert_resource(db_guid, self.category, name, qty, self.db_parent.db_guid)
         else:
             self.resources[name]['qty'] += qty
-            cursor.execute("UPDATE RESOURCE SET QTY=:qty WHERE GUID=:db_guid", {'qty':self.resources[name]['qty'], 'db_guid':self.resources[name]['db_guid']})
-            db.commit()
+            storage.update_resource_qty(self.resources[name]['db_guid'], self.resources[name]['qty'])
         return self.output(name)
 
     def remove(self, name, qty=1):
         """Remove a quantity of resources from a given name."""
 
+        self.version += 1
         if not name in self.resources:
             raise CortexError(HAS_NONE_ERROR, name, self.category)
         if self.resources[name]['qty'] < qty:
             raise CortexError(HAS_ONLY_ERROR, name, self.resources[name]['qty'], self.category)
         self.resources[name]['qty'] -= qty
-        cursor.execute("UPDATE RESOURCE SET QTY=:qty WHERE GUID=:db_guid", {'qty':self.resources[name]['qty'], 'db_guid':self.resources[name]['db_guid']})
-        db.commit()
+        storage.update_resource_qty(self.resources[name]['db_guid'], self.resources[name]['qty'])
         return self.output(name)
 
     def clear(self, name):
         """Remove a name from the catalog entirely."""
+
+        self.version += 1
         if not name in self.resources:
             raise CortexError(HAS_NONE_ERROR, name, self.category)
-        cursor.execute("DELETE FROM RESOURCE WHERE GUID=:db_guid", {'db_guid':self.resources[name]['db_guid']})
-        db.commit()
+        storage.delete_resources([self.resources[name]['db_guid']])
         del self.resources[name]
         return 'Cleared {0} from {1} list.'.format(name, self.category)
 
@@ -723,22 +1660,16 @@ class Resources:
 class GroupedNamedDice:
     """Holds named dice that are separated by groups, such as mental and physical stress (the dice names) assigned to characters (the dice groups)."""
 
-    def __init__(self, category, db_parent):
+    __slots__ = ('groups', 'version', 'category', 'db_parent')
+
+    def __init__(self, category, db_parent, rows):
         self.groups = {}
+        self.version = 0
         self.category = category
         self.db_parent = db_parent
-        cursor.execute("SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:parent_guid AND CATEGORY=:category", {'parent_guid':self.db_parent.db_guid, 'category':self.category})
-        group_guids = {}
-        fetching = True
-        while fetching:
-            row = cursor.fetchone()
-            if row:
-                group_guids[row['GRP']] = row['GUID']
-            else:
-                fetching = False
-        for group in group_guids:
-            new_group = NamedDice(self.category, group, self.db_parent, db_guid=group_guids[group])
-            self.groups[group] = new_group
+        for row in rows.fetch_collections(self.category):
+            new_group = NamedDice(self.category, row['GRP'], self.db_parent, db_guid=row['GUID'], rows=rows)
+            self.groups[new_group.group] = new_group
 
     def is_empty(self):
         """Identifies whether we're holding any dice yet."""
@@ -748,6 +1679,7 @@ class GroupedNamedDice:
     def remove_from_db(self):
         """Remove all of these dice from the database."""
 
+        self.version += 1
         for group in list(self.groups):
             self.groups[group].remove_from_db()
         self.groups = {}
@@ -755,6 +1687,7 @@ class GroupedNamedDice:
     def add(self, group, name, die):
         """Add dice with a given name to a given group."""
 
+        self.version += 1
         if not group in self.groups:
             self.groups[group] = NamedDice(self.category, group, self.db_parent)
         return self.groups[group].add(name, die)
@@ -762,6 +1695,7 @@ class GroupedNamedDice:
     def remove(self, group, name):
         """Remove dice with a given name from a given group."""
 
+        self.version += 1
         if not group in self.groups:
             raise CortexError(HAS_NONE_ERROR, group, self.category)
         return self.groups[group].remove(name)
@@ -769,6 +1703,7 @@ class GroupedNamedDice:
     def clear(self, group):
         """Remove all dice from a given group."""
 
+        self.version += 1
         if not group in self.groups:
             raise CortexError(HAS_NONE_ERROR, group, self.category)
         self.groups[group].remove_from_db()
@@ -778,6 +1713,7 @@ class GroupedNamedDice:
     def step_up(self, group, name):
         """Step up the die with a given name, within a given group."""
 
+        self.version += 1
         if not group in self.groups:
             raise CortexError(HAS_NONE_ERROR, group, self.category)
         return self.groups[group].step_up(name)
@@ -785,6 +1721,7 @@ class GroupedNamedDice:
     def step_down(self, group, name):
         """Step down the die with a given name, within a given group."""
 
+        self.version += 1
         if not group in self.groups:
             raise CortexError(HAS_NONE_ERROR, group, self.category)
         return self.groups[group].step_down(name)
@@ -809,82 +1746,159 @@ class GroupedNamedDice:
 class CortexGame:
     """All information for a game, within a single server and channel."""
 
-    def __init__(self, roller, server, channel):
-        self.roller = roller
+    # The game's traits, and the dice collection or resource category each one is stored under.
+    DICE_TRAITS = {'assets': 'asset', 'complications': 'complication', 'stress': 'stress', 'pools': 'pool'}
+    RESOURCE_TRAITS = {'plot_points': 'plot points', 'xp': 'xp'}
+    # The sections of the game report, in order: each one's heading, the trait it shows, and the trait's method for formatting it.
+    SECTIONS = [
+        ('**Assets**', 'assets', 'output_all'),
+        ('**Complications**', 'complications', 'output_all'),
+        ('**Stress**', 'stress', 'output_all'),
+        ('**Plot Points**', 'plot_points', 'output_all'),
+        ('**Dice Pools**', 'pools', 'output'),
+        ('**Experience Points**', 'xp', 'output_all')
+    ]
+
+    def __init__(self, shard, server, channel):
+        self.shard = shard
+        self.roller = shard.roller.for_server(server)
         self.server = server
         self.channel = channel
-        self.pinned_message = None
 
-        cursor.execute('SELECT * FROM GAME WHERE SERVER=:server AND CHANNEL=:channel', {"server":server, "channel":channel})
-        row = cursor.fetchone()
+        row = storage.find_game(server, channel)
         if not row:
             self.db_guid = uuid.uuid1().hex
-            cursor.execute('INSERT INTO GAME (GUID, SERVER, CHANNEL, ACTIVITY) VALUES (?, ?, ?, ?)', (self.db_guid, server, channel, datetime.now(timezone.utc)))
-            db.commit()
+            self.activity = datetime.now(timezone.utc)
+            self.version = 0
+            storage.insert_game(self.db_guid, server, channel, self.activity)
         else:
             self.db_guid = row['GUID']
+            self.activity = parse_activity(row['ACTIVITY'])
+            self.version = row['VERSION']
+        self.generation = database.refresh()
         self.new()
 
     def new(self):
-        """Set up new, empty traits for the game."""
+        """Set up the game's traits. Each trait is loaded from the database the first time it's used."""
+
+        self.traits = {}
+        # Formatted report sections, each with the version of the trait it shows, and the whole report, with the versions of every trait.
+        self.sections = {}
+        self.rendered = None
+        self.rendered_versions = None
+
+    def load(self, *names):
+        """Load the named traits from the database, if they aren't loaded already, all in one round trip."""
+
+        names = [name for name in names if not name in self.traits]
+        if not names:
+            return
+        rows = GameRows(
+            self.db_guid,
+            [self.DICE_TRAITS[name] for name in names if name in self.DICE_TRAITS],
+            [self.RESOURCE_TRAITS[name] for name in names if name in self.RESOURCE_TRAITS])
+        for name in names:
+            if name == 'complications':
+                self.traits[name] = NamedDice('complication', None, self, db_guid=rows.find_collection('complication', None), rows=rows)
+            elif name == 'assets':
+                self.traits[name] = NamedDice('asset', None, self, db_guid=rows.find_collection('asset', None), rows=rows)
+            elif name == 'pools':
+                self.traits[name] = DicePools(self.roller, self, rows)
+            elif name == 'stress':
+                self.traits[name] = GroupedNamedDice('stress', self, rows)
+            else:
+                self.traits[name] = Resources(self.RESOURCE_TRAITS[name], self, rows)
+
+    def load_all(self):
+        """Load every trait that isn't loaded already."""
+
+        self.load(*self.DICE_TRAITS, *self.RESOURCE_TRAITS)
+
+    def get_trait(self, name):
+        """Return one of the game's traits, loading it first if necessary."""
+
+        self.load(name)
+        return self.traits[name]
+
+    @property
+    def pinned_message(self):
+        """The game's pinned message, if it has one. The shard keeps it, so that it outlives this copy of the game in memory."""
+        return self.shard.pinned_messages.get((self.server, self.channel))
+
+    @pinned_message.setter
+    def pinned_message(self, message):
+        self.shard.pinned_messages[(self.server, self.channel)] = message
+
+    @property
+    def complications(self):
+        return self.get_trait('complications')
 
-        self.complications = NamedDice('complication', None, self)
-        self.assets = NamedDice('asset', None, self)
-        self.pools = DicePools(self.roller, self)
-        self.plot_points = Resources('plot points', self)
-        self.stress = GroupedNamedDice('stress', self)
-        self.xp = Resources('xp', self)
+    @property
+    def assets(self):
+        return self.get_trait('assets')
+
+    @property
+    def pools(self):
+        return self.get_trait('pools')
+
+    @property
+    def plot_points(self):
+        return self.get_trait('plot_points')
+
+    @property
+    def stress(self):
+        return self.get_trait('stress')
+
+    @property
+    def xp(self):
+        return self.get_trait('xp')
 
     def clean(self):
         """Resets and erases the game's traits."""
 
+        self.load_all()
+
         self.complications.remove_from_db()
         self.assets.remove_from_db()
         self.pools.remove_from_db()
         self.plot_points.remove_from_db()
         self.stress.remove_from_db()
         self.xp.remove_from_db()
+        # Start over with fresh traits, since the complication and asset collections are gone.
+        self.new()
 
     def output(self):
-        """Return a report of all of the game's traits."""
-
-        output = GAME_INFO_HEADER + '\n'
-        if not self.assets.is_empty():
-            output += '\n**Assets**\n'
-            output += self.assets.output_all()
-            output += '\n'
-        if not self.complications.is_empty():
-            output += '\n**Complications**\n'
-            output += self.complications.output_all()
-            output += '\n'
-        if not self.stress.is_empty():
-            output += '\n**Stress**\n'
-            output += self.stress.output_all()
-            output += '\n'
-        if not self.plot_points.is_empty():
-            output += '\n**Plot Points**\n'
-            output += self.plot_points.output_all()
-            output += '\n'
-        if not self.pools.is_empty():
-            output += '\n**Dice Pools**\n'
-            output += self.pools.output()
-            output += '\n'
-        if not self.xp.is_empty():
-            output += '\n**Experience Points**\n'
-            output += self.xp.output_all()
-            output += '\n'
+        """Return a report of all of the game's traits. Only sections whose traits have changed since the last report are formatted again."""
+
+        self.load_all()
+
+        versions = tuple(self.traits[name].version for heading, name, method in self.SECTIONS)
+        if versions != self.rendered_versions:
+            output = GAME_INFO_HEADER + '\n'
+            for heading, name, method in self.SECTIONS:
+                output += self.output_section(heading, name, method)
+            self.rendered = output
+            self.rendered_versions = versions
+        return self.rendered
+
+    def output_section(self, heading, name, method):
+        """Return one section of the game report, formatting it again only if its trait has changed."""
+
+        trait = self.traits[name]
+        cached = self.sections.get(name)
+        if cached and cached[0] == trait.version:
+            return cached[1]
+        output = ''
+        if not trait.is_empty():
+            output = '\n{0}\n{1}\n'.format(heading, getattr(trait, method)())
+        self.sections[name] = (trait.version, output)
         return output
 
     def get_channel(self):
         return self.channel
 
     def get_option(self, key):
-        value = None
-        cursor.execute('SELECT * FROM GAME_OPTIONS WHERE PARENT_GUID=:game_guid AND KEY=:key', {'game_guid':self.db_guid, 'key':key})
-        row = cursor.fetchone()
-        if row:
-            value = row['VALUE']
-        return value
+        return self.shard.options.get(self.server, self.channel, key)
 
     def get_option_as_bool(self, key):
         as_bool = False
@@ -895,87 +1909,574 @@ class CortexGame:
         return as_bool
 
     def set_option(self, key, value):
-        prior = self.get_option(key)
-        if not prior:
+        # The database stores option values as text, so the cache should too.
+        value = str(value)
+        if not key in self.shard.options.get_all(self.server, self.channel):
             new_guid = uuid.uuid1().hex
-            cursor.execute('INSERT INTO GAME_OPTIONS (GUID, KEY, VALUE, PARENT_GUID) VALUES (?, ?, ?, ?)', (new_guid, key, value, self.db_guid))
+            storage.insert_option(new_guid, key, value, self.db_guid)
         else:
-            cursor.execute('UPDATE GAME_OPTIONS SET VALUE=:value where KEY=:key and PARENT_GUID=:game_guid', {'value':value, 'key':key, 'game_guid':self.db_guid})
-        db.commit()
+            storage.update_option(self.db_guid, key, value)
+        self.shard.options.set(self.server, self.channel, key, value)
 
     def update_activity(self):
-        cursor.execute('UPDATE GAME SET ACTIVITY=:now WHERE GUID=:db_guid', {'now':datetime.now(timezone.utc), 'db_guid':self.db_guid})
-        db.commit()
+        activity_tracker.touch(self)
+
+    def mark_changed(self):
+        """Count a change to the game, so that other processes sharing the database know to load it again."""
+
+        if database.shared:
+            storage.bump_game_version(self.db_guid)
+            self.version += 1
+
+    def is_current(self):
+        """Check that no other process sharing the database has changed or deleted the game since we loaded it. The check only reaches the database after another process has written to it."""
+
+        generation = database.refresh()
+        if generation == self.generation:
+            return True
+        if storage.game_version(self.db_guid) != self.version:
+            return False
+        self.generation = generation
+        return True
+
+def split_message(sections, limit=MESSAGE_LIMIT):
+    """Pack sections of text into as few messages as possible, each within Discord's length limit. A section that's too long by itself is split between its lines."""
+
+    messages = []
+    current = ''
+    for section in sections:
+        pieces = [section]
+        if len(section) > limit:
+            pieces = [line[:limit - 1] + '\n' for line in section.splitlines()]
+        for piece in pieces:
+            if current and len(current) + len(piece) > limit:
+                messages.append(current)
+                current = ''
+            if not current:
+                piece = piece.lstrip('\n')
+            current += piece
+    if current:
+        messages.append(current)
+    return messages
+
+def output_roll_frequencies(results, scope):
+    """Return a report of die roll frequencies, given how often each face came up on each die size."""
+
+    total = 0
+
+    frequency = ''
+    separator = ''
+    for size in results:
+        subtotal = sum(results[size])
+        total += subtotal
+        frequency += '**{0}D{1}** : {2} rolls'.format(separator, size, subtotal)
+        separator = '\n'
+        if subtotal > 0:
+            for face in range(1, size + 1):
+                frequency += ' : **{0}** {1}x {2}%'.format(
+                    face,
+                    results[size][face - 1],
+                    round(float(results[size][face - 1]) / float(subtotal) * 100.0, 1))
+
+    output = (
+    '**Randomness**\n'
+    'The bot has rolled {0} dice {1}.\n'
+    '\n'
+    'Roll frequency statistics:\n'
+    '{2}'
+    ).format(total, scope, frequency)
+
+    return output
 
 class Roller:
-    """Generates random die rolls and remembers the frequency of results."""
+    """Generates random die rolls and remembers the frequency of results, recording them for each server in the database in bulk every few minutes."""
 
     def __init__(self):
         self.results = {}
         for size in DIE_SIZES:
             self.results[size] = [0] * size
+        # Frequencies not yet recorded in the database, keyed by server and die size.
+        self.unsaved = {}
+        self.entropy = b''
+        self.entropy_index = 0
+        self.lock = threading.Lock()
+        # For each die size, a table translating a random byte to a face (counting from zero), and the bytes to reject.
+        self.face_tables = {size: odds.face_table(size) for size in DIE_SIZES}
 
-    def roll(self, size):
+    def for_server(self, server):
+        """Return a roller whose results count toward a given server's statistics."""
+
+        return ServerRoller(self, server)
+
+    def unsaved_faces(self, server, size):
+        """Return the list of a server's unrecorded frequencies for a die size. The caller must hold the lock."""
+
+        faces = self.unsaved.get((server, size))
+        if faces is None:
+            faces = self.unsaved[(server, size)] = [0] * size
+        return faces
+
+    def roll(self, size, server=None):
         """Roll a die of a given size and return the result."""
 
-        face = random.SystemRandom().randrange(1, int(size) + 1)
-        self.results[size][face - 1] += 1
+        size = int(size)
+        table, rejected = self.face_tables[size]
+        # Only accept bytes below the largest multiple of the die size, so that every face is equally likely.
+        limit = 256 - len(rejected)
+        with self.lock:
+            byte = limit
+            while byte >= limit:
+                if self.entropy_index >= len(self.entropy):
+                    self.entropy = os.urandom(ENTROPY_BLOCK_SIZE)
+                    self.entropy_index = 0
+                byte = self.entropy[self.entropy_index]
+                self.entropy_index += 1
+            face = table[byte] + 1
+            self.results[size][face - 1] += 1
+            if server is not None:
+                self.unsaved_faces(server, size)[face - 1] += 1
         return face
 
+    def roll_counts(self, size, qty, server=None):
+        """Roll many dice of a given size at once, and return how many times each face came up."""
+
+        size = int(size)
+        tables = self.face_tables[size]
+        faces = [0] * size
+        remaining = qty
+        while remaining > 0:
+            block = os.urandom(min(remaining + remaining // 4 + 16, ENTROPY_BLOCK_SIZE))
+            block = odds.bytes_to_faces(block, tables)[:remaining]
+            for face in range(size):
+                faces[face] += block.count(face)
+            remaining -= len(block)
+        with self.lock:
+            for face in range(size):
+                self.results[size][face] += faces[face]
+            if server is not None:
+                unsaved = self.unsaved_faces(server, size)
+                for face in range(size):
+                    unsaved[face] += faces[face]
+        return faces
+
+    def flush(self):
+        """Add all unrecorded frequencies to the database, and commit them. This runs on the database thread. If they can't be recorded, they're kept to try again next time."""
+
+        with self.lock:
+            unsaved = self.unsaved
+            self.unsaved = {}
+        rows = []
+        for (server, size), faces in unsaved.items():
+            for face in range(size):
+                if faces[face]:
+                    rows.append((server, size, face + 1, faces[face]))
+        if rows:
+            try:
+                storage.add_roll_stats(rows)
+                # Commit straight away, so that the frequencies are only forgotten once they're safely recorded.
+                database.commit()
+            except:
+                with self.lock:
+                    for (server, size), faces in unsaved.items():
+                        restored = self.unsaved_faces(server, size)
+                        for face in range(size):
+                            restored[face] += faces[face]
+                raise
+            logging.info('Recorded roll frequencies for %d servers', len(set(server for server, size in unsaved)))
+
+class ServerRoller:
+    """Rolls dice on behalf of one server, so that the results count toward that server's statistics."""
+
+    def __init__(self, roller, server):
+        self.roller = roller
+        self.server = server
+
+    def roll(self, size):
+        """Roll a die of a given size and return the result."""
+
+        return self.roller.roll(size, self.server)
+
+    def roll_counts(self, size, qty):
+        """Roll many dice of a given size at once, and return how many times each face came up."""
+
+        return self.roller.roll_counts(size, qty, self.server)
+
+class GameRegistry:
+    """Holds recently used games in memory, discarding the least recently used game when full."""
+
+    def __init__(self, max_games):
+        self.max_games = max_games
+        self.games = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, server, channel):
+        """Return the cached game for a server and channel, or None if we don't have it."""
+
+        key = (server, channel)
+        game = self.games.get(key)
+        if game:
+            self.games.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return game
+
+    def add(self, game):
+        """Remember a game, evicting older games if we have too many."""
+
+        self.games[(game.server, game.channel)] = game
+        self.games.move_to_end((game.server, game.channel))
+        while len(self.games) > self.max_games:
+            self.games.popitem(last=False)
+            self.evictions += 1
+
+    def evict(self, keys):
+        """Forget the games for a list of server and channel pairs."""
+
+        for key in keys:
+            if self.games.pop(key, None):
+                self.evictions += 1
+
     def output(self):
-        """Return a report of die roll frequencies."""
-
-        total = 0
-
-        frequency = ''
-        separator = ''
-        for size in self.results:
-            subtotal = sum(self.results[size])
-            total += subtotal
-            frequency += '**{0}D{1}** : {2} rolls'.format(separator, size, subtotal)
-            separator = '\n'
-            if subtotal > 0:
-                for face in range(1, size + 1):
-                    frequency += ' : **{0}** {1}x {2}%'.format(
-                        face,
-                        self.results[size][face - 1],
-                        round(float(self.results[size][face - 1]) / float(subtotal) * 100.0, 1))
-
-        output = (
-        '**Randomness**\n'
-        'The bot has rolled {0} dice since starting up.\n'
-        '\n'
-        'Roll frequency statistics:\n'
-        '{1}'
-        ).format(total, frequency)
+        """Return a report of cache usage."""
+
+        return (
+        '**Game Cache**\n'
+        'Holding {0} of at most {1} games.\n'
+        'Lookups: {2} hits, {3} misses, {4} evictions.\n'
+        ).format(len(self.games), self.max_games, self.hits, self.misses, self.evictions)
+
+class Shard:
+    """The in-memory state for the servers on one Discord shard: recent games, options, pinned messages, and roll statistics, along with command timings."""
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.games = GameRegistry(GAME_CACHE_SIZE)
+        self.options = OptionCache(OPTION_CACHE_SIZE)
+        # Each game's pinned message, by server and channel, which stays put when the game itself is dropped from memory.
+        self.pinned_messages = {}
+        self.roller = Roller()
+        self.commands = 0
+        self.command_seconds = 0.0
+        self.slowest_command_seconds = 0.0
+        self.queued = 0
+
+    def start_command(self):
+        """Note that a command has started, and return its start time."""
+
+        self.queued += 1
+        return time.perf_counter()
+
+    def finish_command(self, start):
+        """Note that a command has finished, given its start time."""
+
+        elapsed = time.perf_counter() - start
+        self.queued -= 1
+        self.commands += 1
+        self.command_seconds += elapsed
+        self.slowest_command_seconds = max(self.slowest_command_seconds, elapsed)
+
+    def output(self, latency=None):
+        """Return a one-line report of this shard's activity."""
+
+        average_ms = 0
+        if self.commands:
+            average_ms = self.command_seconds / self.commands * 1000
+        output = 'Shard {0}: {1} games cached, {2} commands, {3:.1f} ms average, {4:.1f} ms slowest, {5} in progress'.format(
+            self.shard_id, len(self.games.games), self.commands, average_ms, self.slowest_command_seconds * 1000, self.queued)
+        if latency is not None:
+            output += ', {0:.0f} ms gateway latency'.format(latency * 1000)
+        return output
+
+class Shards:
+    """Partitions the bot's in-memory state by Discord shard, so that no two shards share caches or statistics."""
+
+    def __init__(self):
+        self.shards = {}
+
+    def get(self, shard_id):
+        """Return the state for a shard, creating it if necessary. A bot without shards keeps everything in shard 0."""
+
+        if shard_id is None:
+            shard_id = 0
+        shard = self.shards.get(shard_id)
+        if not shard:
+            # The event loop and the database thread may both meet a new shard at once, and only one of them may add it.
+            shard = self.shards.setdefault(shard_id, Shard(shard_id))
+        return shard
+
+    def evict(self, keys):
+        """Forget the games, options, and pinned messages for a list of server and channel pairs, whichever shards they belong to."""
+
+        # The event loop may add a shard while this runs on the database thread.
+        for shard in list(self.shards.values()):
+            shard.games.evict(keys)
+            for key in keys:
+                shard.pinned_messages.pop(key, None)
+        self.forget_options(keys)
+
+    def forget_options(self, keys):
+        """Forget the options for a list of server and channel pairs, whichever shards they belong to."""
+
+        for shard in list(self.shards.values()):
+            for server, channel in keys:
+                shard.options.forget(server, channel)
+
+    def results(self):
+        """Return how often each face has come up since startup, on every shard together."""
+
+        results = {}
+        for size in DIE_SIZES:
+            results[size] = [0] * size
+        for shard in list(self.shards.values()):
+            for size in DIE_SIZES:
+                for face in range(size):
+                    results[size][face] += shard.roller.results[size][face]
+        return results
+
+    def flush(self):
+        """Add every shard's unrecorded roll frequencies to the database. This runs on the database thread."""
+
+        for shard in list(self.shards.values()):
+            shard.roller.flush()
+
+    def read_results(self, server=None):
+        """Get the frequencies recorded in the database, for one server or for all of them. This runs on a reader thread, so flush first to include the latest rolls."""
 
+        results = {}
+        for size in DIE_SIZES:
+            results[size] = [0] * size
+        for size, face, rolls in storage.read_roll_stats(server):
+            if size in results and 1 <= face <= size:
+                results[size][face - 1] = rolls
+        return results
+
+    async def run_forever(self):
+        """Flush unrecorded roll frequencies after every interval."""
+
+        while True:
+            await asyncio.sleep(ROLL_STATS_FLUSH_MINUTES * 60)
+            try:
+                await database.transact(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except:
+                logging.error(traceback.format_exc())
+
+    def output(self, latencies):
+        """Return a report of every shard's activity, given each shard's gateway latency."""
+
+        output = '**Shards**\n'
+        for shard_id, shard in sorted(list(self.shards.items())):
+            output += shard.output(latencies.get(shard_id)) + '\n'
         return output
 
+shards = Shards()
+
+def start_storage(new_storage, readers=DATABASE_READERS):
+    """
+    Keep games in a storage backend from now on, with nothing about them remembered in memory yet, and return the database that runs work against it.
+
+    The bot does this once when it starts. Tests and benchmarks do it for every backend they try, closing the previous database first.
+    """
+
+    global storage, database, activity_tracker, shards
+    storage = new_storage
+    database = Database(storage, readers)
+    activity_tracker = ActivityTracker()
+    shards = Shards()
+    return database
+
+class Purger:
+    """Deletes old unused games in the background, a small chunk at a time, so that no one command waits on the purge."""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.chunk_size = PURGE_CHUNK_SIZE
+        self.running = False
+        self.last_start = None
+        self.last_finish = None
+        self.last_deleted = 0
+        self.total_deleted = 0
+
+    async def run_forever(self):
+        """Purge now, and then again after every interval."""
+
+        while True:
+            try:
+                await self.purge()
+            except asyncio.CancelledError:
+                raise
+            except:
+                self.running = False
+                logging.error(traceback.format_exc())
+            await asyncio.sleep(PURGE_INTERVAL_HOURS * 3600)
+
+    async def purge(self):
+        """Delete every game that's been idle too long, yielding to other work between chunks."""
+
+        logging.info('Running the purge')
+        self.running = True
+        self.last_start = datetime.now(timezone.utc)
+        self.last_deleted = 0
+        purge_time = self.last_start - timedelta(days=PURGE_DAYS)
+        purging = True
+        while purging:
+            start = time.perf_counter()
+            purged_keys = await database.transact(self.purge_chunk, purge_time, self.chunk_size)
+            # A reader thread may have fetched the purged games' options just before the purge was committed.
+            self.shards.forget_options(purged_keys)
+            deleted = len(purged_keys)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.last_deleted += deleted
+            self.total_deleted += deleted
+            if deleted:
+                logging.info('Purged %d games in %d ms (%d so far)', deleted, elapsed_ms, self.last_deleted)
+            purging = deleted == self.chunk_size
+            # Keep each chunk within its time budget, and let it grow back when there's room.
+            if elapsed_ms > PURGE_CHUNK_BUDGET_MS:
+                self.chunk_size = max(1, self.chunk_size // 2)
+            elif elapsed_ms < PURGE_CHUNK_BUDGET_MS / 2:
+                self.chunk_size = min(PURGE_CHUNK_SIZE, self.chunk_size * 2)
+            await asyncio.sleep(0)
+        self.running = False
+        self.last_finish = datetime.now(timezone.utc)
+        logging.info('Deleted %d games', self.last_deleted)
+
+    def purge_chunk(self, purge_time, limit):
+        """Purge one chunk of old games from the database, forget them, and return their server and channel pairs. This runs on the database thread."""
+
+        # Record recent activity first, so that we don't purge a game that's in use.
+        activity_tracker.flush()
+        purged_keys = purge(purge_time, limit)
+        self.shards.evict(purged_keys)
+        return purged_keys
+
+    def output(self):
+        """Return a report of purge progress."""
+
+        if not self.last_start:
+            return '**Purge**\nNo purge has run yet.\n'
+        start_formatted = self.last_start.isoformat(sep=' ', timespec='seconds')
+        if self.running:
+            status = 'A purge started at UTC {0} and has deleted {1} games so far.'.format(start_formatted, self.last_deleted)
+        else:
+            status = 'The last purge started at UTC {0} and deleted {1} games.'.format(start_formatted, self.last_deleted)
+        return (
+        '**Purge**\n'
+        '{0}\n'
+        'Purges have deleted {1} games since starting up.\n'
+        ).format(status, self.total_deleted)
+
+class PinUpdater:
+    """Keeps pinned messages up to date in the background, editing each game's pin at most once per interval, with the game's latest information."""
+
+    def __init__(self):
+        self.pending = {}
+        self.tasks = {}
+
+    def schedule(self, game):
+        """Note that a game's pinned message needs an update. Updates that pile up in the meantime become a single edit."""
+
+        key = (game.server, game.channel)
+        self.pending[key] = game
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.ensure_future(self.run(key))
+
+    async def run(self, key):
+        """Edit one game's pinned message for as long as it keeps changing, waiting an interval after every edit."""
+
+        try:
+            while key in self.pending:
+                game = self.pending.pop(key)
+                try:
+                    if game.pinned_message:
+                        # Rendering may load traits, and loading a trait may store it, so it needs a transaction of its own.
+                        await game.pinned_message.edit(content=await database.transact(game.output))
+                except asyncio.CancelledError:
+                    raise
+                except:
+                    # The command that asked for this update has already succeeded, so just note the failure.
+                    logging.error(traceback.format_exc())
+                await asyncio.sleep(PIN_UPDATE_SECONDS)
+        finally:
+            del self.tasks[key]
+
+    def cancel(self):
+        """Stop all pending updates."""
+
+        for task in list(self.tasks.values()):
+            task.cancel()
+
 class CortexPal(commands.Cog):
     """This cog encapsulates the commands and state of the bot."""
 
     def __init__(self, bot):
         """Initialize."""        
         self.bot = bot
-        self.games = []
+        self.shards = shards
         self.warnings = []
         self.startup_time = datetime.now(timezone.utc)
         self.last_command_time = None
-        self.roller = Roller()
+        self.purger = Purger(self.shards)
+        self.purge_task = bot.loop.create_task(self.purger.run_forever())
+        self.activity_task = bot.loop.create_task(activity_tracker.run_forever())
+        self.stats_task = bot.loop.create_task(self.shards.run_forever())
+        self.sim_executor = None
+        self.pins = PinUpdater()
+
+    def cog_unload(self):
+        """Stop background work when the cog goes away."""
+        self.purge_task.cancel()
+        self.activity_task.cancel()
+        self.stats_task.cancel()
+        self.pins.cancel()
+        if self.sim_executor:
+            self.sim_executor.shutdown(wait=False)
+
+    def get_sim_executor(self):
+        """Return the executor for simulations, starting it the first time it's needed."""
+        if not self.sim_executor:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                # Other ways of starting processes would import this whole file again in every worker.
+                self.sim_executor = concurrent.futures.ProcessPoolExecutor(SIM_WORKERS, mp_context=multiprocessing.get_context('fork'))
+            else:
+                self.sim_executor = concurrent.futures.ThreadPoolExecutor(1)
+        return self.sim_executor
+
+    async def cog_before_invoke(self, ctx):
+        """Time every command, and count it as queued on its shard until it finishes."""
+        ctx.command_start = self.shards.get(ctx.guild.shard_id).start_command()
+
+    async def cog_after_invoke(self, ctx):
+        """Record how long a command took on its shard."""
+        self.shards.get(ctx.guild.shard_id).finish_command(ctx.command_start)
 
-    def get_game_info(self, context, suppress_join=False):
+    async def get_game_info(self, context, suppress_join=False):
         """Match a server and channel to a Cortex game."""
+        return await database.transact(self.find_game, context, suppress_join)
+
+    def find_option_as_bool(self, context, key):
+        """Match a server and channel to a Cortex game, and return one of the game's options as a boolean. This runs on the database thread."""
+        return self.find_game(context).get_option_as_bool(key)
+
+    def find_game(self, context, suppress_join=False):
+        """Match a server and channel to a Cortex game. This runs on the database thread."""
         game_info = None
         fallback_game = None
         game_key = [context.guild.id, context.message.channel.id]
         joined_channel = None
+        shard = self.shards.get(context.guild.shard_id)
         while not game_info:
-            for existing_game in self.games:
-                if game_key == existing_game[0]:
-                    game_info = existing_game[1]
+            game_info = shard.games.get(game_key[0], game_key[1])
+            if game_info and not game_info.is_current():
+                self.forget_game(game_info)
+                game_info = None
             if not game_info:
-                game_info = CortexGame(self.roller, game_key[0], game_key[1])
-                self.games.append([game_key, game_info])
+                game_info = CortexGame(shard, game_key[0], game_key[1])
+                shard.games.add(game_info)
             if joined_channel:
                 if game_info.get_option(JOIN_OPTION) != 'on':
                     joined_channel_name = 'other'
@@ -984,6 +2485,9 @@ class CortexPal(commands.Cog):
                             joined_channel_name = channel.name
                     game_info = fallback_game
                     game_info.set_option(JOIN_OPTION, 'off')
+                    game_info.mark_changed()
+                    # Keep the broken join, even though the command itself fails.
+                    database.commit()
                     raise CortexError(JOIN_ERROR, joined_channel_name)
             elif not suppress_join:
                 joined_channel = game_info.get_option(JOIN_OPTION)
@@ -993,6 +2497,36 @@ class CortexPal(commands.Cog):
                     game_key = [context.guild.id, int(joined_channel)]
         return game_info
 
+    async def run_command(self, context, apply, *args):
+        """Find the game for a command and apply the command to it, in a single database transaction. Return the game and the command's result."""
+        return await database.transact(self.find_and_apply, context, apply, *args)
+
+    def find_and_apply(self, context, apply, *args):
+        """Find the game for a command and apply the command to it. This runs on the database thread."""
+        changes = database.changes()
+        game = self.find_game(context)
+        try:
+            result = apply(game, *args)
+        except:
+            # The transaction will be rolled back, so anything in memory that changed along with it is suspect.
+            if database.changes() != changes:
+                self.forget_game(game)
+            raise
+        if database.changes() != changes:
+            game.mark_changed()
+        game.update_activity()
+        return game, result
+
+    def forget_game(self, game):
+        """Drop a game and its options from memory, so they will be fetched again from the database."""
+        game.shard.games.evict([(game.server, game.channel)])
+        game.shard.options.forget(game.server, game.channel)
+
+    def update_pin(self, game):
+        """Update the pinned message, if there is one, with the latest game information. The update happens in the background, so the command's reply needn't wait for it."""
+        if game.pinned_message:
+            self.pins.schedule(game)
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
         """Intercepts any exceptions we haven't specifically caught elsewhere."""
@@ -1004,20 +2538,12 @@ class CortexPal(commands.Cog):
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx):
-        """After every command, determine whether we want to run a purge."""
-        run_purge = False
+        """After every command, track the time, and warn each channel about the shutdown once a day."""
         now = datetime.now(timezone.utc)
         if self.last_command_time:
-            # Run purge after midnight
+            # Warn again after midnight
             if now.day != self.last_command_time.day:
-                run_purge = True
                 self.warnings = []
-        else:
-            # Run purge on first command after startup
-            run_purge = True
-        if run_purge:
-            purge()
-            self.games = []
         self.last_command_time = now
         channel_key = [ctx.guild.id, ctx.message.channel.id]
         if channel_key not in self.warnings:
@@ -1029,9 +2555,7 @@ class CortexPal(commands.Cog):
         """Display all game information."""
 
         try:
-            game = self.get_game_info(ctx)
-            game.update_activity()
-            output = game.output()
+            game, output = await self.run_command(ctx, self.apply_info)
             if game.get_channel() != ctx.message.channel.id:
                 for channel in ctx.guild.channels:
                     if channel.id == game.get_channel():
@@ -1043,6 +2567,11 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_info(self, game):
+        """Return the game's information for the $info and $pin commands."""
+
+        return game.output()
+
     @commands.command()
     async def pin(self, ctx):
         """Pin a message to the channel to hold game information."""
@@ -1051,9 +2580,8 @@ class CortexPal(commands.Cog):
         for pin in pins:
             if pin.author == self.bot.user:
                 await pin.unpin()
-        game = self.get_game_info(ctx)
-        game.update_activity()
-        game.pinned_message = await ctx.send(game.output())
+        game, output = await self.run_command(ctx, self.apply_info)
+        game.pinned_message = await ctx.send(output)
         await game.pinned_message.pin()
 
     @commands.command()
@@ -1073,35 +2601,9 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("comp")
             else:
-                output = ''
-                game = self.get_game_info(ctx)
-                game.update_activity()
-                separated = separate_dice_and_name(args[1:])
-                dice = separated['dice']
-                name = separated['name']
-                update_pin = False
-                if args[0] in ADD_SYNONYMS:
-                    if not dice:
-                        raise CortexError(DIE_MISSING_ERROR)
-                    elif len(dice) > 1:
-                        raise CortexError(DIE_EXCESS_ERROR)
-                    elif dice[0].qty > 1:
-                        raise CortexError(DIE_EXCESS_ERROR)
-                    output = game.complications.add(name, dice[0])
-                    update_pin = True
-                elif args[0] in REMOVE_SYNOYMS:
-                    output = game.complications.remove(name)
-                    update_pin = True
-                elif args[0] in UP_SYNONYMS:
-                    output = game.complications.step_up(name)
-                    update_pin = True
-                elif args[0] in DOWN_SYNONYMS:
-                    output = game.complications.step_down(name)
-                    update_pin = True
-                else:
-                    raise CortexError(INSTRUCTION_ERROR, args[0], '$comp')
-                if update_pin and game.pinned_message:
-                    await game.pinned_message.edit(content=game.output())
+                game, (output, update_pin) = await self.run_command(ctx, self.apply_comp, args)
+                if update_pin:
+                    self.update_pin(game)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1109,6 +2611,36 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_comp(self, game, args):
+        """Carry out a $comp instruction. Return the output, and whether the pinned message needs an update."""
+
+        output = ''
+        separated = separate_dice_and_name(args[1:])
+        dice = separated['dice']
+        name = separated['name']
+        update_pin = False
+        if args[0] in ADD_SYNONYMS:
+            if not dice:
+                raise CortexError(DIE_MISSING_ERROR)
+            elif len(dice) > 1:
+                raise CortexError(DIE_EXCESS_ERROR)
+            elif dice[0].qty > 1:
+                raise CortexError(DIE_EXCESS_ERROR)
+            output = game.complications.add(name, dice[0])
+            update_pin = True
+        elif args[0] in REMOVE_SYNOYMS:
+            output = game.complications.remove(name)
+            update_pin = True
+        elif args[0] in UP_SYNONYMS:
+            output = game.complications.step_up(name)
+            update_pin = True
+        elif args[0] in DOWN_SYNONYMS:
+            output = game.complications.step_down(name)
+            update_pin = True
+        else:
+            raise CortexError(INSTRUCTION_ERROR, args[0], '$comp')
+        return output, update_pin
+
     @commands.command()
     async def pp(self, ctx, *args):
         """
@@ -1125,28 +2657,9 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("pp")
             else:
-                output = ''
-                update_pin = False
-                game = self.get_game_info(ctx)
-                game.update_activity()
-                separated = separate_numbers_and_name(args[1:])
-                name = separated['name']
-                qty = 1
-                if separated['numbers']:
-                    qty = separated['numbers'][0]
-                if args[0] in ADD_SYNONYMS:
-                    output = 'Plot points for ' + game.plot_points.add(name, qty)
-                    update_pin = True
-                elif args[0] in REMOVE_SYNOYMS:
-                    output = 'Plot points for ' + game.plot_points.remove(name, qty)
-                    update_pin = True
-                elif args[0] in CLEAR_SYNONYMS:
-                    output = game.plot_points.clear(name)
-                    update_pin = True
-                else:
-                    raise CortexError(INSTRUCTION_ERROR, args[0], '$pp')
-                if update_pin and game.pinned_message:
-                    await game.pinned_message.edit(content=game.output())
+                game, (output, update_pin) = await self.run_command(ctx, self.apply_pp, args)
+                if update_pin:
+                    self.update_pin(game)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1154,6 +2667,29 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_pp(self, game, args):
+        """Carry out a $pp instruction. Return the output, and whether the pinned message needs an update."""
+
+        output = ''
+        update_pin = False
+        separated = separate_numbers_and_name(args[1:])
+        name = separated['name']
+        qty = 1
+        if separated['numbers']:
+            qty = separated['numbers'][0]
+        if args[0] in ADD_SYNONYMS:
+            output = 'Plot points for ' + game.plot_points.add(name, qty)
+            update_pin = True
+        elif args[0] in REMOVE_SYNOYMS:
+            output = 'Plot points for ' + game.plot_points.remove(name, qty)
+            update_pin = True
+        elif args[0] in CLEAR_SYNONYMS:
+            output = game.plot_points.clear(name)
+            update_pin = True
+        else:
+            raise CortexError(INSTRUCTION_ERROR, args[0], '$pp')
+        return output, update_pin
+
     @commands.command()
     async def roll(self, ctx, *args):
         """
@@ -1175,8 +2711,7 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("roll")
             else:
-                game = self.get_game_info(ctx)
-                suggest_best = game.get_option_as_bool(BEST_OPTION)
+                suggest_best = await database.transact(self.find_option_as_bool, ctx, BEST_OPTION)
                 separated = separate_dice_and_name(args)
                 ignored_strings = separated['name']
                 dice = separated['dice']
@@ -1185,7 +2720,7 @@ class CortexPal(commands.Cog):
                 if ignored_strings:
                     ignored_line = '\n*Ignored: {0}*'.format(ignored_strings)
                 """
-                pool = DicePool(self.roller, None, incoming_dice=dice)
+                pool = DicePool(self.shards.get(ctx.guild.shard_id).roller.for_server(ctx.guild.id), None, incoming_dice=dice)
                 echo_line = 'Rolling: {0}\n'.format(pool.output())
                 await ctx.send(echo_line + pool.roll(suggest_best))
         except CortexError as err:
@@ -1194,6 +2729,93 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    @commands.command()
+    async def odds(self, ctx, *args):
+        """
+        Work out the odds for some dice, using the best total and the biggest remaining die for the effect.
+
+        For example:
+        $odds 8 8 10 (shows the chances of beating each difficulty with 2D8 and a D10)
+        $odds 2d8 10 vs 11 (also shows the chance of beating a difficulty of 11)
+
+        Like the $roll command, this command ignores any words that don't look like dice.
+        """
+
+        logging.debug("odds command invoked")
+        try:
+            if not args:
+                await ctx.send_help("odds")
+            else:
+                difficulty = None
+                if len(args) >= 2 and args[-2].lower() in VERSUS_SYNONYMS and args[-1].isdecimal():
+                    difficulty = int(args[-1])
+                    args = args[:-2]
+                separated = separate_dice_and_name(args)
+                pool = DicePool(None, None, incoming_dice=separated['dice'])
+                echo_line = 'Odds for: {0}\n'.format(pool.output())
+                # Big pools take a moment to work out, so keep the event loop free in the meantime.
+                output = await self.bot.loop.run_in_executor(None, pool.odds, difficulty)
+                await ctx.send(echo_line + output)
+        except CortexError as err:
+            await ctx.send(err)
+        except:
+            logging.error(traceback.format_exc())
+            await ctx.send(UNEXPECTED_ERROR)
+
+    @commands.command()
+    async def sim(self, ctx, *args):
+        """
+        Simulate many rolls of some dice, alone or against a difficulty or other dice.
+
+        For example:
+        $sim 8 8 10 (simulates rolling 2D8 and a D10)
+        $sim 2d8 10 vs 11 (also shows how often the total beats a difficulty of 11)
+        $sim 2d8 10 vs 6 2d10 (also shows how often 2D8 and a D10 win against a D6 and 2D10)
+        $sim 2d8 10 trials 50000 seed 42 (simulates 50000 rolls, the same way every time)
+
+        After "vs", give a single number for a difficulty. To oppose a single die, use D notation, like "vs d12".
+        """
+
+        logging.debug("sim command invoked")
+        try:
+            if not args:
+                await ctx.send_help("sim")
+            else:
+                trials = SIM_TRIALS
+                seed = None
+                words = []
+                index = 0
+                while index < len(args):
+                    if args[index].lower() in ['trials', 'seed'] and index + 1 < len(args) and args[index + 1].isdecimal():
+                        if args[index].lower() == 'trials':
+                            trials = max(int(args[index + 1]), 1)
+                        else:
+                            seed = int(args[index + 1])
+                        index += 2
+                    else:
+                        words.append(args[index])
+                        index += 1
+                opponent = None
+                for index, word in enumerate(words):
+                    if word.lower() in VERSUS_SYNONYMS:
+                        opposing_words = words[index + 1:]
+                        words = words[:index]
+                        if len(opposing_words) == 1 and opposing_words[0].isdecimal():
+                            opponent = int(opposing_words[0])
+                        else:
+                            opponent = DicePool(None, None, incoming_dice=separate_dice_and_name(opposing_words)['dice'])
+                        break
+                pool = DicePool(None, None, incoming_dice=separate_dice_and_name(words)['dice'])
+                echo_line = 'Simulating: {0}\n'.format(pool.output())
+                simulate = functools.partial(pool.simulate, opponent, trials, seed, self.get_sim_executor())
+                output = await self.bot.loop.run_in_executor(None, simulate)
+                await ctx.send(echo_line + output)
+        except CortexError as err:
+            await ctx.send(err)
+        except:
+            logging.error(traceback.format_exc())
+            await ctx.send(UNEXPECTED_ERROR)
+
     @commands.command()
     async def pool(self, ctx, *args):
         """
@@ -1212,31 +2834,9 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("pool")
             else:
-                output = ''
-                update_pin = False
-                game = self.get_game_info(ctx)
-                game.update_activity()
-                suggest_best = game.get_option_as_bool(BEST_OPTION)
-                separated = separate_dice_and_name(args[1:])
-                dice = separated['dice']
-                name = separated['name']
-                if args[0] in ADD_SYNONYMS:
-                    output = game.pools.add(name, dice)
-                    update_pin = True
-                elif args[0] in REMOVE_SYNOYMS:
-                    output = game.pools.remove(name, dice)
-                    update_pin = True
-                elif args[0] in CLEAR_SYNONYMS:
-                    output = game.pools.clear(name)
-                    update_pin = True
-                elif args[0] == 'roll':
-                    temp_pool = game.pools.temporary_copy(name)
-                    temp_pool.add(dice)
-                    output = temp_pool.roll(suggest_best)
-                else:
-                    raise CortexError(INSTRUCTION_ERROR, args[0], '$pool')
-                if update_pin and game.pinned_message:
-                    await game.pinned_message.edit(content=game.output())
+                game, (output, update_pin) = await self.run_command(ctx, self.apply_pool, args)
+                if update_pin:
+                    self.update_pin(game)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1244,6 +2844,32 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_pool(self, game, args):
+        """Carry out a $pool instruction. Return the output, and whether the pinned message needs an update."""
+
+        output = ''
+        update_pin = False
+        suggest_best = game.get_option_as_bool(BEST_OPTION)
+        separated = separate_dice_and_name(args[1:])
+        dice = separated['dice']
+        name = separated['name']
+        if args[0] in ADD_SYNONYMS:
+            output = game.pools.add(name, dice)
+            update_pin = True
+        elif args[0] in REMOVE_SYNOYMS:
+            output = game.pools.remove(name, dice)
+            update_pin = True
+        elif args[0] in CLEAR_SYNONYMS:
+            output = game.pools.clear(name)
+            update_pin = True
+        elif args[0] == 'roll':
+            temp_pool = game.pools.temporary_copy(name)
+            temp_pool.add(dice)
+            output = temp_pool.roll(suggest_best)
+        else:
+            raise CortexError(INSTRUCTION_ERROR, args[0], '$pool')
+        return output, update_pin
+
     @commands.command()
     async def stress(self, ctx, *args):
         """
@@ -1263,43 +2889,9 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("stress")
             else:
-                output = ''
-                update_pin = False
-                game = self.get_game_info(ctx)
-                game.update_activity()
-                separated = separate_dice_and_name(args[1:])
-                dice = separated['dice']
-                split_name = separated['name'].split(' ', maxsplit=1)
-                owner_name = split_name[0]
-                if len(split_name) == 1:
-                    stress_name = UNTYPED_STRESS
-                else:
-                    stress_name = split_name[1]
-                if args[0] in ADD_SYNONYMS:
-                    if not dice:
-                        raise CortexError(DIE_MISSING_ERROR)
-                    elif len(dice) > 1:
-                        raise CortexError(DIE_EXCESS_ERROR)
-                    elif dice[0].qty > 1:
-                        raise CortexError(DIE_EXCESS_ERROR)
-                    output = '{0} Stress for {1}'.format(game.stress.add(owner_name, stress_name, dice[0]), owner_name)
-                    update_pin = True
-                elif args[0] in REMOVE_SYNOYMS:
-                    output = '{0} Stress for {1}'.format(game.stress.remove(owner_name, stress_name), owner_name)
-                    update_pin = True
-                elif args[0] in UP_SYNONYMS:
-                    output = '{0} Stress for {1}'.format(game.stress.step_up(owner_name, stress_name), owner_name)
-                    update_pin = True
-                elif args[0] in DOWN_SYNONYMS:
-                    output = '{0} Stress for {1}'.format(game.stress.step_down(owner_name, stress_name), owner_name)
-                    update_pin = True
-                elif args[0] in CLEAR_SYNONYMS:
-                    output = game.stress.clear(owner_name)
-                    update_pin = True
-                else:
-                    raise CortexError(INSTRUCTION_ERROR, args[0], '$stress')
-                if update_pin and game.pinned_message:
-                    await game.pinned_message.edit(content=game.output())
+                game, (output, update_pin) = await self.run_command(ctx, self.apply_stress, args)
+                if update_pin:
+                    self.update_pin(game)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1307,6 +2899,42 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_stress(self, game, args):
+        """Carry out a $stress instruction. Return the output, and whether the pinned message needs an update."""
+
+        output = ''
+        update_pin = False
+        parsed = parse_arguments(tuple(args[1:]))
+        dice = [Die(size=size, qty=qty) for size, qty in parsed.dice]
+        owner_name = parsed.name_head
+        stress_name = parsed.name_tail
+        if stress_name is None:
+            stress_name = UNTYPED_STRESS
+        if args[0] in ADD_SYNONYMS:
+            if not dice:
+                raise CortexError(DIE_MISSING_ERROR)
+            elif len(dice) > 1:
+                raise CortexError(DIE_EXCESS_ERROR)
+            elif dice[0].qty > 1:
+                raise CortexError(DIE_EXCESS_ERROR)
+            output = '{0} Stress for {1}'.format(game.stress.add(owner_name, stress_name, dice[0]), owner_name)
+            update_pin = True
+        elif args[0] in REMOVE_SYNOYMS:
+            output = '{0} Stress for {1}'.format(game.stress.remove(owner_name, stress_name), owner_name)
+            update_pin = True
+        elif args[0] in UP_SYNONYMS:
+            output = '{0} Stress for {1}'.format(game.stress.step_up(owner_name, stress_name), owner_name)
+            update_pin = True
+        elif args[0] in DOWN_SYNONYMS:
+            output = '{0} Stress for {1}'.format(game.stress.step_down(owner_name, stress_name), owner_name)
+            update_pin = True
+        elif args[0] in CLEAR_SYNONYMS:
+            output = game.stress.clear(owner_name)
+            update_pin = True
+        else:
+            raise CortexError(INSTRUCTION_ERROR, args[0], '$stress')
+        return output, update_pin
+
     @commands.command()
     async def asset(self, ctx, *args):
         """
@@ -1325,35 +2953,9 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("asset")
             else:
-                output = ''
-                game = self.get_game_info(ctx)
-                game.update_activity()
-                separated = separate_dice_and_name(args[1:])
-                dice = separated['dice']
-                name = separated['name']
-                update_pin = False
-                if args[0] in ADD_SYNONYMS:
-                    if not dice:
-                        raise CortexError(DIE_MISSING_ERROR)
-                    elif len(dice) > 1:
-                        raise CortexError(DIE_EXCESS_ERROR)
-                    elif dice[0].qty > 1:
-                        raise CortexError(DIE_EXCESS_ERROR)
-                    output = game.assets.add(name, dice[0])
-                    update_pin = True
-                elif args[0] in REMOVE_SYNOYMS:
-                    output = game.assets.remove(name)
-                    update_pin = True
-                elif args[0] in UP_SYNONYMS:
-                    output = game.assets.step_up(name)
-                    update_pin = True
-                elif args[0] in DOWN_SYNONYMS:
-                    output = game.assets.step_down(name)
-                    update_pin = True
-                else:
-                    raise CortexError(INSTRUCTION_ERROR, args[0], '$asset')
-                if update_pin and game.pinned_message:
-                    await game.pinned_message.edit(content=game.output())
+                game, (output, update_pin) = await self.run_command(ctx, self.apply_asset, args)
+                if update_pin:
+                    self.update_pin(game)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1361,6 +2963,36 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_asset(self, game, args):
+        """Carry out an $asset instruction. Return the output, and whether the pinned message needs an update."""
+
+        output = ''
+        separated = separate_dice_and_name(args[1:])
+        dice = separated['dice']
+        name = separated['name']
+        update_pin = False
+        if args[0] in ADD_SYNONYMS:
+            if not dice:
+                raise CortexError(DIE_MISSING_ERROR)
+            elif len(dice) > 1:
+                raise CortexError(DIE_EXCESS_ERROR)
+            elif dice[0].qty > 1:
+                raise CortexError(DIE_EXCESS_ERROR)
+            output = game.assets.add(name, dice[0])
+            update_pin = True
+        elif args[0] in REMOVE_SYNOYMS:
+            output = game.assets.remove(name)
+            update_pin = True
+        elif args[0] in UP_SYNONYMS:
+            output = game.assets.step_up(name)
+            update_pin = True
+        elif args[0] in DOWN_SYNONYMS:
+            output = game.assets.step_down(name)
+            update_pin = True
+        else:
+            raise CortexError(INSTRUCTION_ERROR, args[0], '$asset')
+        return output, update_pin
+
     @commands.command()
     async def xp(self, ctx, *args):
         """
@@ -1377,28 +3009,9 @@ class CortexPal(commands.Cog):
             if not args:
                 await ctx.send_help("xp")
             else:
-                output = ''
-                update_pin = False
-                game = self.get_game_info(ctx)
-                game.update_activity()
-                separated = separate_numbers_and_name(args[1:])
-                name = separated['name']
-                qty = 1
-                if separated['numbers']:
-                    qty = separated['numbers'][0]
-                if args[0] in ADD_SYNONYMS:
-                    output = 'Experience points for ' + game.xp.add(name, qty)
-                    update_pin = True
-                elif args[0] in REMOVE_SYNOYMS:
-                    output = 'Experience points for ' + game.xp.remove(name, qty)
-                    update_pin = True
-                elif args[0] in CLEAR_SYNONYMS:
-                    output = game.xp.clear(name)
-                    update_pin = True
-                else:
-                    raise CortexError(INSTRUCTION_ERROR, args[0], '$xp')
-                if update_pin and game.pinned_message:
-                    await game.pinned_message.edit(content=game.output())
+                game, (output, update_pin) = await self.run_command(ctx, self.apply_xp, args)
+                if update_pin:
+                    self.update_pin(game)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1406,6 +3019,101 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_xp(self, game, args):
+        """Carry out an $xp instruction. Return the output, and whether the pinned message needs an update."""
+
+        output = ''
+        update_pin = False
+        separated = separate_numbers_and_name(args[1:])
+        name = separated['name']
+        qty = 1
+        if separated['numbers']:
+            qty = separated['numbers'][0]
+        if args[0] in ADD_SYNONYMS:
+            output = 'Experience points for ' + game.xp.add(name, qty)
+            update_pin = True
+        elif args[0] in REMOVE_SYNOYMS:
+            output = 'Experience points for ' + game.xp.remove(name, qty)
+            update_pin = True
+        elif args[0] in CLEAR_SYNONYMS:
+            output = game.xp.clear(name)
+            update_pin = True
+        else:
+            raise CortexError(INSTRUCTION_ERROR, args[0], '$xp')
+        return output, update_pin
+
+    @commands.command()
+    async def batch(self, ctx, *, script=None):
+        """
+        Run several commands at once, one per line. Either every command succeeds, or nothing changes.
+
+        For example:
+        $batch
+        ```
+        comp add 6 on fire
+        asset add 8 rope
+        stress add amy 8
+        pp add amy 2
+        pool add doom 6 6
+        ```
+
+        You may use the comp, asset, stress, pp, xp, and pool commands, with or without the command prefix.
+        """
+
+        logging.debug("batch command invoked")
+        try:
+            if not script:
+                await ctx.send_help("batch")
+            else:
+                game, (outputs, update_pin) = await self.run_command(ctx, self.apply_batch, script)
+                if update_pin:
+                    self.update_pin(game)
+                # A long script's output can outgrow a single message.
+                for message in split_message(['\n' + output for output in outputs]):
+                    await ctx.send(message)
+        except CortexError as err:
+            await ctx.send(err)
+        except:
+            logging.error(traceback.format_exc())
+            await ctx.send(UNEXPECTED_ERROR)
+
+    def apply_batch(self, game, script):
+        """Carry out every line of a $batch script. Return the output of each line, and whether the pinned message needs an update."""
+
+        instructions = {
+            'comp': self.apply_comp,
+            'asset': self.apply_asset,
+            'stress': self.apply_stress,
+            'pp': self.apply_pp,
+            'xp': self.apply_xp,
+            'pool': self.apply_pool
+        }
+        prefix = game.get_option(PREFIX_OPTION) or PREFIX
+        lines = script.strip().strip('`').strip().splitlines()
+        # A code block may name its language on the first line.
+        if lines and len(lines[0].split()) == 1 and lines[0].strip().lstrip(prefix) not in instructions:
+            lines = lines[1:]
+        outputs = []
+        update_pin = False
+        for number, line in enumerate(lines, start=1):
+            words = line.split()
+            if not words:
+                continue
+            command = words[0].lower()
+            if command.startswith(prefix):
+                command = command[len(prefix):]
+            try:
+                if not command in instructions or len(words) < 2:
+                    raise CortexError(UNKNOWN_COMMAND_ERROR)
+                output, line_update_pin = instructions[command](game, tuple(words[1:]))
+            except CortexError as err:
+                raise CortexError(BATCH_LINE_ERROR, number, line.strip(), err)
+            outputs.append(output)
+            update_pin = update_pin or line_update_pin
+        if not outputs:
+            raise CortexError(BATCH_EMPTY_ERROR)
+        return outputs, update_pin
+
     @commands.command()
     async def clean(self, ctx):
         """
@@ -1414,11 +3122,8 @@ class CortexPal(commands.Cog):
 
         logging.debug("clean command invoked")
         try:
-            game = self.get_game_info(ctx)
-            game.update_activity()
-            game.clean()
-            if game.pinned_message:
-                await game.pinned_message.edit(content=game.output())
+            game, output = await self.run_command(ctx, self.apply_clean)
+            self.update_pin(game)
             await ctx.send('Cleaned up all game information.')
         except CortexError as err:
             await ctx.send(err)
@@ -1426,26 +3131,55 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
+    def apply_clean(self, game):
+        """Carry out a $clean command."""
+
+        game.clean()
+
     @commands.command()
-    async def report(self, ctx):
+    async def report(self, ctx, *args):
         """
         Report the bot's statistics.
-        """
-
-        start_formatted = self.startup_time.isoformat(sep=' ', timespec='seconds')
-        last_formatted = '(no user commands yet)'
-        if self.last_command_time:
-            last_formatted = self.last_command_time.isoformat(sep=' ', timespec='seconds')
 
-        output = (
-        '**CortexPal Usage Report**\n'
-        'Bot started up at UTC {0}.\n'
-        'Last user command was at UTC {1}.\n'
-        '\n'
-        ).format(start_formatted, last_formatted)
+        For example:
+        $report (counts die rolls since the bot started up)
+        $report all (counts all die rolls ever recorded)
+        $report server (counts all die rolls ever recorded on this server)
+        """
 
-        output += self.roller.output()
-        await ctx.send(output)
+        try:
+            start_formatted = self.startup_time.isoformat(sep=' ', timespec='seconds')
+            last_formatted = '(no user commands yet)'
+            if self.last_command_time:
+                last_formatted = self.last_command_time.isoformat(sep=' ', timespec='seconds')
+
+            sections = [(
+            '**CortexPal Usage Report**\n'
+            'Bot started up at UTC {0}.\n'
+            'Last user command was at UTC {1}.\n'
+            ).format(start_formatted, last_formatted)]
+
+            shard = self.shards.get(ctx.guild.shard_id)
+            sections.append('\n' + shard.games.output())
+            latencies = dict(getattr(self.bot, 'latencies', [(0, getattr(self.bot, 'latency', None))]))
+            sections.append('\n' + self.shards.output(latencies))
+            sections.append('\n' + self.purger.output())
+            if args and args[0] == 'all':
+                await database.transact(self.shards.flush)
+                results = await database.read(self.shards.read_results)
+                sections.append('\n' + output_roll_frequencies(results, 'in all'))
+            elif args and args[0] == 'server':
+                await database.transact(self.shards.flush)
+                results = await database.read(self.shards.read_results, ctx.guild.id)
+                sections.append('\n' + output_roll_frequencies(results, 'on this server in all'))
+            else:
+                sections.append('\n' + output_roll_frequencies(self.shards.results(), 'since starting up'))
+            # The report can outgrow a single message, especially with many shards.
+            for message in split_message(sections):
+                await ctx.send(message)
+        except:
+            logging.error(traceback.format_exc())
+            await ctx.send(UNEXPECTED_ERROR)
 
     @commands.command()
     async def option(self, ctx, *args):
@@ -1460,40 +3194,11 @@ class CortexPal(commands.Cog):
         $option join off (break and prohibit joins between this channel and other channels)
         $option join #other-channel (all commands from this channel apply to the game in #other-channel)
         """
-        game = self.get_game_info(ctx)
-        game.update_activity()
-        output = 'No such option.'
-
         try:
             if not args:
                 await ctx.send_help("option")
             else:
-                if args[0] == PREFIX_OPTION:
-                    if len(args[1]) > 1:
-                        output = 'Prefix must be a single character.'
-                    else:
-                        game.set_option(PREFIX_OPTION, args[1])
-                        output = 'Prefix set to {0}'.format(args[1])
-                elif args[0] == BEST_OPTION:
-                    if args[1] == 'on' or args[1] == 'off':
-                        game.set_option(BEST_OPTION, args[1])
-                        output = 'Option to suggest best total and effect is now {0}.'.format(args[1])
-                    else:
-                        output = 'You may only set this option to "on" or "off".'
-                elif args[0] == JOIN_OPTION:
-                    game = self.get_game_info(ctx, True)
-                    if args[1] == 'on':
-                        game.set_option(JOIN_OPTION, 'on')
-                        output = 'Other channels may now join this channel.'
-                    elif args[1] == 'off':
-                        game.set_option(JOIN_OPTION, 'off')
-                        output = 'This channel now does not join or accept joins from other channels.'
-                    elif ctx.message.channel_mentions:
-                        game.set_option(JOIN_OPTION, ctx.message.channel_mentions[0].id)
-                        joined_game = self.get_game_info(ctx)
-                        output = 'Joining the #{0} channel.'.format(ctx.message.channel_mentions[0].name)
-                    else:
-                        output = 'You may only set this option to "on" or "off" or the name of another channel.'
+                output = await database.transact(self.apply_option, ctx, args)
                 await ctx.send(output)
         except CortexError as err:
             await ctx.send(err)
@@ -1501,13 +3206,68 @@ class CortexPal(commands.Cog):
             logging.error(traceback.format_exc())
             await ctx.send(UNEXPECTED_ERROR)
 
-# Set up bot.
+    def apply_option(self, ctx, args):
+        """Carry out an $option command, and return the output."""
+
+        changes = database.changes()
+        game = self.find_game(ctx)
+        game.update_activity()
+        output = 'No such option.'
+        if args[0] == PREFIX_OPTION:
+            if len(args[1]) > 1:
+                output = 'Prefix must be a single character.'
+            else:
+                game.set_option(PREFIX_OPTION, args[1])
+                output = 'Prefix set to {0}'.format(args[1])
+        elif args[0] == BEST_OPTION:
+            if args[1] == 'on' or args[1] == 'off':
+                game.set_option(BEST_OPTION, args[1])
+                output = 'Option to suggest best total and effect is now {0}.'.format(args[1])
+            else:
+                output = 'You may only set this option to "on" or "off".'
+        elif args[0] == JOIN_OPTION:
+            game = self.find_game(ctx, True)
+            if args[1] == 'on':
+                game.set_option(JOIN_OPTION, 'on')
+                output = 'Other channels may now join this channel.'
+            elif args[1] == 'off':
+                game.set_option(JOIN_OPTION, 'off')
+                output = 'This channel now does not join or accept joins from other channels.'
+            elif ctx.message.channel_mentions:
+                game.set_option(JOIN_OPTION, ctx.message.channel_mentions[0].id)
+                joined_game = self.find_game(ctx)
+                output = 'Joining the #{0} channel.'.format(ctx.message.channel_mentions[0].name)
+            else:
+                output = 'You may only set this option to "on" or "off" or the name of another channel.'
+        if database.changes() != changes:
+            game.mark_changed()
+        return output
+
+if __name__ == '__main__':
+
+    # Set up logging.
+
+    logHandler = logging.handlers.TimedRotatingFileHandler(filename=config['logging']['file'], when='D', backupCount=9)
+    logging.basicConfig(handlers=[logHandler], format='%(asctime)s %(message)s', level=logging.INFO)
+
+    # Set up database.
+
+    start_storage(open_storage())
+
+    # Set up bot.
 
-TOKEN = config['discord']['token']
-bot = commands.Bot(command_prefix=get_prefix, description=ABOUT_TEXT)
+    TOKEN = config['discord']['token']
+    if SHARDED:
+        bot = commands.AutoShardedBot(command_prefix=get_prefix, description=ABOUT_TEXT, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+    else:
+        bot = commands.Bot(command_prefix=get_prefix, description=ABOUT_TEXT)
 
-# Start the bot.
+    # Start the bot.
 
-logging.info("Bot startup")
-bot.add_cog(CortexPal(bot))
-bot.run(TOKEN)
+    logging.info("Bot startup")
+    cortex_pal = CortexPal(bot)
+    bot.add_cog(cortex_pal)
+    bot.run(TOKEN)
+    database.transact_now(activity_tracker.flush)
+    database.transact_now(shards.flush)
+    database.close()
@@ -0,0 +1,92 @@
+"""
+Measure how late the event loop wakes up while commands write to a slow disk.
+
+Every commit is slowed down to stand in for a slow disk. A ticker on the event loop asks to wake up every millisecond, and records how late it wakes, while several channels run commands at once. The same commands run twice: once with database work on the worker thread, as the bot does, and once blocking the event loop until the worker finishes, as the bot did before it had a worker thread.
+
+Run it with "python bench_event_loop.py".
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import CortexPal
+import migrate
+from test_bot import Context, launch_bot
+
+COMMIT_DELAY = 0.01
+CHANNELS = 4
+COMMANDS = 25
+TICK = 0.001
+
+class SlowStorage(CortexPal.SQLiteStorage):
+    """SQLite storage on a disk that takes a while to commit."""
+
+    def commit(self):
+        time.sleep(COMMIT_DELAY)
+        super().commit()
+
+async def tick(lags, done):
+    """Sleep a millisecond at a time until told to stop, recording how late each wake-up came."""
+
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+async def play(cog, channel_id):
+    """Run a channel's commands one after another, like a group in the middle of a game."""
+
+    ctx = Context(1, channel_id)
+    for num in range(COMMANDS):
+        await cog.pp(ctx, 'add', 'amy')
+        await cog.comp(ctx, 'add', '6', 'fire{0}'.format(num))
+        await cog.pool(ctx, 'add', 'doom', '8')
+
+async def measure(cog):
+    lags = []
+    done = asyncio.Event()
+    ticker = asyncio.ensure_future(tick(lags, done))
+    start = time.perf_counter()
+    await asyncio.gather(*[play(cog, channel_id) for channel_id in range(1, CHANNELS + 1)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker
+    return elapsed, lags
+
+def run(on_loop):
+    directory = tempfile.TemporaryDirectory()
+    filename = os.path.join(directory.name, 'cortexpal.db')
+    migrate.upgrade(filename)
+    loop, cog, stop = launch_bot(SlowStorage(filename))
+    if on_loop:
+        database = CortexPal.database
+
+        async def run_blocking(function, *args):
+            # The event loop waits for the worker, just as if it ran the work itself.
+            return database.executor.submit(function, *args).result()
+
+        database.run = run_blocking
+    try:
+        elapsed, lags = loop.run_until_complete(measure(cog))
+    finally:
+        stop()
+        directory.cleanup()
+    lags.sort()
+    print('{0:<16} {1:>7.2f} s {2:>9} {3:>9.1f} ms {4:>9.1f} ms {5:>9.1f} ms'.format(
+        'event loop' if on_loop else 'worker thread', elapsed, len(lags),
+        statistics.median(lags) * 1000, lags[int(len(lags) * 0.95)] * 1000, lags[-1] * 1000))
+
+def main():
+    logging.getLogger('discord').setLevel(logging.ERROR)
+    print('{0} channels, {1} commands each, {2:.0f} ms per commit'.format(CHANNELS, COMMANDS * 3, COMMIT_DELAY * 1000))
+    print('{0:<16} {1:>9} {2:>9} {3:>12} {4:>12} {5:>12}'.format('database work', 'time', 'ticks', 'median lag', 'p95 lag', 'max lag'))
+    for on_loop in [True, False]:
+        run(on_loop)
+
+if __name__ == '__main__':
+    main()
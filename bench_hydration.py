@@ -0,0 +1,69 @@
+"""
+Measure how long a game takes to load from storage, and how many SQL statements that takes, as the game grows.
+
+Each game has as many characters as pools. Every character has plot points and stress, and every pool has dice of two sizes. The game is dropped from memory before each $info, so every $info loads it again. Statements are counted with a SQLite trace callback, so only the SQLite backend counts them.
+
+Run it with "python bench_hydration.py".
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+import CortexPal
+import migrate
+from test_bot import Context, launch_bot
+
+SIZES = [1, 10, 50, 100]
+REPEATS = 20
+
+def build_game(loop, cog, ctx, size):
+    for num in range(size):
+        name = 'hero{0}'.format(num)
+        loop.run_until_complete(cog.pp(ctx, 'add', name, '2'))
+        loop.run_until_complete(cog.stress(ctx, 'add', name, '8', 'afraid'))
+        loop.run_until_complete(cog.pool(ctx, 'add', 'pool{0}'.format(num), '6', '2d8'))
+
+def forget_game():
+    games = CortexPal.shards.get(None).games
+    games.evict(list(games.games))
+
+def measure(backend, size):
+    directory = tempfile.TemporaryDirectory()
+    if backend == 'sqlite':
+        filename = os.path.join(directory.name, 'cortexpal.db')
+        migrate.upgrade(filename)
+        new_storage = CortexPal.SQLiteStorage(filename)
+    else:
+        new_storage = CortexPal.MemoryStorage()
+    loop, cog, stop = launch_bot(new_storage)
+    ctx = Context(1, 1)
+    try:
+        build_game(loop, cog, ctx, size)
+        statements = []
+        if backend == 'sqlite':
+            CortexPal.database.transact_now(CortexPal.storage.connection.set_trace_callback, statements.append)
+        forget_game()
+        loop.run_until_complete(cog.info(ctx))
+        count = len(statements)
+        elapsed = 0
+        for repeat in range(REPEATS):
+            forget_game()
+            start = time.perf_counter()
+            loop.run_until_complete(cog.info(ctx))
+            elapsed += time.perf_counter() - start
+    finally:
+        stop()
+        directory.cleanup()
+    print('{0:<8} {1:>10} {2:>12} {3:>12.2f} ms'.format(backend, size, count if backend == 'sqlite' else '-', elapsed / REPEATS * 1000))
+
+def main():
+    logging.getLogger('discord').setLevel(logging.ERROR)
+    print('{0:<8} {1:>10} {2:>12} {3:>15}'.format('backend', 'size', 'statements', 'cold $info'))
+    for backend in ['sqlite', 'memory']:
+        for size in SIZES:
+            measure(backend, size)
+
+if __name__ == '__main__':
+    main()
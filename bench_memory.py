@@ -0,0 +1,98 @@
+"""
+Measure the memory a loaded game holds on to, and the time and memory a $pool roll takes.
+
+The game holds 10 assets, 10 complications, 5 characters with stress, and 5 pools with dice of every size. Memory is traced with tracemalloc, after a first load has warmed up any caches. Rolls are timed both as whole commands, including the trip to the database thread, and as the pool work alone.
+
+Run it with "python bench_memory.py".
+"""
+
+import gc
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import CortexPal
+import migrate
+from test_bot import Context, launch_bot
+
+ROLLS = 2000
+ROLL = ('roll', 'pool0', '8')
+
+def build_game(loop, cog, ctx):
+    for num in range(10):
+        loop.run_until_complete(cog.asset(ctx, 'add', '6', 'asset{0}'.format(num)))
+        loop.run_until_complete(cog.comp(ctx, 'add', '8', 'complication{0}'.format(num)))
+    for num in range(5):
+        name = 'hero{0}'.format(num)
+        loop.run_until_complete(cog.stress(ctx, 'add', name, 'mental', '6'))
+        loop.run_until_complete(cog.stress(ctx, 'add', name, 'physical', '8'))
+        loop.run_until_complete(cog.pool(ctx, 'add', 'pool{0}'.format(num), '4', '6', '8', '10', '12'))
+
+def forget_game():
+    games = CortexPal.shards.get(None).games
+    games.evict(list(games.games))
+
+def load_game(loop, cog, ctx):
+    """Load the game from storage, and return how many bytes it keeps allocated."""
+
+    forget_game()
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    loop.run_until_complete(cog.info(ctx))
+    ctx.sent.clear()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before
+
+def roll_pool(cog, ctx):
+    """On the database thread, time many pool rolls, then trace one. Return the time per roll and the most memory one roll had allocated at once."""
+
+    game = cog.find_game(ctx)
+    start = time.perf_counter()
+    for num in range(ROLLS):
+        cog.apply_pool(game, ROLL)
+    elapsed = (time.perf_counter() - start) / ROLLS
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    cog.apply_pool(game, ROLL)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return elapsed, peak
+
+def measure(backend):
+    directory = tempfile.TemporaryDirectory()
+    if backend == 'sqlite':
+        filename = os.path.join(directory.name, 'cortexpal.db')
+        migrate.upgrade(filename)
+        new_storage = CortexPal.SQLiteStorage(filename)
+    else:
+        new_storage = CortexPal.MemoryStorage()
+    loop, cog, stop = launch_bot(new_storage)
+    ctx = Context(1, 1)
+    try:
+        build_game(loop, cog, ctx)
+        tracemalloc.start()
+        load_game(loop, cog, ctx)
+        loaded = load_game(loop, cog, ctx)
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for num in range(ROLLS):
+            loop.run_until_complete(cog.pool(ctx, *ROLL))
+        command = (time.perf_counter() - start) / ROLLS
+        ctx.sent.clear()
+        roll, peak = CortexPal.database.transact_now(roll_pool, cog, ctx)
+    finally:
+        stop()
+        directory.cleanup()
+    print('{0:<8} {1:>10.1f} KB {2:>12.0f} us {3:>12.0f} us {4:>12.1f} KB'.format(backend, loaded / 1024, command * 1000000, roll * 1000000, peak / 1024))
+
+def main():
+    logging.getLogger('discord').setLevel(logging.ERROR)
+    print('{0:<8} {1:>13} {2:>15} {3:>15} {4:>15}'.format('backend', 'loaded game', '$pool roll', 'pool work', 'roll peak'))
+    for backend in ['sqlite', 'memory']:
+        measure(backend)
+
+if __name__ == '__main__':
+    main()
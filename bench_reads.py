@@ -0,0 +1,80 @@
+"""
+Measure how long the command-prefix lookup takes while the database is busy writing.
+
+One channel runs 40-line batches back to back, while messages arrive in channels whose options aren't cached yet, so every lookup goes to the database. The lookups run once on reader threads with their own connections, as the bot does, and once taking turns with the writes on the worker thread, as the bot did before it had reader threads.
+
+Run it with "python bench_reads.py".
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import CortexPal
+import migrate
+from test_bot import Context, launch_bot
+
+DURATION = 5
+PAUSE = 0.002
+BATCH = '\n'.join(['pool add doom{0} 6'.format(num) for num in range(20)] + ['pp add hero{0} 1'.format(num) for num in range(20)])
+
+async def write(cog, done, batches):
+    """Run batches back to back until told to stop."""
+
+    ctx = Context(1, 1)
+    while not done.is_set():
+        await cog.batch(ctx, script=BATCH)
+        batches.append(ctx.sent.pop())
+
+async def look_up(latencies):
+    """Look up prefixes for new channels, one at a time with a short pause between, for the length of the benchmark."""
+
+    loop = asyncio.get_running_loop()
+    end = loop.time() + DURATION
+    channel_id = 1000
+    while loop.time() < end:
+        channel_id += 1
+        message = Context(1, channel_id).message
+        start = time.perf_counter()
+        await CortexPal.get_prefix(None, message)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(PAUSE)
+
+async def measure(cog):
+    latencies = []
+    batches = []
+    done = asyncio.Event()
+    writer = asyncio.ensure_future(write(cog, done, batches))
+    await look_up(latencies)
+    done.set()
+    await writer
+    return latencies, batches
+
+def run(concurrent_reads):
+    directory = tempfile.TemporaryDirectory()
+    filename = os.path.join(directory.name, 'cortexpal.db')
+    migrate.upgrade(filename)
+    new_storage = CortexPal.SQLiteStorage(filename)
+    new_storage.concurrent_reads = concurrent_reads
+    loop, cog, stop = launch_bot(new_storage)
+    try:
+        latencies, batches = loop.run_until_complete(measure(cog))
+    finally:
+        stop()
+        directory.cleanup()
+    latencies.sort()
+    print('{0:<14} {1:>8} {2:>8} {3:>9.2f} ms {4:>9.2f} ms {5:>9.2f} ms'.format(
+        'reader threads' if concurrent_reads else 'worker thread', len(batches), len(latencies),
+        statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.95)] * 1000, latencies[-1] * 1000))
+
+def main():
+    logging.getLogger('discord').setLevel(logging.ERROR)
+    print('{0:<14} {1:>8} {2:>8} {3:>12} {4:>12} {5:>12}'.format('lookups on', 'batches', 'lookups', 'median', 'p95', 'max'))
+    for concurrent_reads in [False, True]:
+        run(concurrent_reads)
+
+if __name__ == '__main__':
+    main()
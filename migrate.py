@@ -0,0 +1,386 @@
+"""
+Schema migrations for the CortexPal database.
+
+The bot runs these at startup. You can also run this file by hand, perhaps against a copy of the database, to upgrade it or to see what an upgrade would involve:
+
+python migrate.py cortexpal.db
+python migrate.py --dry-run cortexpal.db
+python migrate.py --check cortexpal.db
+"""
+
+import argparse
+import logging
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+BATCH_SIZE = 5000
+
+# Each table that belongs to a parent, with a condition that finds its rows whose parent no longer exists.
+ORPHANS = [
+    ('GAME_OPTIONS', 'PARENT_GUID NOT IN (SELECT GUID FROM GAME)'),
+    ('DICE_COLLECTION', 'PARENT_GUID NOT IN (SELECT GUID FROM GAME)'),
+    ('RESOURCE', 'PARENT_GUID NOT IN (SELECT GUID FROM GAME)'),
+    ('DIE', 'PARENT_GUID NOT IN (SELECT GUID FROM DICE_COLLECTION)')
+]
+
+class Migrator:
+    """Applies schema changes to one database, or describes them without applying them."""
+
+    def __init__(self, db, dry_run=False, batch_size=BATCH_SIZE):
+        self.db = db
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.rows_per_second = None
+        self.estimated_rows = 0
+        self.estimated_seconds = 0.0
+        if dry_run:
+            return
+        self.db.execute(
+        'CREATE TABLE IF NOT EXISTS SCHEMA_VERSION'
+        '(VERSION INT NOT NULL,'
+        'APPLIED DATETIME NOT NULL)'
+        )
+        self.db.execute(
+        'CREATE TABLE IF NOT EXISTS MIGRATION_PROGRESS'
+        '(TABLE_NAME VARCHAR(64) PRIMARY KEY,'
+        'LAST_ROWID INT NOT NULL)'
+        )
+
+    def version(self):
+        """Identify the schema version of the database."""
+
+        if not self.table_exists('SCHEMA_VERSION'):
+            return 0
+        row = self.db.execute('SELECT MAX(VERSION) FROM SCHEMA_VERSION').fetchone()
+        if row[0] is None:
+            return 0
+        return row[0]
+
+    def table_exists(self, table):
+        """Identify whether a table exists in the database."""
+
+        row = self.db.execute('SELECT COUNT(*) FROM sqlite_master WHERE type="table" AND name=:table', {'table':table}).fetchone()
+        return row[0] > 0
+
+    def columns(self, table):
+        """Return the names of the columns in a table."""
+
+        return [row[1] for row in self.db.execute('PRAGMA table_info({0})'.format(table))]
+
+    def has_foreign_key(self, table, column):
+        """Identify whether a column of a table refers to another table with a foreign key."""
+
+        return any(row[3] == column for row in self.db.execute('PRAGMA foreign_key_list({0})'.format(table)))
+
+    def count_rows(self, table):
+        """Count the rows in a table, treating a missing table as empty."""
+
+        if not self.table_exists(table):
+            return 0
+        return self.db.execute('SELECT COUNT(*) FROM {0}'.format(table)).fetchone()[0]
+
+    def measure(self, table):
+        """Estimate how quickly we can copy rows, by timing a sample copy that we then roll back."""
+
+        if self.rows_per_second or not self.table_exists(table):
+            return
+        self.db.execute('BEGIN')
+        start = time.perf_counter()
+        self.db.execute('CREATE TEMP TABLE MIGRATION_SAMPLE AS SELECT * FROM {0} LIMIT {1}'.format(table, self.batch_size))
+        copied = self.db.execute('SELECT COUNT(*) FROM MIGRATION_SAMPLE').fetchone()[0]
+        elapsed = time.perf_counter() - start
+        self.db.execute('ROLLBACK')
+        if copied:
+            self.rows_per_second = copied / max(elapsed, 0.000001)
+
+    def estimate(self, description, table):
+        """Report, instead of performing, a step that touches every row of a table."""
+
+        self.measure(table)
+        rows = self.count_rows(table)
+        seconds = 0.0
+        if self.rows_per_second:
+            seconds = rows / self.rows_per_second
+        self.estimated_rows += rows
+        self.estimated_seconds += seconds
+        logging.info('Would %s: %d rows, about %.1f seconds', description, rows, seconds)
+
+    def execute(self, sql):
+        """Run a single schema statement."""
+
+        if self.dry_run:
+            logging.info('Would execute: %s', sql)
+        else:
+            self.db.execute(sql)
+
+    def create_index(self, name, table, columns):
+        """Create an index if it doesn't already exist."""
+
+        if self.dry_run:
+            self.estimate('create index {0} on {1}'.format(name, table), table)
+        else:
+            self.db.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'.format(name, table, columns))
+
+    def count_orphans(self):
+        """Count the rows in each table whose parent no longer exists."""
+
+        counts = {}
+        for table, condition in ORPHANS:
+            counts[table] = 0
+            if self.table_exists(table):
+                counts[table] = self.db.execute('SELECT COUNT(*) FROM {0} WHERE {1}'.format(table, condition)).fetchone()[0]
+        return counts
+
+    def delete_orphans(self):
+        """Delete the rows in each table whose parent no longer exists."""
+
+        if self.dry_run:
+            for table, count in self.count_orphans().items():
+                logging.info('Would delete %d orphaned rows from %s', count, table)
+            return
+        self.db.execute('BEGIN')
+        for table, condition in ORPHANS:
+            cursor = self.db.execute('DELETE FROM {0} WHERE {1}'.format(table, condition))
+            logging.info('Deleted %d orphaned rows from %s', cursor.rowcount, table)
+        self.db.execute('COMMIT')
+
+    def rebuild_table(self, table, create_sql, columns, select):
+        """
+        Replace a table with a new definition, copying its rows over in batches.
+
+        The create_sql statement must contain {0} where the table name belongs. The select expressions supply the new table's columns from the old table's rows.
+        Each batch is committed on its own, and the position of the last copied row is recorded, so an interrupted rebuild resumes where it stopped.
+        """
+
+        if self.dry_run:
+            self.estimate('rebuild table {0}'.format(table), table)
+            return
+
+        new_table = table + '_REBUILD'
+        self.db.execute(create_sql.format('IF NOT EXISTS ' + new_table))
+        row = self.db.execute('SELECT LAST_ROWID FROM MIGRATION_PROGRESS WHERE TABLE_NAME=:table', {'table':table}).fetchone()
+        last_rowid = 0
+        if row:
+            last_rowid = row[0]
+            logging.info('Resuming rebuild of %s after row %d', table, last_rowid)
+        copied = 0
+        copying = True
+        while copying:
+            row = self.db.execute('SELECT MAX(rowid) FROM (SELECT rowid FROM {0} WHERE rowid>:last_rowid ORDER BY rowid LIMIT :batch_size)'.format(table), {'last_rowid':last_rowid, 'batch_size':self.batch_size}).fetchone()
+            if row[0] is None:
+                copying = False
+            else:
+                self.db.execute('BEGIN')
+                cursor = self.db.execute('INSERT INTO {0} ({1}) SELECT {2} FROM {3} WHERE rowid>:first AND rowid<=:last'.format(new_table, columns, select, table), {'first':last_rowid, 'last':row[0]})
+                copied += cursor.rowcount
+                last_rowid = row[0]
+                self.db.execute('INSERT OR REPLACE INTO MIGRATION_PROGRESS (TABLE_NAME, LAST_ROWID) VALUES (?, ?)', (table, last_rowid))
+                self.db.execute('COMMIT')
+        self.db.execute('BEGIN')
+        self.db.execute('DROP TABLE {0}'.format(table))
+        self.db.execute('ALTER TABLE {0} RENAME TO {1}'.format(new_table, table))
+        self.db.execute('DELETE FROM MIGRATION_PROGRESS WHERE TABLE_NAME=:table', {'table':table})
+        self.db.execute('COMMIT')
+        logging.info('Rebuilt table %s, copying %d rows', table, copied)
+
+    def run(self, migrations):
+        """Apply, in order, every migration newer than the database's current version."""
+
+        current = self.version()
+        pending = [migration for migration in migrations if migration[0] > current]
+        if not pending:
+            logging.info('Database schema is up to date at version %d', current)
+        for version, description, step in pending:
+            logging.info('Migrating to schema version %d: %s', version, description)
+            step(self)
+            if not self.dry_run:
+                self.db.execute('INSERT INTO SCHEMA_VERSION (VERSION, APPLIED) VALUES (?, ?)', (version, datetime.now(timezone.utc)))
+        if self.dry_run and pending:
+            logging.info('Estimated total: %d rows, about %.1f seconds', self.estimated_rows, self.estimated_seconds)
+
+def create_tables(migrator):
+    """Create the original tables, if this is a new database."""
+
+    migrator.execute(
+    'CREATE TABLE IF NOT EXISTS GAME'
+    '(GUID VARCHAR(32) PRIMARY KEY,'
+    'SERVER INT NOT NULL,'
+    'CHANNEL INT NOT NULL,'
+    'ACTIVITY DATETIME NOT NULL)'
+    )
+
+    migrator.execute(
+    'CREATE TABLE IF NOT EXISTS GAME_OPTIONS'
+    '(GUID VARCHAR(32) PRIMARY KEY,'
+    'KEY VARCHAR(16) NOT NULL,'
+    'VALUE VARCHAR(256),'
+    'PARENT_GUID VARCHAR(32) NOT NULL)'
+    )
+
+    migrator.execute(
+    'CREATE TABLE IF NOT EXISTS DIE'
+    '(GUID VARCHAR(32) PRIMARY KEY,'
+    'NAME VARCHAR(64),'
+    'SIZE INT NOT NULL,'
+    'QTY INT NOT NULL,'
+    'PARENT_GUID VARCHAR(32) NOT NULL)'
+    )
+
+    migrator.execute(
+    'CREATE TABLE IF NOT EXISTS DICE_COLLECTION'
+    '(GUID VARCHAR(32) PRIMARY KEY,'
+    'CATEGORY VARCHAR(64) NOT NULL,'
+    'GRP VARCHAR(64),'
+    'PARENT_GUID VARCHAR(32) NOT NULL)'
+    )
+
+    migrator.execute(
+    'CREATE TABLE IF NOT EXISTS RESOURCE'
+    '(GUID VARCHAR(32) PRIMARY KEY,'
+    'CATEGORY VARCHAR(64) NOT NULL,'
+    'NAME VARCHAR(64) NOT NULL,'
+    'QTY INT NOT NULL,'
+    'PARENT_GUID VARCHAR(64) NOT NULL)'
+    )
+
+def add_game_activity(migrator):
+    """Add the ACTIVITY column to a GAME table from before v1.0.1, marking every existing game as active now."""
+
+    if not migrator.table_exists('GAME') or 'ACTIVITY' in migrator.columns('GAME'):
+        return
+    migrator.rebuild_table(
+    'GAME',
+    'CREATE TABLE {0}'
+    '(GUID VARCHAR(32) PRIMARY KEY,'
+    'SERVER INT NOT NULL,'
+    'CHANNEL INT NOT NULL,'
+    'ACTIVITY DATETIME NOT NULL)',
+    'GUID, SERVER, CHANNEL, ACTIVITY',
+    'GUID, SERVER, CHANNEL, CURRENT_TIMESTAMP'
+    )
+
+def create_indexes(migrator):
+    """Index the columns we search on, so lookups don't have to scan whole tables."""
+
+    migrator.create_index('GAME_SERVER_CHANNEL', 'GAME', 'SERVER, CHANNEL')
+    migrator.create_index('GAME_ACTIVITY', 'GAME', 'ACTIVITY')
+    migrator.create_index('GAME_OPTIONS_PARENT_KEY', 'GAME_OPTIONS', 'PARENT_GUID, KEY')
+    migrator.create_index('DIE_PARENT', 'DIE', 'PARENT_GUID')
+    migrator.create_index('DICE_COLLECTION_PARENT_CATEGORY_GRP', 'DICE_COLLECTION', 'PARENT_GUID, CATEGORY, GRP')
+    migrator.create_index('RESOURCE_PARENT_CATEGORY', 'RESOURCE', 'PARENT_GUID, CATEGORY')
+
+def add_foreign_keys(migrator):
+    """Make every row refer to its parent with a foreign key, so that deleting a game deletes everything that belongs to it."""
+
+    migrator.delete_orphans()
+    # A table rebuilt before an interrupted upgrade already has its foreign key, so it isn't copied again.
+    if not migrator.has_foreign_key('GAME_OPTIONS', 'PARENT_GUID'):
+        migrator.rebuild_table(
+        'GAME_OPTIONS',
+        'CREATE TABLE {0}'
+        '(GUID VARCHAR(32) PRIMARY KEY,'
+        'KEY VARCHAR(16) NOT NULL,'
+        'VALUE VARCHAR(256),'
+        'PARENT_GUID VARCHAR(32) NOT NULL REFERENCES GAME (GUID) ON DELETE CASCADE)',
+        'GUID, KEY, VALUE, PARENT_GUID',
+        'GUID, KEY, VALUE, PARENT_GUID'
+        )
+    if not migrator.has_foreign_key('DICE_COLLECTION', 'PARENT_GUID'):
+        migrator.rebuild_table(
+        'DICE_COLLECTION',
+        'CREATE TABLE {0}'
+        '(GUID VARCHAR(32) PRIMARY KEY,'
+        'CATEGORY VARCHAR(64) NOT NULL,'
+        'GRP VARCHAR(64),'
+        'PARENT_GUID VARCHAR(32) NOT NULL REFERENCES GAME (GUID) ON DELETE CASCADE)',
+        'GUID, CATEGORY, GRP, PARENT_GUID',
+        'GUID, CATEGORY, GRP, PARENT_GUID'
+        )
+    if not migrator.has_foreign_key('RESOURCE', 'PARENT_GUID'):
+        migrator.rebuild_table(
+        'RESOURCE',
+        'CREATE TABLE {0}'
+        '(GUID VARCHAR(32) PRIMARY KEY,'
+        'CATEGORY VARCHAR(64) NOT NULL,'
+        'NAME VARCHAR(64) NOT NULL,'
+        'QTY INT NOT NULL,'
+        'PARENT_GUID VARCHAR(64) NOT NULL REFERENCES GAME (GUID) ON DELETE CASCADE)',
+        'GUID, CATEGORY, NAME, QTY, PARENT_GUID',
+        'GUID, CATEGORY, NAME, QTY, PARENT_GUID'
+        )
+    if not migrator.has_foreign_key('DIE', 'PARENT_GUID'):
+        migrator.rebuild_table(
+        'DIE',
+        'CREATE TABLE {0}'
+        '(GUID VARCHAR(32) PRIMARY KEY,'
+        'NAME VARCHAR(64),'
+        'SIZE INT NOT NULL,'
+        'QTY INT NOT NULL,'
+        'PARENT_GUID VARCHAR(32) NOT NULL REFERENCES DICE_COLLECTION (GUID) ON DELETE CASCADE)',
+        'GUID, NAME, SIZE, QTY, PARENT_GUID',
+        'GUID, NAME, SIZE, QTY, PARENT_GUID'
+        )
+    # Rebuilding a table drops its indexes.
+    create_indexes(migrator)
+
+def create_roll_stats(migrator):
+    """Create a table that counts how often each face of each die size has come up on each server."""
+
+    migrator.execute(
+    'CREATE TABLE IF NOT EXISTS ROLL_STATS'
+    '(SERVER INT NOT NULL,'
+    'SIZE INT NOT NULL,'
+    'FACE INT NOT NULL,'
+    'ROLLS INT NOT NULL,'
+    'PRIMARY KEY (SERVER, SIZE, FACE))'
+    ' WITHOUT ROWID'
+    )
+
+def add_game_version(migrator):
+    """Add a VERSION column to the GAME table, which counts changes to each game, so that processes sharing the database can tell when a game they remember has changed."""
+
+    if 'VERSION' in migrator.columns('GAME'):
+        return
+    migrator.execute('ALTER TABLE GAME ADD COLUMN VERSION INT NOT NULL DEFAULT 0')
+
+MIGRATIONS = [
+    (1, 'create tables', create_tables),
+    (2, 'add game activity', add_game_activity),
+    (3, 'create indexes', create_indexes),
+    (4, 'add foreign keys', add_foreign_keys),
+    (5, 'create roll stats', create_roll_stats),
+    (6, 'add game version', add_game_version)
+]
+
+def upgrade(filename, dry_run=False, batch_size=BATCH_SIZE):
+    """Bring the database in a given file up to the current schema version."""
+
+    db = sqlite3.connect(filename, isolation_level=None)
+    try:
+        Migrator(db, dry_run, batch_size).run(MIGRATIONS)
+    finally:
+        db.close()
+
+def check(filename):
+    """Report any rows in the database whose parent no longer exists."""
+
+    db = sqlite3.connect(filename, isolation_level=None)
+    try:
+        for table, count in Migrator(db, dry_run=True).count_orphans().items():
+            logging.info('%s: %d orphaned rows', table, count)
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upgrade a CortexPal database to the current schema.')
+    parser.add_argument('database', help='the database file to upgrade')
+    parser.add_argument('--dry-run', action='store_true', help='report what the upgrade would do, without changing anything')
+    parser.add_argument('--check', action='store_true', help='report rows whose parent no longer exists, without changing anything')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='how many rows to copy per transaction when rebuilding a table')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    if args.check:
+        check(args.database)
+    else:
+        upgrade(args.database, args.dry_run, args.batch_size)
@@ -0,0 +1,338 @@
+"""
+Results and odds for Cortex dice pools.
+
+A roll's result is the best total (the two highest dice that aren't hitches) along with an effect die (the biggest die left over, or a D4). Rather than enumerating every outcome of a pool, pool_odds() works through the pool one die at a time, tracking only what can still matter to the result: the two dice in the total and the size of the effect die. Every state carries the exact number of outcomes that reach it, so the resulting odds are exact.
+
+For questions the exact odds can't answer, like how one pool fares against another, simulate() rolls the pools many times over. It splits the rolls into chunks that can run in separate processes, which is why this module stands apart from the bot itself. For the same reason, this is where the bot's dice get the tables that turn random bytes into faces.
+"""
+
+import concurrent.futures
+import functools
+import random
+import time
+
+# Difficulties from the Cortex Prime rules, from very easy to very hard.
+DIFFICULTIES = [3, 7, 11, 15, 19]
+
+def highest_values(counts, qty, skip=None):
+    """
+    Find the highest non-hitch values among rolled dice, preferring smaller dice when values are tied.
+
+    The counts map each die size to a list of how many times each face came up. The skip parameter may name one (value, size) die to leave out.
+    Return a list of (value, size) pairs.
+    """
+
+    found = []
+    sizes = sorted(counts)
+    for value in range(max(counts, default=0), 1, -1):
+        for size in sizes:
+            if value <= size:
+                available = counts[size][value - 1]
+                if skip == (value, size):
+                    available -= 1
+                while available > 0 and len(found) < qty:
+                    found.append((value, size))
+                    available -= 1
+    return found
+
+def best_total(counts):
+    """
+    Choose the two highest dice for the total, and then the biggest remaining die for the effect.
+
+    Return a list of the values in the total and the effect die size, or None if every die was a hitch.
+    """
+
+    remaining = {}
+    for size in counts:
+        remaining[size] = sum(counts[size][1:])
+    total_dice = highest_values(counts, 2)
+    if not total_dice:
+        return None
+    for value, size in total_dice:
+        remaining[size] -= 1
+    effect = 4
+    for size in remaining:
+        if remaining[size] > 0 and size > effect:
+            effect = size
+    return [value for value, size in total_dice], effect
+
+def best_effect(counts):
+    """
+    Choose the biggest die (with its lowest value) for the effect, and then the two highest remaining dice for the total.
+
+    Return a list of the values in the total and the effect die size, or None if every die was a hitch.
+    """
+
+    available = 0
+    effect = 0
+    for size in counts:
+        non_hitches = sum(counts[size][1:])
+        available += non_hitches
+        if non_hitches and size > effect:
+            effect = size
+    if not available:
+        return None
+    if available <= 2:
+        return [value for value, size in highest_values(counts, 2)], 4
+    lowest = 2
+    while not counts[effect][lowest - 1]:
+        lowest += 1
+    total_dice = highest_values(counts, 2, skip=(lowest, effect))
+    return [value for value, size in total_dice], effect
+
+class PoolOdds:
+    """The exact distribution of results for one dice pool."""
+
+    def __init__(self, signature, outcomes, totals, effects, botches):
+        self.signature = signature
+        self.outcomes = outcomes
+        self.totals = totals
+        self.effects = effects
+        self.botches = botches
+
+    def chance_to_beat(self, difficulty):
+        """Return the chance that the best total is greater than the difficulty."""
+
+        beating = 0
+        for total in self.totals:
+            if total > difficulty:
+                beating += self.totals[total]
+        return beating / self.outcomes
+
+    def chance_of_effect(self, size):
+        """Return the chance that the effect die is a given size."""
+
+        return self.effects.get(size, 0) / self.outcomes
+
+    def chance_of_hitch(self):
+        """Return the chance that at least one die comes up 1."""
+
+        no_hitches = 1
+        for size, qty in self.signature:
+            no_hitches *= (size - 1) ** qty
+        return 1 - no_hitches / self.outcomes
+
+    def chance_of_botch(self):
+        """Return the chance that every die comes up 1."""
+
+        return self.botches / self.outcomes
+
+    def average_total(self):
+        """Return the expected best total, counting a botch as zero."""
+
+        return sum(total * count for total, count in self.totals.items()) / self.outcomes
+
+def add_die(states, size):
+    """
+    Add one die to every state, and return the new states.
+
+    Each state is a tuple of (highest value, its size, second highest value, its size, effect size), with zeroes for anything not yet rolled. A die's size is also zero when it is no bigger than the effect die, so that it could never change the effect, which keeps the number of states small. Dice must be added from smallest to largest, so that a new die never displaces an equal value, and so that a new die left out of the total is always the biggest effect die so far.
+    """
+
+    next_states = {}
+    for state, count in states.items():
+        high, high_size, low, low_size, effect = state
+        # A hitch leaves the result as it was.
+        next_states[state] = next_states.get(state, 0) + count
+        # Any other value no higher than the total's lower die only becomes the effect die. That makes the sizes of the dice in the total irrelevant.
+        if low > 1:
+            left_out = (high, 0, low, 0, size)
+            next_states[left_out] = next_states.get(left_out, 0) + count * (low - 1)
+        # Higher values join the total, and whatever they displace may become the effect die.
+        displaced_effect = max(effect, low_size)
+        if high_size <= displaced_effect:
+            high_size = 0
+        joined_size = size
+        if size <= displaced_effect:
+            joined_size = 0
+        for value in range(max(low + 1, 2), size + 1):
+            if value > high:
+                joined = (value, joined_size, high, high_size, displaced_effect)
+            else:
+                joined = (high, high_size, value, joined_size, displaced_effect)
+            next_states[joined] = next_states.get(joined, 0) + count
+    return next_states
+
+@functools.lru_cache(maxsize=1024)
+def pool_odds(signature):
+    """
+    Work out the exact odds for a pool.
+
+    The signature is a tuple of (size, quantity) pairs, in order of size, which makes it a canonical key for remembering the odds of pools that have been asked about before.
+    """
+
+    states = {(0, 0, 0, 0, 0): 1}
+    for size, qty in signature:
+        for num in range(qty):
+            states = add_die(states, size)
+    outcomes = 0
+    totals = {}
+    effects = {}
+    botches = 0
+    for (high, high_size, low, low_size, effect), count in states.items():
+        outcomes += count
+        if not high:
+            botches += count
+            continue
+        totals[high + low] = totals.get(high + low, 0) + count
+        effect = max(effect, 4)
+        effects[effect] = effects.get(effect, 0) + count
+    return PoolOdds(signature, outcomes, totals, effects, botches)
+
+class Simulation:
+    """Tallies the results of many simulated rolls of a pool, optionally against a difficulty or an opposing pool."""
+
+    def __init__(self):
+        self.trials = 0
+        self.totals = {}
+        self.effects = {}
+        self.effect_totals = {}
+        self.effect_effects = {}
+        self.hitches = 0
+        self.botches = 0
+        self.wins = 0
+        self.ties = 0
+        self.seed = None
+
+    def add(self, counts, target=None):
+        """Tally one roll, given how often each face came up on each die size, and the total to beat, if any."""
+
+        self.trials += 1
+        total = 0
+        effect = None
+        best = best_total(counts)
+        if best:
+            values, effect = best
+            total = sum(values)
+            values, effect_effect = best_effect(counts)
+            effect_total = sum(values)
+            self.effect_totals[effect_total] = self.effect_totals.get(effect_total, 0) + 1
+            self.effect_effects[effect_effect] = self.effect_effects.get(effect_effect, 0) + 1
+            self.effects[effect] = self.effects.get(effect, 0) + 1
+        else:
+            self.botches += 1
+        self.totals[total] = self.totals.get(total, 0) + 1
+        if any(faces[0] for faces in counts.values()):
+            self.hitches += 1
+        if target is not None:
+            if total > target:
+                self.wins += 1
+            elif total == target:
+                self.ties += 1
+        return total
+
+    def merge(self, other):
+        """Add the tallies of another simulation to this one."""
+
+        self.trials += other.trials
+        for mine, theirs in [(self.totals, other.totals), (self.effects, other.effects), (self.effect_totals, other.effect_totals), (self.effect_effects, other.effect_effects)]:
+            for key in theirs:
+                mine[key] = mine.get(key, 0) + theirs[key]
+        self.hitches += other.hitches
+        self.botches += other.botches
+        self.wins += other.wins
+        self.ties += other.ties
+
+    def percentile(self, percent):
+        """Return the best total that this percentage of rolls did not exceed, counting a botch as zero."""
+
+        needed = self.trials * percent / 100
+        seen = 0
+        for total in sorted(self.totals):
+            seen += self.totals[total]
+            if seen >= needed:
+                return total
+        return 0
+
+    def average(self, totals):
+        """Return the average of a tally of totals."""
+
+        return sum(total * count for total, count in totals.items()) / self.trials
+
+def face_table(size):
+    """
+    Build the tables that turn random bytes into the faces of a die, counting from zero.
+
+    Return a table for bytes.translate() that maps each byte to a face, and the bytes for it to delete. Only bytes below the largest multiple of the die size are kept, so that every face is equally likely.
+    """
+
+    limit = 256 - 256 % size
+    return bytes(byte % size for byte in range(256)), bytes(range(limit, 256))
+
+def bytes_to_faces(block, tables):
+    """Turn a block of random bytes into faces, counting from zero, using the tables from face_table(). Rejected bytes are dropped, so there may be fewer faces than bytes."""
+
+    table, rejected = tables
+    return block.translate(table, rejected)
+
+def roll_signature(rng, signature):
+    """Roll the dice in a signature, and return how often each face came up on each die size."""
+
+    counts = {}
+    for size, qty in signature:
+        faces = [0] * size
+        for num in range(qty):
+            faces[int(rng.random() * size)] += 1
+        counts[size] = faces
+    return counts
+
+def simulate_chunk(signature, opponent, seed, index, trials):
+    """
+    Simulate one chunk of rolls, and return a Simulation.
+
+    The opponent is either a difficulty, an opposing pool's signature, or None. Each chunk has its own random generator, seeded from the run's seed and the chunk's index, so a run produces the same results however its chunks are spread across processes.
+    """
+
+    rng = random.Random('{0}:{1}'.format(seed, index))
+    simulation = Simulation()
+    for trial in range(trials):
+        counts = roll_signature(rng, signature)
+        if opponent is None or isinstance(opponent, int):
+            simulation.add(counts, opponent)
+        else:
+            opposing = best_total(roll_signature(rng, opponent))
+            simulation.add(counts, sum(opposing[0]) if opposing else 0)
+    return simulation
+
+def chunk_sizes(trials, chunk_size):
+    """Split a number of trials into chunks."""
+
+    return [min(chunk_size, trials - start) for start in range(0, trials, chunk_size)]
+
+def simulate(signature, opponent=None, trials=10000, seed=None, executor=None, chunk_size=5000, budget=None):
+    """
+    Simulate many rolls of a pool, and return a Simulation.
+
+    The opponent is either a difficulty, an opposing pool's signature, or None. If an executor is given, the chunks run on it. If a budget is given, in seconds, any chunks after the first that are still unfinished when it runs out are dropped. Only an unbroken run of chunks from the first one counts, so that a seeded run is always a prefix of the same longer run.
+    """
+
+    if seed is None:
+        seed = random.SystemRandom().randrange(1000000000)
+    sizes = chunk_sizes(trials, chunk_size)
+    if executor:
+        futures = [executor.submit(simulate_chunk, signature, opponent, seed, index, size) for index, size in enumerate(sizes)]
+        chunks = []
+        deadline = None if budget is None else time.monotonic() + budget
+        for future in futures:
+            try:
+                # Always wait for the first chunk, so there's something to report.
+                timeout = None
+                if deadline is not None and chunks:
+                    timeout = max(deadline - time.monotonic(), 0)
+                chunks.append(future.result(timeout))
+            except concurrent.futures.TimeoutError:
+                break
+        for future in futures[len(chunks):]:
+            future.cancel()
+    else:
+        chunks = []
+        started = time.monotonic()
+        for index, size in enumerate(sizes):
+            if budget is not None and chunks and time.monotonic() - started > budget:
+                break
+            chunks.append(simulate_chunk(signature, opponent, seed, index, size))
+    simulation = Simulation()
+    for chunk in chunks:
+        simulation.merge(chunk)
+    simulation.seed = seed
+    return simulation
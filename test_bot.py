@@ -0,0 +1,418 @@
+"""Run the bot's commands against each storage backend, through stand-ins for Discord's servers, channels, and messages."""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import types
+import unittest
+import unittest.mock
+from datetime import datetime, timezone
+
+from discord.ext import commands
+
+import CortexPal
+import migrate
+
+class Message:
+    """A message the bot has sent."""
+
+    def __init__(self, content):
+        self.content = content
+        self.pinned = False
+
+    async def edit(self, content):
+        self.content = content
+
+    async def pin(self):
+        self.pinned = True
+
+class Channel:
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = 'channel-{0}'.format(channel_id)
+
+    async def pins(self):
+        return []
+
+class Guild:
+
+    def __init__(self, guild_id, shard_id=None):
+        self.id = guild_id
+        self.shard_id = shard_id
+        self.channels = [Channel(channel_id) for channel_id in range(1, 4)]
+
+class Context:
+    """The context of a command typed in one channel, which remembers everything the bot sends back."""
+
+    def __init__(self, guild_id, channel_id, shard_id=None):
+        self.guild = Guild(guild_id, shard_id)
+        self.channel = Channel(channel_id)
+        self.message = types.SimpleNamespace(guild=self.guild, channel=self.channel, channel_mentions=[])
+        self.sent = []
+
+    async def send(self, content=None):
+        self.sent.append(str(content))
+        return Message(str(content))
+
+    async def send_help(self, name):
+        self.sent.append('help ' + name)
+
+def launch_bot(new_storage, sharded=False, readers=CortexPal.DATABASE_READERS):
+    """Start the cog on a fresh event loop with a storage backend. Return the loop, the cog, and a function that stops them both."""
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    database = CortexPal.start_storage(new_storage, readers)
+    if sharded:
+        bot = commands.AutoShardedBot(command_prefix=CortexPal.get_prefix, loop=loop, shard_count=2)
+    else:
+        bot = commands.Bot(command_prefix=CortexPal.get_prefix, loop=loop)
+    cog = CortexPal.CortexPal(bot)
+    bot.add_cog(cog)
+    # Tests and benchmarks run the purge themselves.
+    cog.purge_task.cancel()
+
+    def stop():
+        cog.cog_unload()
+        loop.run_until_complete(asyncio.sleep(0))
+        database.close()
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    return loop, cog, stop
+
+def start_bot(test, new_storage, sharded=False, readers=CortexPal.DATABASE_READERS):
+    """Start the cog as launch_bot() does, and arrange for a test to stop it afterward. Return the loop and the cog."""
+
+    loop, cog, stop = launch_bot(new_storage, sharded, readers)
+    test.addCleanup(stop)
+    return loop, cog
+
+class BehaviourTests:
+    """The tests every storage backend must pass. Subclasses supply the backend with open_storage()."""
+
+    def setUp(self):
+        self.loop, self.cog = start_bot(self, self.open_storage())
+        self.ctx = Context(1, 1)
+
+    def command(self, name, *args, ctx=None, **kwargs):
+        """Run a command, and return the bot's reply."""
+
+        ctx = ctx or self.ctx
+        self.loop.run_until_complete(getattr(self.cog, name)(ctx, *args, **kwargs))
+        return ctx.sent[-1]
+
+    def info(self, ctx=None):
+        return self.command('info', ctx=ctx)
+
+    def forget_everything(self):
+        """Drop every game and option from memory, so the next command reloads them from storage."""
+
+        for shard in CortexPal.shards.shards.values():
+            shard.games.evict(list(shard.games.games))
+            shard.options.options.clear()
+
+    def test_comp(self):
+        self.assertEqual(self.command('comp', 'add', '6', 'on', 'fire'), 'New: D6 On Fire')
+        self.assertEqual(self.command('comp', 'stepup', 'on', 'fire'), 'Stepped up to D8 On Fire')
+        self.assertEqual(self.command('comp', 'add', '4', 'dazed'), 'New: D4 Dazed')
+        self.assertEqual(self.command('comp', 'stepdown', 'dazed'), 'Stepped down and removed: Dazed')
+        self.assertEqual(self.command('comp', 'remove', 'dazed'), 'There\'s no such complication yet.')
+        self.assertEqual(self.command('comp', 'add', '6', '8', 'smoke'), CortexPal.DIE_EXCESS_ERROR)
+        self.forget_everything()
+        self.assertIn('**Complications**\nD8 On Fire\n', self.info())
+        self.assertEqual(self.command('comp', 'remove', 'on', 'fire'), 'Removed: D8 On Fire')
+        self.assertNotIn('Complications', self.info())
+
+    def test_asset(self):
+        self.assertEqual(self.command('asset', 'add', '8', 'rope'), 'New: D8 Rope')
+        self.assertEqual(self.command('asset', 'stepup', 'rope'), 'Stepped up to D10 Rope')
+        self.assertEqual(self.command('asset', 'stepdown', 'rope'), 'Stepped down to D8 Rope')
+        self.assertEqual(self.command('asset', 'add', '12', 'sword'), 'New: D12 Sword')
+        self.forget_everything()
+        self.assertIn('**Assets**\nD8 Rope\nD12 Sword\n', self.info())
+        self.assertEqual(self.command('asset', 'remove', 'rope'), 'Removed: D8 Rope')
+        self.assertIn('**Assets**\nD12 Sword\n', self.info())
+
+    def test_stress(self):
+        self.assertEqual(self.command('stress', 'add', 'amy', 'mental', '8'), 'New: D8 Mental Stress for Amy')
+        self.assertEqual(self.command('stress', 'add', 'bob', '6'), 'New: D6 General Stress for Bob')
+        self.assertEqual(self.command('stress', 'stepup', 'amy', 'mental'), 'Stepped up to D10 Mental Stress for Amy')
+        self.assertEqual(self.command('stress', 'stepdown', 'bob'), 'Stepped down to D4 General Stress for Bob')
+        self.forget_everything()
+        self.assertIn('**Stress**\nAmy: D10 Mental\nBob: D4 General\n', self.info())
+        self.assertEqual(self.command('stress', 'remove', 'amy', 'mental'), 'Removed: D10 Mental Stress for Amy')
+        self.assertEqual(self.command('stress', 'clear', 'bob'), 'Cleared all stress for Bob.')
+        self.forget_everything()
+        self.assertIn('**Stress**\nAmy: None\n', self.info())
+
+    def test_pp(self):
+        self.assertEqual(self.command('pp', 'add', 'amy', '3'), 'Plot points for Amy: 3')
+        self.assertEqual(self.command('pp', 'remove', 'amy'), 'Plot points for Amy: 2')
+        self.assertEqual(self.command('pp', 'add', 'bob'), 'Plot points for Bob: 1')
+        self.assertEqual(self.command('pp', 'remove', 'bob', '2'), 'Bob only has 1 plot points.')
+        self.forget_everything()
+        self.assertIn('**Plot Points**\nAmy: 2\nBob: 1\n', self.info())
+        self.assertEqual(self.command('pp', 'clear', 'amy'), 'Cleared Amy from plot points list.')
+        self.assertIn('**Plot Points**\nBob: 1\n', self.info())
+
+    def test_xp(self):
+        self.assertEqual(self.command('xp', 'add', 'amy', '5'), 'Experience points for Amy: 5')
+        self.assertEqual(self.command('xp', 'remove', 'amy', '2'), 'Experience points for Amy: 3')
+        self.forget_everything()
+        self.assertIn('**Experience Points**\nAmy: 3\n', self.info())
+        self.assertEqual(self.command('xp', 'clear', 'amy'), 'Cleared Amy from xp list.')
+        self.assertNotIn('Experience Points', self.info())
+
+    def test_pool(self):
+        self.assertEqual(self.command('pool', 'add', 'doom', '6', '2d8'), 'Doom: D6 2D8 ')
+        self.assertEqual(self.command('pool', 'remove', 'doom', '8'), 'Doom: D6 D8 ')
+        self.assertEqual(self.command('pool', 'remove', 'doom', '12'), 'That pool doesn\'t have any D12s.')
+        self.assertEqual(self.command('pool', 'add', 'crisis', '10'), 'Crisis: D10 ')
+        self.forget_everything()
+        self.assertIn('**Dice Pools**\nDoom: D6 D8 \nCrisis: D10 \n', self.info())
+        self.assertEqual(self.command('pool', 'clear', 'doom'), 'Cleared Doom pool.')
+        self.assertIn('**Dice Pools**\nCrisis: D10 \n', self.info())
+
+    def test_option(self):
+        self.command('option', 'prefix', '!')
+        self.forget_everything()
+        prefix = self.loop.run_until_complete(CortexPal.get_prefix(None, self.ctx.message))
+        self.assertEqual(prefix, '!')
+
+    def test_batch_rolls_back(self):
+        self.command('pp', 'add', 'amy', '1')
+        before = self.info()
+        output = self.command('batch', script='comp add 6 fire\npp add amy 2\npool add doom 8\nstress add amy 20')
+        self.assertEqual(output, 'Line 4 (`stress add amy 20`): There were no valid dice in that command.\nNothing in the batch was changed.')
+        self.assertEqual(self.info(), before)
+        self.forget_everything()
+        self.assertEqual(self.info(), before)
+
+    def test_batch(self):
+        output = self.command('batch', script='```\ncomp add 6 fire\n$pp add amy 2\n\nasset add 12 sword\n```')
+        self.assertEqual(output, 'New: D6 Fire\nPlot points for Amy: 2\nNew: D12 Sword')
+        self.forget_everything()
+        self.assertEqual(self.info(), '**Cortex Game Information**\n\n**Assets**\nD12 Sword\n\n**Complications**\nD6 Fire\n\n**Plot Points**\nAmy: 2\n')
+
+    def test_options_are_bounded(self):
+        options = CortexPal.shards.get(None).options
+        options.max_channels = 2
+        self.command('option', 'prefix', '!')
+        for channel_id in [2, 1, 3]:
+            self.loop.run_until_complete(CortexPal.get_prefix(None, Context(1, channel_id).message))
+        # Looking up the first channel again kept it in memory, so the second was the least recently used.
+        self.assertEqual(list(options.options), [(1, 1), (1, 3)])
+        self.loop.run_until_complete(CortexPal.get_prefix(None, Context(1, 4).message))
+        self.assertEqual(list(options.options), [(1, 3), (1, 4)])
+        # A forgotten channel's options are fetched again.
+        self.assertEqual(self.loop.run_until_complete(CortexPal.get_prefix(None, self.ctx.message)), '!')
+        self.assertEqual(list(options.options), [(1, 4), (1, 1)])
+
+    def test_long_batch(self):
+        # The output of a long script is split between messages, at the ends of lines.
+        script = '\n'.join('comp add 6 raging fire{0}'.format(num) for num in range(150))
+        self.command('batch', script=script)
+        self.assertGreater(len(self.ctx.sent), 1)
+        for message in self.ctx.sent:
+            self.assertLessEqual(len(message), CortexPal.MESSAGE_LIMIT)
+        self.assertEqual('\n'.join(self.ctx.sent), '\n'.join('New: D6 Raging Fire{0}'.format(num) for num in range(150)))
+
+    def test_reload_after_eviction(self):
+        self.command('batch', script='comp add 6 fire\nasset add 8 rope\nstress add amy mental 8\npp add amy 2\nxp add amy 4\npool add doom 6 6 10')
+        before = self.info()
+        shard = CortexPal.shards.get(None)
+        shard.games.max_games = 1
+        # Using another channel pushes the first game out of the cache.
+        self.command('pp', 'add', 'bob', ctx=Context(1, 2))
+        self.assertIsNone(shard.games.games.get((1, 1)))
+        self.assertEqual(self.info(), before)
+        self.assertEqual(self.command('pool', 'remove', 'doom', '6'), 'Doom: D6 D10 ')
+
+    def test_failed_command_reloads(self):
+        self.command('comp', 'add', '6', 'fire')
+        before = self.info()
+        self.command('batch', script='comp stepup fire\ncomp remove nothing')
+        self.assertEqual(self.info(), before)
+
+    def test_clean(self):
+        self.command('batch', script='comp add 6 fire\nasset add 8 rope\nstress add amy 8\npp add amy 2\nxp add amy 4\npool add doom 6')
+        other = Context(1, 2)
+        self.command('pp', 'add', 'bob', ctx=other)
+        self.assertEqual(self.command('clean'), 'Cleaned up all game information.')
+        self.assertEqual(self.info(), '**Cortex Game Information**\n')
+        self.forget_everything()
+        self.assertEqual(self.info(), '**Cortex Game Information**\n')
+        self.assertIn('Bob: 1', self.info(other))
+        self.assertEqual(self.command('comp', 'add', '8', 'smoke'), 'New: D8 Smoke')
+
+    def test_purge(self):
+        self.command('pp', 'add', 'amy', '1')
+        self.command('option', 'prefix', '!')
+        other = Context(1, 2)
+        self.command('pp', 'add', 'bob', '1', ctx=other)
+        game = CortexPal.database.transact_now(self.cog.find_game, self.ctx)
+        CortexPal.database.transact_now(CortexPal.activity_tracker.flush)
+        CortexPal.database.transact_now(CortexPal.storage.record_activity, {game.db_guid: datetime(2000, 1, 1, tzinfo=timezone.utc)})
+        self.loop.run_until_complete(self.cog.purger.purge())
+        self.assertEqual(self.cog.purger.last_deleted, 1)
+        self.assertIsNone(CortexPal.shards.get(None).games.games.get((1, 1)))
+        self.assertEqual(self.loop.run_until_complete(CortexPal.get_prefix(None, self.ctx.message)), '$')
+        self.assertEqual(self.info(), '**Cortex Game Information**\n')
+        self.assertIn('Bob: 1', self.info(other))
+
+    def test_failed_flush_keeps_roll_stats(self):
+        self.command('roll', '8', '8', '10')
+        # Whether writing the frequencies fails or committing them does, nothing is lost.
+        for method in ['add_roll_stats', 'commit']:
+            with self.subTest(method=method):
+                with unittest.mock.patch.object(CortexPal.storage, method, side_effect=sqlite3.OperationalError('disk I/O error')):
+                    with self.assertRaises(sqlite3.OperationalError):
+                        CortexPal.database.transact_now(CortexPal.shards.flush)
+        CortexPal.database.transact_now(CortexPal.shards.flush)
+        results = CortexPal.database.transact_now(CortexPal.shards.read_results, 1)
+        self.assertEqual(sum(results[8]), 2)
+        self.assertEqual(sum(results[10]), 1)
+        self.assertEqual(CortexPal.shards.get(None).roller.unsaved, {})
+
+def open_sqlite(test, shared=False):
+    """Create SQLite storage in a temporary file that lasts as long as a test."""
+
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    filename = os.path.join(directory.name, 'cortexpal.db')
+    migrate.upgrade(filename)
+    return CortexPal.SQLiteStorage(filename, shared)
+
+class SQLiteTest(BehaviourTests, unittest.TestCase):
+
+    def open_storage(self):
+        return open_sqlite(self)
+
+class MemoryTest(BehaviourTests, unittest.TestCase):
+
+    def open_storage(self):
+        return CortexPal.MemoryStorage()
+
+class ShardTest(unittest.TestCase):
+    """Two servers on different shards of one sharded bot, which must not see each other's games, options, or statistics."""
+
+    def setUp(self):
+        self.loop, self.cog = start_bot(self, open_sqlite(self), sharded=True)
+        self.first = Context(1, 1, shard_id=0)
+        self.second = Context(2, 1, shard_id=1)
+
+    def command(self, ctx, name, *args):
+        self.loop.run_until_complete(getattr(self.cog, name)(ctx, *args))
+        return ctx.sent[-1]
+
+    def test_disjoint_caches(self):
+        self.command(self.first, 'pp', 'add', 'amy', '2')
+        self.command(self.second, 'pp', 'add', 'bob', '3')
+        self.command(self.second, 'option', 'prefix', '!')
+        for ctx in [self.first, self.second]:
+            self.loop.run_until_complete(CortexPal.get_prefix(None, ctx.message))
+        first_shard = CortexPal.shards.get(0)
+        second_shard = CortexPal.shards.get(1)
+        self.assertEqual(list(first_shard.games.games), [(1, 1)])
+        self.assertEqual(list(second_shard.games.games), [(2, 1)])
+        self.assertEqual(list(first_shard.options.options), [(1, 1)])
+        self.assertEqual(list(second_shard.options.options), [(2, 1)])
+        self.assertEqual(self.loop.run_until_complete(CortexPal.get_prefix(None, self.first.message)), '$')
+        self.assertEqual(self.loop.run_until_complete(CortexPal.get_prefix(None, self.second.message)), '!')
+        self.assertIn('Amy: 2', self.command(self.first, 'info'))
+        self.assertIn('Bob: 3', self.command(self.second, 'info'))
+
+    def test_disjoint_statistics(self):
+        self.command(self.first, 'roll', '8', '8', '8')
+        self.command(self.second, 'roll', '10')
+        self.assertEqual(sum(CortexPal.shards.get(0).roller.results[8]), 3)
+        self.assertEqual(sum(CortexPal.shards.get(0).roller.results[10]), 0)
+        self.assertEqual(sum(CortexPal.shards.get(1).roller.results[10]), 1)
+        self.assertEqual(sum(CortexPal.shards.get(1).roller.results[8]), 0)
+        report = self.command(self.first, 'report')
+        self.assertIn('Shard 0: 1 games cached', report)
+        self.assertIn('Shard 1: 1 games cached', report)
+
+    def test_purge_evicts_from_the_right_shard(self):
+        self.command(self.first, 'pp', 'add', 'amy', '2')
+        self.command(self.second, 'pp', 'add', 'bob', '3')
+        game = CortexPal.database.transact_now(self.cog.find_game, self.second)
+        CortexPal.database.transact_now(CortexPal.activity_tracker.flush)
+        CortexPal.database.transact_now(CortexPal.storage.record_activity, {game.db_guid: datetime(2000, 1, 1, tzinfo=timezone.utc)})
+        self.loop.run_until_complete(self.cog.purger.purge())
+        self.assertEqual(list(CortexPal.shards.get(0).games.games), [(1, 1)])
+        self.assertEqual(list(CortexPal.shards.get(1).games.games), [])
+
+class SharedOptionsTest(unittest.TestCase):
+    """Options of a database shared with other processes, which must be fetched again only when another process commits."""
+
+    def setUp(self):
+        new_storage = open_sqlite(self, shared=True)
+        # Each reader thread checks for commits on its own, so with a single reader, the test knows what it has seen.
+        self.loop, self.cog = start_bot(self, new_storage, readers=1)
+        self.ctx = Context(1, 1)
+        self.options = CortexPal.shards.get(None).options
+        self.queries = 0
+        query = self.options.query
+
+        def counting_query(server, channel):
+            self.queries += 1
+            return query(server, channel)
+
+        self.options.query = counting_query
+        # Another process, with its own connection to the same file.
+        self.other = CortexPal.SQLiteStorage(new_storage.filename, shared=True)
+        self.other.connect()
+        self.addCleanup(self.other.connection.close)
+
+    def prefix(self):
+        return self.loop.run_until_complete(CortexPal.get_prefix(None, self.ctx.message))
+
+    def settle(self):
+        """Read the prefix, and wait for any check it asked the database thread to make."""
+
+        prefix = self.prefix()
+        CortexPal.database.transact_now(lambda: None)
+        return prefix
+
+    def test_no_queries_without_commits(self):
+        self.loop.run_until_complete(self.cog.option(self.ctx, 'prefix', '!'))
+        self.settle()
+        queries = self.queries
+        for num in range(20):
+            self.assertEqual(self.prefix(), '!')
+        self.assertEqual(self.queries, queries)
+
+    def test_own_commits_keep_options(self):
+        self.loop.run_until_complete(self.cog.option(self.ctx, 'prefix', '!'))
+        self.settle()
+        forgotten = self.options.forgotten
+        self.loop.run_until_complete(self.cog.pp(self.ctx, 'add', 'amy'))
+        self.assertEqual(self.settle(), '!')
+        self.assertEqual(self.options.forgotten, forgotten)
+        queries = self.queries
+        self.assertEqual(self.prefix(), '!')
+        self.assertEqual(self.queries, queries)
+
+    def test_other_process_commits(self):
+        self.loop.run_until_complete(self.cog.option(self.ctx, 'prefix', '!'))
+        self.settle()
+        self.other.begin()
+        guid = self.other.find_game(1, 1)['GUID']
+        self.other.update_option(guid, 'prefix', '?')
+        self.other.bump_game_version(guid)
+        self.other.commit()
+        # The first look fetches the new prefix, while the database thread checks who committed. The check forgets every option, and the next look fetches and remembers the prefix again.
+        self.assertEqual(self.settle(), '?')
+        forgotten = self.options.forgotten
+        self.assertEqual(self.prefix(), '?')
+        self.assertEqual(self.options.forgotten, forgotten + 1)
+        queries = self.queries
+        self.assertEqual(self.prefix(), '?')
+        self.assertEqual(self.queries, queries)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Check that an upgraded database can answer the bot's frequent queries from its indexes."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+import unittest.mock
+
+import migrate
+
+# The queries the bot runs most often, with the index each one should search.
+HOT_QUERIES = [
+    ('GAME_SERVER_CHANNEL', 'SELECT * FROM GAME WHERE SERVER=:server AND CHANNEL=:channel', {'server':1, 'channel':2}),
+    ('GAME_ACTIVITY', 'SELECT GUID, SERVER, CHANNEL FROM GAME WHERE ACTIVITY<:purge_time LIMIT :limit', {'purge_time':'2020-01-01', 'limit':100}),
+    ('GAME_OPTIONS_PARENT_KEY', 'SELECT GAME_OPTIONS.KEY, GAME_OPTIONS.VALUE FROM GAME_OPTIONS INNER JOIN GAME ON GAME_OPTIONS.PARENT_GUID=GAME.GUID WHERE GAME.SERVER=:server AND GAME.CHANNEL=:channel', {'server':1, 'channel':2}),
+    ('GAME_OPTIONS_PARENT_KEY', 'UPDATE GAME_OPTIONS SET VALUE=:value where KEY=:key and PARENT_GUID=:game_guid', {'value':'on', 'key':'best', 'game_guid':'a'}),
+    ('DIE_PARENT', 'SELECT * FROM DIE WHERE PARENT_GUID=:PARENT_GUID', {'PARENT_GUID':'a'}),
+    ('DICE_COLLECTION_PARENT_CATEGORY_GRP', 'SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category AND GRP=:group', {'PARENT_GUID':'a', 'category':'Stress', 'group':'Alice'}),
+    ('DICE_COLLECTION_PARENT_CATEGORY_GRP', 'SELECT * FROM DICE_COLLECTION WHERE PARENT_GUID=:PARENT_GUID AND CATEGORY=:category AND GRP IS NULL', {'PARENT_GUID':'a', 'category':'Complications'}),
+    ('RESOURCE_PARENT_CATEGORY', 'SELECT * FROM RESOURCE WHERE PARENT_GUID=? AND CATEGORY IN (?, ?) ORDER BY rowid', ('a', 'Plot points', 'XP'))
+]
+
+def create_database_from_before_activity(filename):
+    """Create a database as the bot left it before v1.0.1, with a row in every table."""
+
+    db = sqlite3.connect(filename, isolation_level=None)
+    db.execute('CREATE TABLE GAME (GUID VARCHAR(32) PRIMARY KEY, SERVER INT NOT NULL, CHANNEL INT NOT NULL)')
+    db.execute('CREATE TABLE GAME_OPTIONS (GUID VARCHAR(32) PRIMARY KEY, KEY VARCHAR(16) NOT NULL, VALUE VARCHAR(256), PARENT_GUID VARCHAR(32) NOT NULL)')
+    db.execute('CREATE TABLE DIE (GUID VARCHAR(32) PRIMARY KEY, NAME VARCHAR(64), SIZE INT NOT NULL, QTY INT NOT NULL, PARENT_GUID VARCHAR(32) NOT NULL)')
+    db.execute('CREATE TABLE DICE_COLLECTION (GUID VARCHAR(32) PRIMARY KEY, CATEGORY VARCHAR(64) NOT NULL, GRP VARCHAR(64), PARENT_GUID VARCHAR(32) NOT NULL)')
+    db.execute('CREATE TABLE RESOURCE (GUID VARCHAR(32) PRIMARY KEY, CATEGORY VARCHAR(64) NOT NULL, NAME VARCHAR(64) NOT NULL, QTY INT NOT NULL, PARENT_GUID VARCHAR(64) NOT NULL)')
+    db.execute("INSERT INTO GAME VALUES ('a', 1, 2)")
+    db.execute("INSERT INTO GAME_OPTIONS VALUES ('b', 'best', 'on', 'a')")
+    db.execute("INSERT INTO DICE_COLLECTION VALUES ('c', 'Stress', 'Alice', 'a')")
+    db.execute("INSERT INTO DIE VALUES ('d', 'Afraid', 8, 1, 'c')")
+    db.execute("INSERT INTO RESOURCE VALUES ('e', 'Plot points', 'Alice', 1, 'a')")
+    db.close()
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'cortexpal.db')
+
+    def assert_indexed(self):
+        db = sqlite3.connect(self.filename)
+        try:
+            for index, sql, parameters in HOT_QUERIES:
+                with self.subTest(sql=sql):
+                    plan = ' '.join(row[3] for row in db.execute('EXPLAIN QUERY PLAN ' + sql, parameters))
+                    self.assertIn('USING INDEX {0}'.format(index), plan)
+        finally:
+            db.close()
+
+    def test_new_database(self):
+        migrate.upgrade(self.filename)
+        self.assert_indexed()
+
+    def test_database_from_before_activity(self):
+        # Adding the ACTIVITY column and the foreign keys both rebuild tables, which drops the indexes they had.
+        create_database_from_before_activity(self.filename)
+        migrate.upgrade(self.filename, batch_size=2)
+        self.assert_indexed()
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'cortexpal.db')
+        create_database_from_before_activity(self.filename)
+        self.rebuilt = []
+        rebuild_table = migrate.Migrator.rebuild_table
+
+        def recording_rebuild_table(migrator, table, *args):
+            self.rebuilt.append(table)
+            if table == self.interrupt:
+                raise KeyboardInterrupt
+            rebuild_table(migrator, table, *args)
+
+        self.interrupt = None
+        patch = unittest.mock.patch.object(migrate.Migrator, 'rebuild_table', recording_rebuild_table)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_rebuilt_tables_are_not_copied_again(self):
+        self.interrupt = 'RESOURCE'
+        with self.assertRaises(KeyboardInterrupt):
+            migrate.upgrade(self.filename, batch_size=2)
+        self.assertEqual(self.rebuilt, ['GAME', 'GAME_OPTIONS', 'DICE_COLLECTION', 'RESOURCE'])
+        self.interrupt = None
+        self.rebuilt = []
+        migrate.upgrade(self.filename, batch_size=2)
+        self.assertEqual(self.rebuilt, ['RESOURCE', 'DIE'])
+        db = sqlite3.connect(self.filename)
+        try:
+            for table in ['GAME_OPTIONS', 'DICE_COLLECTION', 'RESOURCE', 'DIE']:
+                self.assertEqual(db.execute('SELECT COUNT(*) FROM {0}'.format(table)).fetchone()[0], 1)
+        finally:
+            db.close()
+        # Another upgrade has nothing left to do.
+        self.rebuilt = []
+        migrate.upgrade(self.filename)
+        self.assertEqual(self.rebuilt, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Check the exact odds in odds.py against every outcome of small pools."""
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import random
+import unittest
+
+import odds
+
+DIE_SIZES = [4, 6, 8, 10, 12]
+
+def brute_force(sizes):
+    """Roll every combination of faces for a list of die sizes, and tally the results with best_total()."""
+
+    outcomes = 0
+    totals = {}
+    effects = {}
+    botches = 0
+    for values in itertools.product(*[range(1, size + 1) for size in sizes]):
+        counts = {size: [0] * size for size in sizes}
+        for size, value in zip(sizes, values):
+            counts[size][value - 1] += 1
+        outcomes += 1
+        best = odds.best_total(counts)
+        if best is None:
+            botches += 1
+            continue
+        total_values, effect = best
+        totals[sum(total_values)] = totals.get(sum(total_values), 0) + 1
+        effects[effect] = effects.get(effect, 0) + 1
+    return outcomes, totals, effects, botches
+
+# The chi-square statistic that uniform faces exceed only one time in a thousand, for each die size (with one fewer degrees of freedom than faces).
+CHI_SQUARE_LIMITS = {4: 16.27, 6: 20.52, 8: 24.32, 10: 27.88, 12: 31.26}
+
+def chi_square(faces):
+    """Measure how far a list of face counts strays from every face being equally likely."""
+
+    expected = sum(faces) / len(faces)
+    return sum((count - expected) ** 2 / expected for count in faces)
+
+def count_faces(faces, size):
+    """Count how many times each face (counting from zero) appears in a block of faces."""
+
+    return [faces.count(face) for face in range(size)]
+
+def signature(sizes):
+    """Return the pool_odds() signature for a list of die sizes."""
+
+    return tuple((size, sizes.count(size)) for size in sorted(set(sizes)))
+
+class PoolOddsTest(unittest.TestCase):
+
+    def check(self, sizes):
+        with self.subTest(sizes=sizes):
+            pool_odds = odds.pool_odds(signature(sizes))
+            outcomes, totals, effects, botches = brute_force(sizes)
+            self.assertEqual(pool_odds.outcomes, outcomes)
+            self.assertEqual(pool_odds.totals, totals)
+            self.assertEqual(pool_odds.effects, effects)
+            self.assertEqual(pool_odds.botches, botches)
+
+    def test_every_pool_up_to_four_dice(self):
+        for qty in range(1, 5):
+            for sizes in itertools.combinations_with_replacement(DIE_SIZES, qty):
+                self.check(list(sizes))
+
+    def test_five_dice(self):
+        # Every size, ties in the total, ties in the effect, and dice too small to ever be the effect.
+        for sizes in [[4, 4, 4, 4, 4], [4, 4, 6, 6, 8], [4, 6, 8, 10, 12], [6, 6, 6, 6, 6], [8, 8, 8, 10, 10], [4, 4, 4, 12, 12], [6, 8, 10, 10, 12]]:
+            self.check(sizes)
+
+    def test_chances(self):
+        pool_odds = odds.pool_odds(((8, 2),))
+        self.assertAlmostEqual(pool_odds.chance_of_botch(), 1 / 64)
+        self.assertAlmostEqual(pool_odds.chance_of_hitch(), 1 - 49 / 64)
+        # 2D8 only beats 15 with two eights.
+        self.assertAlmostEqual(pool_odds.chance_to_beat(15), 1 / 64)
+
+class FaceTableTest(unittest.TestCase):
+
+    def test_every_byte_once(self):
+        # Each byte that survives rejection should land on the faces exactly evenly.
+        for size in DIE_SIZES:
+            with self.subTest(size=size):
+                faces = odds.bytes_to_faces(bytes(range(256)), odds.face_table(size))
+                self.assertEqual(len(faces) % size, 0)
+                self.assertEqual(count_faces(faces, size), [len(faces) // size] * size)
+
+    def test_chi_square(self):
+        block = random.Random('faces').randbytes(1000000)
+        for size in DIE_SIZES:
+            with self.subTest(size=size):
+                faces = count_faces(odds.bytes_to_faces(block, odds.face_table(size)), size)
+                self.assertLess(chi_square(faces), CHI_SQUARE_LIMITS[size])
+
+    def test_chi_square_catches_modulo_bias(self):
+        # Without rejection, a D10 favours its lower faces, which the test above would notice.
+        block = random.Random('faces').randbytes(1000000)
+        faces = count_faces(block.translate(odds.face_table(10)[0]), 10)
+        self.assertGreater(chi_square(faces), CHI_SQUARE_LIMITS[10])
+
+class SimulateTest(unittest.TestCase):
+    """Seeded simulations must give the same results however they run, so that results can be compared across versions."""
+
+    POOL = ((6, 1), (8, 2), (10, 1))
+    OPPONENTS = [None, 11, ((8, 2),)]
+
+    def tallies(self, simulation):
+        return vars(simulation)
+
+    def test_same_with_any_executor(self):
+        context = multiprocessing.get_context('spawn')
+        for opponent in self.OPPONENTS:
+            with self.subTest(opponent=opponent):
+                expected = self.tallies(odds.simulate(self.POOL, opponent, trials=10000, seed=1234, chunk_size=1000))
+                self.assertEqual(expected['trials'], 10000)
+                for workers in [1, 2, 3]:
+                    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+                        simulation = odds.simulate(self.POOL, opponent, trials=10000, seed=1234, executor=executor, chunk_size=1000)
+                    self.assertEqual(self.tallies(simulation), expected)
+
+    def test_different_seeds_differ(self):
+        first = odds.simulate(self.POOL, trials=5000, seed=1)
+        second = odds.simulate(self.POOL, trials=5000, seed=2)
+        self.assertNotEqual(self.tallies(first), self.tallies(second))
+
+    def test_budget_keeps_a_prefix(self):
+        # With no time to spare, only the first chunk is sure to be kept, and whatever is kept must be the start of the full run.
+        simulation = odds.simulate(self.POOL, 11, trials=20000, seed=99, chunk_size=2000, budget=0)
+        self.assertEqual(simulation.trials, 2000)
+        self.assertEqual(self.tallies(simulation), self.tallies(odds.simulate(self.POOL, 11, trials=2000, seed=99, chunk_size=2000)))
+        with concurrent.futures.ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            simulation = odds.simulate(self.POOL, 11, trials=20000, seed=99, executor=executor, chunk_size=2000, budget=0)
+        self.assertGreaterEqual(simulation.trials, 2000)
+        self.assertEqual(simulation.trials % 2000, 0)
+        self.assertEqual(self.tallies(simulation), self.tallies(odds.simulate(self.POOL, 11, trials=simulation.trials, seed=99, chunk_size=2000)))
+
+if __name__ == '__main__':
+    unittest.main()
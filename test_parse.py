@@ -0,0 +1,70 @@
+"""Check that parse_arguments() sorts command arguments exactly as the bot's original parsing did."""
+
+import random
+import unittest
+
+import CortexPal
+
+def original_separate_dice_and_name(inputs):
+    """The original separate_dice_and_name(), which matched each word and then built a Die from it."""
+
+    dice = []
+    words = []
+    for input in inputs:
+        if CortexPal.DICE_EXPRESSION.fullmatch(input):
+            dice.append(CortexPal.Die(input))
+        else:
+            words.append(input.lower().capitalize())
+    return {'dice': dice, 'name': ' '.join(words)}
+
+def original_separate_numbers_and_name(inputs):
+    """The original separate_numbers_and_name()."""
+
+    numbers = []
+    words = []
+    for input in inputs:
+        if input.isdecimal():
+            numbers.append(int(input))
+        else:
+            words.append(input.lower().capitalize())
+    return {'numbers': numbers, 'name': ' '.join(words)}
+
+# Pieces of words that make dice notations, numbers, and names, along with the awkward cases in between.
+PIECES = ['', '0', '1', '2', '4', '6', '8', '10', '12', '20', '007', '0d4', 'd', 'D', 'd8', '2d', 'x', 'amy', 'Bob', 'ÉCLAIR', ' ', '-', '٣', '²']
+
+def random_word(rng):
+    return ''.join(rng.choice(PIECES) for num in range(rng.randint(0, 3)))
+
+class ParseTest(unittest.TestCase):
+
+    def check(self, inputs):
+        with self.subTest(inputs=inputs):
+            original = original_separate_dice_and_name(inputs)
+            separated = CortexPal.separate_dice_and_name(inputs)
+            self.assertEqual([(die.size, die.qty) for die in separated['dice']], [(die.size, die.qty) for die in original['dice']])
+            self.assertEqual(separated['name'], original['name'])
+            self.assertEqual(CortexPal.separate_numbers_and_name(inputs), original_separate_numbers_and_name(inputs))
+            parsed = CortexPal.parse_arguments(tuple(inputs))
+            split_name = original['name'].split(' ', maxsplit=1)
+            self.assertEqual(parsed.name_head, split_name[0])
+            self.assertEqual(parsed.name_tail, split_name[1] if len(split_name) > 1 else None)
+
+    def test_awkward_words(self):
+        for inputs in [[], [''], ['0d4'], ['007'], ['0d4', '007', ''], ['d8', '2d10', '10', 'D12'], ['2d20'], ['amy', '', 'mental', '8'], ['٣d8', '²'], ['4', '04', '40']]:
+            self.check(inputs)
+
+    def test_random_words(self):
+        rng = random.Random('parse')
+        for trial in range(5000):
+            self.check([random_word(rng) for num in range(rng.randint(0, 5))])
+
+    def test_fresh_dice(self):
+        # Parses are cached, but the dice built from them are changed later, so each call needs dice of its own.
+        first = CortexPal.separate_dice_and_name(['2d8', 'fire'])['dice'][0]
+        second = CortexPal.separate_dice_and_name(['2d8', 'fire'])['dice'][0]
+        self.assertIsNot(first, second)
+        first.qty = 5
+        self.assertEqual(second.qty, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Run several processes against one shared database at once, with commands that conflict, and check that they all end up agreeing."""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import unittest
+
+from discord.ext import commands
+
+import CortexPal
+import migrate
+from test_bot import Context
+
+PROCESSES = 4
+COMMANDS = 60
+
+def run_commands(filename, seed, barrier, results):
+    """In one process, run random commands on a game that every process shares, then report what this process sees of the game."""
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    database = CortexPal.start_storage(CortexPal.SQLiteStorage(filename, shared=True, busy_timeout_ms=60000))
+    bot = commands.Bot(command_prefix=CortexPal.get_prefix, loop=loop)
+    cog = CortexPal.CortexPal(bot)
+    bot.add_cog(cog)
+    cog.purge_task.cancel()
+    ctx = Context(1, 1)
+    rng = random.Random(seed)
+    plot_points = 0
+    doom = 0
+    errors = []
+    barrier.wait()
+    for num in range(COMMANDS):
+        choice = rng.random()
+        name = 'fire{0}'.format(rng.randrange(3))
+        if choice < 0.3:
+            loop.run_until_complete(cog.pp(ctx, 'add', 'amy'))
+            plot_points += 1
+        elif choice < 0.45:
+            loop.run_until_complete(cog.pool(ctx, 'add', 'doom', '6'))
+            doom += 1
+        elif choice < 0.65:
+            loop.run_until_complete(cog.comp(ctx, 'add', rng.choice(['4', '6', '8']), name))
+        elif choice < 0.75:
+            loop.run_until_complete(cog.comp(ctx, 'stepup', name))
+        elif choice < 0.85:
+            loop.run_until_complete(cog.comp(ctx, 'remove', name))
+        elif choice < 0.92:
+            loop.run_until_complete(cog.option(ctx, 'best', rng.choice(['on', 'off'])))
+        else:
+            loop.run_until_complete(cog.roll(ctx, '8', '10'))
+        if ctx.sent[-1] == CortexPal.UNEXPECTED_ERROR:
+            errors.append(num)
+        if rng.random() < 0.3:
+            loop.run_until_complete(cog.info(ctx))
+    # Once everyone has finished, see what this process makes of the game.
+    barrier.wait()
+    loop.run_until_complete(cog.info(ctx))
+    results.put((seed, plot_points, doom, errors, ctx.sent[-1]))
+    cog.cog_unload()
+    loop.run_until_complete(asyncio.sleep(0))
+    database.close()
+    loop.close()
+
+class SharedDatabaseTest(unittest.TestCase):
+
+    def test_processes_converge(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        filename = os.path.join(directory.name, 'cortexpal.db')
+        migrate.upgrade(filename)
+        # Start each process afresh, rather than copying this one and its threads.
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(PROCESSES)
+        results = context.Queue()
+        processes = [context.Process(target=run_commands, args=(filename, seed, barrier, results)) for seed in range(PROCESSES)]
+        for process in processes:
+            process.start()
+        reports = [results.get(timeout=300) for process in processes]
+        for process in processes:
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+        for seed, plot_points, doom, errors, output in reports:
+            self.assertEqual(errors, [], 'Process {0} failed some commands.'.format(seed))
+        outputs = set(output for seed, plot_points, doom, errors, output in reports)
+        self.assertEqual(len(outputs), 1, 'The processes disagree:\n' + '\n'.join(outputs))
+        output = outputs.pop()
+        # Additions from every process must all count, whatever order they ran in.
+        self.assertIn('Amy: {0}\n'.format(sum(report[1] for report in reports)), output)
+        self.assertIn('Doom: {0}D6 \n'.format(sum(report[2] for report in reports)), output)
+
+if __name__ == '__main__':
+    unittest.main()